@@ -0,0 +1,70 @@
+import os
+from collections import OrderedDict
+
+import torch
+
+def _to_cpu(value):
+    if torch.is_tensor(value):
+        return value.cpu()
+    return tuple(_to_cpu(v) for v in value)
+
+def _nbytes(value):
+    if torch.is_tensor(value):
+        return value.element_size() * value.nelement()
+    return sum(_nbytes(v) for v in value)
+
+class AdjacencyCache:
+    '''
+    Memory-bounded LRU cache of per-jet adjacency matrices.
+
+    Entries are keyed by the index of a jet in its data file and hold the
+    activated matrix of the jet, dense or as an edge list, together with a
+    fingerprint of the jet (its size and the sum of its constituents) that is
+    checked on every hit, so that a stale or colliding entry is recomputed
+    rather than used. When the cache grows over max_bytes the least recently
+    used entries are dropped, or written to spill_dir and read back on demand.
+    '''
+    def __init__(self, max_bytes, namespace, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        self.spill_dir = spill_dir
+        if spill_dir is not None and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, '{}-{}.pt'.format(self.namespace, key))
+
+    def get(self, key, fingerprint):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.spill_dir is not None and os.path.exists(self._spill_path(key)):
+            entry = torch.load(self._spill_path(key))
+            self._insert(key, entry)
+
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, fingerprint, value):
+        if key in self.entries:
+            self.n_bytes -= _nbytes(self.entries.pop(key)[1])
+        self._insert(key, (fingerprint, value))
+
+    def _insert(self, key, entry):
+        self.entries[key] = entry
+        self.n_bytes += _nbytes(entry[1])
+        while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.n_bytes -= _nbytes(old_entry[1])
+            if self.spill_dir is not None:
+                torch.save((old_entry[0], _to_cpu(old_entry[1])), self._spill_path(old_key))
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,20 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
 
 from .simple._adjacency import _Adjacency
+from .simple.pairwise_features import PairwiseFeatures
 from .simple import SIMPLE_ADJACENCIES
 
 from src.monitors import Collect
 
+_thread_pools = {}
+
+def thread_pool(n_threads):
+    if n_threads not in _thread_pools:
+        _thread_pools[n_threads] = ThreadPoolExecutor(max_workers=n_threads)
+    return _thread_pools[n_threads]
+
+def weighted_sum(components, weights):
+    '''
+    sum_k weights[k] * components[k] over the (k, component) pairs of
+    components, in the order they come: the output is allocated once, by
+    the first component to finish, and every other one is accumulated into
+    it in place as soon as it is ready, so that no component waits on the
+    others to be released. weights are floats, or the entries of a tensor
+    of learned weights.
+    '''
+    out = None
+    for k, M in components:
+        if out is None:
+            out = M * weights[k]
+        elif torch.is_tensor(weights[k]):
+            out.addcmul_(M, weights[k])
+        else:
+            out.add_(M, alpha=weights[k])
+    return out
+
 class ComboAdjacency(_Adjacency):
     def __init__(self, **kwargs):
         super().__init__(name='combo'+kwargs.get('index', 'ls'),**kwargs)
 
-    def initialize(self, adj_list=None, **kwargs):
+    def initialize(self, adj_list=None, combo_threads=0, **kwargs):
         super().initialize(**kwargs)
         kwargs.pop('name')
+        self.combo_threads = combo_threads
         self.adjs = nn.ModuleList()
         #self.n_adjs = len(self.adjs)
         for adj in adj_list:
@@ -34,14 +64,26 @@ class ComboAdjacency(_Adjacency):
         ]
         self.monitors.extend(self.component_monitors)
 
+    def components(self, fn):
+        ''' Yields (k, fn(self.adjs[k])) for every adjacency, on combo_threads
+        CPU threads if set, in which case in the order they finish.
+        '''
+        if self.combo_threads <= 1 or len(self.adjs) <= 1:
+            for k, adj in enumerate(self.adjs):
+                yield k, fn(adj)
+            return
+        # grad mode is thread local: run every component under the caller's
+        grad_enabled = torch.is_grad_enabled()
+        def run(k, adj):
+            with torch.set_grad_enabled(grad_enabled):
+                return k, fn(adj)
+        pool = thread_pool(self.combo_threads)
+        for future in as_completed([pool.submit(run, k, adj) for k, adj in enumerate(self.adjs)]):
+            yield future.result()
+
     def forward(self, h, mask, **kwargs):
-        # raw matrix
-        combo = Variable(torch.zeros(h.size()[0], h.size()[1], h.size()[1]))
-        if torch.cuda.is_available():
-            combo = combo.cuda()
-        for adj, weight in zip(self.adjs, self.weights):
-            M = adj(h, mask, **kwargs)
-            combo += M * weight
+        pairwise = PairwiseFeatures(h)
+        combo = weighted_sum(self.components(lambda adj: adj(h, mask, pairwise=pairwise, **kwargs)), self.weights)
 
         #if self.symmetric:
         #    M = 0.5 * (M + M.transpose(1, 2))
@@ -53,6 +95,19 @@ class ComboAdjacency(_Adjacency):
             self.logging(dij=combo, mask=mask, **kwargs)
         return combo
 
+    def check_packed(self):
+        for adj in self.adjs:
+            adj.check_packed()
+            if adj.sparse:
+                option = 'knn' if getattr(adj, 'knn', None) is not None else 'radius'
+                raise ValueError("{} cannot be used with a combination of adjacencies and engine='packed'".format(option))
+
+    def packed(self, h, batch, **kwargs):
+        return super().packed(h, batch, pairwise=PairwiseFeatures(h), **kwargs)
+
+    def edge_forward(self, h, batch, edges=None, pairwise=None, **kwargs):
+        return weighted_sum(self.components(lambda adj: adj.edge_forward(h, batch, edges=edges, pairwise=pairwise, **kwargs)), self.weights)
+
     def logging(self, **kwargs):
         super().logging(**kwargs)
         if kwargs.get('epoch', None) is not None and kwargs.get('iters', None) == 0:
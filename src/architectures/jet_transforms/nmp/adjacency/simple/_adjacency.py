@@ -1,8 +1,16 @@
+import threading
+
 import torch
 import torch.nn as nn
 from src.monitors import Histogram
 from src.monitors import BatchMatrixMonitor
 from .matrix_activation import MATRIX_ACTIVATIONS
+from .matrix_activation import EDGE_ACTIVATIONS
+from .matrix_activation import no_edge_softmax
+
+# the components of a ComboAdjacency may log from its thread pool, and the
+# monitors plot through the global state of pyplot
+logging_lock = threading.Lock()
 
 class _Adjacency(nn.Module):
     def __init__(self, **kwargs):
@@ -16,10 +24,27 @@ class _Adjacency(nn.Module):
             self.set_monitors()
             self.initialize_monitors(logger, logging_frequency)
 
-    def initialize(self, name=None, symmetric=None, activation=None, **kwargs):
+    def initialize(self, name=None, symmetric=None, activation=None, pairwise_chunk=None, **kwargs):
         self.name = name
+        self.pairwise_chunk = pairwise_chunk
         self.symmetric = symmetric
+        self.activation_name = activation
         self.activation = MATRIX_ACTIVATIONS[activation]
+        self.edge_activation = EDGE_ACTIVATIONS[activation]
+
+    @property
+    def sparse(self):
+        ''' Whether select_edges prunes the within-jet edges.
+        '''
+        return False
+
+    def check_packed(self):
+        ''' Raise a ValueError naming the option that rules out the packed engine.
+        '''
+        if self.edge_activation is no_edge_softmax:
+            raise ValueError("activation='{}' normalises over padding and has no packed equivalent, use engine='dense'".format(self.activation_name))
+        if type(self).raw_edges is _Adjacency.raw_edges and type(self).edge_forward is _Adjacency.edge_forward:
+            raise ValueError("matrix='{}' has no packed implementation, use engine='dense'".format(self.name))
 
 
     def set_monitors(self):
@@ -34,9 +59,16 @@ class _Adjacency(nn.Module):
     def raw_matrix(self, h):
         pass
 
-    def forward(self, h, mask, **kwargs):
+    def shared_raw_matrix(self, h, pairwise):
+        ''' raw_matrix reading the PairwiseFeatures of h that a ComboAdjacency
+        shares between its components. Only adjacencies built on such features
+        override it.
+        '''
+        return self.raw_matrix(h)
+
+    def forward(self, h, mask, pairwise=None, **kwargs):
         #import ipdb; ipdb.set_trace()
-        M = self.raw_matrix(h)
+        M = self.raw_matrix(h) if pairwise is None else self.shared_raw_matrix(h, pairwise)
 
         if self.symmetric:
             M = 0.5 * (M + M.transpose(1, 2))
@@ -47,7 +79,53 @@ class _Adjacency(nn.Module):
 
 
         if self.monitoring:
-            self.logging(dij=M, mask=mask, **kwargs)
+            with logging_lock:
+                self.logging(dij=M, mask=mask, **kwargs)
+
+        return M
+
+    def raw_edges(self, h, rows, cols):
+        raise NotImplementedError('{} has no packed implementation'.format(type(self).__name__))
+
+    def shared_raw_edges(self, h, rows, cols, pairwise):
+        return self.raw_edges(h, rows, cols)
+
+    def select_edges(self, h, batch, pairwise=None):
+        ''' Edges (rows, cols) on which the packed adjacency is evaluated,
+        sorted by row then column. All pairs of nodes of a same jet by default.
+        '''
+        return batch.edges
+
+    def packed(self, h, batch, pairwise=None, **kwargs):
+        ''' Edges of the packed adjacency and its values on them.
+        '''
+        edges = self.select_edges(h, batch, pairwise)
+        return edges, self.edge_forward(h, batch, edges=edges, pairwise=pairwise, **kwargs)
+
+    def edge_forward(self, h, batch, edges=None, pairwise=None, **kwargs):
+        '''
+        Packed counterpart of forward: the values of the adjacency matrix on
+        the edges of the block-diagonal graph of a RaggedJetBatch, where h
+        holds one row per real node. edges defaults to all within-jet pairs.
+        '''
+        if edges is None:
+            edges = batch.edges
+        rows, cols = edges
+        if pairwise is None:
+            raw_edges = self.raw_edges
+        else:
+            raw_edges = lambda h, rows, cols: self.shared_raw_edges(h, rows, cols, pairwise)
+        M = raw_edges(h, rows, cols)
+
+        if self.symmetric:
+            if edges is batch.edges:
+                M = 0.5 * (M + M[batch.edge_transpose])
+            else:
+                # a pruned edge set need not contain the reverse edges
+                M = 0.5 * (M + raw_edges(h, cols, rows))
+
+        if self.edge_activation is not None:
+            M = self.edge_activation(M, rows, len(h))
 
         return M
 
@@ -21,6 +21,9 @@ class Ones(_Adjacency):
         #    return matrix
         #return mask * matrix
 
+    def raw_edges(self, vertices, rows, cols):
+        return vertices.new_ones(len(rows))
+
 class Eye(_Adjacency):
     def __init__(self, index='',**kwargs):
         kwargs.pop('symmetric', None)
@@ -38,6 +41,9 @@ class Eye(_Adjacency):
         #    return matrix
         #return mask * matrix
 
+    def raw_edges(self, vertices, rows, cols):
+        return (rows == cols).float()
+
 CONSTANT_ADJACENCIES = dict(
     one=Ones,
     eye=Eye
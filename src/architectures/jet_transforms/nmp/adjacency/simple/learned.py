@@ -2,6 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from src.architectures.embedding import EMBEDDINGS
+from src.architectures.utils import linear_pair_scores, pairwise_distance
 from ._adjacency import _Adjacency
 
 class Sum(_Adjacency):
@@ -13,13 +14,21 @@ class Sum(_Adjacency):
         if kwargs['wn']:
             self.edge_embedding = nn.utils.weight_norm(self.edge_embedding, name='weight')
 
+    def node_scores(self, h):
+        # w . (h_i + h_j) + b = (w . h_i + b) + (w . h_j + b) - b, so the
+        # pairs only need one projection per node (through the module, which
+        # keeps weight norm in charge of the weight)
+        return self.edge_embedding(h).squeeze(-1)
+
     def raw_matrix(self, h):
-        shp = h.size()
-        h_l = h.view(shp[0], shp[1], 1, shp[2])
-        h_r = h.view(shp[0], 1, shp[1], shp[2])
-        A = self.edge_embedding(h_l + h_r).squeeze(-1)
+        s = self.node_scores(h)
+        A = s.unsqueeze(2) + s.unsqueeze(1) - self.edge_embedding.bias
         return -A
 
+    def raw_edges(self, h, rows, cols):
+        s = self.node_scores(h)
+        return -(s[rows] + s[cols] - self.edge_embedding.bias)
+
 
 class DistMult(_Adjacency):
     def __init__(self, dim_in, index='', **kwargs):
@@ -35,6 +44,17 @@ class DistMult(_Adjacency):
         A = torch.matmul(h, torch.matmul(self.matrix, h.transpose(1,2)))
         return A
 
+    def raw_edges(self, h, rows, cols):
+        return (h[rows] * torch.matmul(h, self.matrix.t())[cols]).sum(-1)
+
+    def shared_raw_matrix(self, h, pairwise):
+        return torch.matmul(h, torch.matmul(self.matrix, pairwise.transposed))
+
+    def shared_raw_edges(self, h, rows, cols, pairwise):
+        # h_i M h_j on the gathered ends shared with the other components
+        h_rows, h_cols = pairwise.edge_nodes(rows, cols)
+        return (torch.matmul(h_rows, self.matrix) * h_cols).sum(-1)
+
 
 class Attentional(_Adjacency):
     def __init__(self, dim_in, dim_out=None, index='', **kwargs):
@@ -47,11 +67,9 @@ class Attentional(_Adjacency):
 
     def forward(self, h=None, **kwargs):
         h = self.embedding(h)
-        shp = h.size()
-        h_i = h.view(shp[0], shp[1], 1, shp[2]).repeat(1, 1, shp[1], 1)
-        h_j = h.view(shp[0], 1, shp[1], shp[2]).repeat(1, shp[1], 1, 1)
-        h_cat = torch.cat([h_i,h_j], 3)
-        e_ij = torch.sum(h_cat * self.a, 3)
+        # a . [h_i, h_j] = a_i . h_i + a_j . h_j
+        a_i, a_j = self.a.view(-1).chunk(2)
+        e_ij = linear_pair_scores(h, a_i, a_j)
 
         return e_ij
 
@@ -62,11 +80,23 @@ class Siamese(_Adjacency):
         #self.softmax = PaddedMatrixSoftmax()
 
     def raw_matrix(self, h):
-        shp = h.size()
-        h_l = h.view(shp[0], shp[1], 1, shp[2])
-        h_r = h.view(shp[0], 1, shp[1], shp[2])
-        A = torch.norm(h_l - h_r, 2, 3)
+        A = pairwise_distance(h, self.pairwise_chunk)
         return -A
+
+    def raw_edges(self, h, rows, cols):
+        return -torch.norm(h[rows] - h[cols], 2, 1)
+
+    def shared_raw_matrix(self, h, pairwise):
+        # ||h_i - h_j||^2 = h_i . h_i + h_j . h_j - 2 h_i . h_j from the shared
+        # gram matrix; pairs at zero distance get a zero gradient
+        n = pairwise.squared_norms
+        squared = n.unsqueeze(-1) + n.unsqueeze(-2) - 2 * pairwise.gram
+        positive = squared > 0
+        return -torch.where(positive, torch.where(positive, squared, torch.ones_like(squared)).sqrt(), torch.zeros_like(squared))
+
+    def shared_raw_edges(self, h, rows, cols, pairwise):
+        h_rows, h_cols = pairwise.edge_nodes(rows, cols)
+        return -torch.norm(h_rows - h_cols, 2, 1)
         #A = F.sigmoid(A)
         #if mask is None:
         #    return A
@@ -1,6 +1,8 @@
 import torch
 import torch.nn.functional as F
 
+from src.architectures.utils import segment_softmax
+
 
 def padded_matrix_softmax(matrix, mask):
     '''
@@ -39,3 +41,27 @@ MATRIX_ACTIVATIONS = {
     'tanh': masked_function(F.tanh),
     'no_mask_softmax': no_mask_softmax
 }
+
+def edge_softmax(values, rows, n_nodes):
+    '''
+    Packed counterpart of padded_matrix_softmax: softmax of the edge values
+    over the edges of each row, i.e. over the real neighbours of each node.
+    '''
+    return segment_softmax(values, rows, n_nodes)
+
+def edge_function(fn):
+    def edge(values, rows, n_nodes):
+        return fn(values)
+    return edge
+
+def no_edge_softmax(values, rows, n_nodes):
+    raise NotImplementedError('no_mask_softmax normalises over padding and has no packed equivalent')
+
+EDGE_ACTIVATIONS = {
+    'mask': edge_function(lambda x: x),
+    'soft': edge_softmax,
+    'sigmoid': edge_function(F.sigmoid),
+    'exp': edge_function(lambda x: torch.exp(x)),
+    'tanh': edge_function(F.tanh),
+    'no_mask_softmax': no_edge_softmax
+}
@@ -0,0 +1,69 @@
+import threading
+
+import torch
+
+from .physics import compute_pairwise_delta_r, compute_delta_r
+
+class PairwiseFeatures:
+    '''
+    Pairwise quantities of one batch of nodes p, computed on first use and
+    shared between the components of a ComboAdjacency, so that e.g. the
+    delta_r of every pair of constituents is only computed once for all the
+    physics adjacencies of a combination:
+        delta_r <- (delta_eta, delta_phi) distances, for the physics adjacencies
+        transposed <- the (B, F, N) right operand of h_i . h_j and h_i M h_j,
+            for the gram and the distmult adjacency
+        gram <- h_i . h_j, for the distances of the siamese adjacency
+        edge_nodes <- the rows p[rows] and p[cols] of the two ends of every
+            edge, which all the packed components gather
+
+    p is either a padded (B, N, F) batch, for the dense entries, or the
+    (n_nodes, F) nodes of a packed batch, for the edge_ entries.
+    '''
+    def __init__(self, p):
+        self.p = p
+        self._cache = {}
+        # components may run on several threads, see ComboAdjacency.components;
+        # reentrant, as entries are built from other entries
+        self._lock = threading.RLock()
+
+    def _cached(self, key, fn):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = fn()
+            return self._cache[key]
+
+    @property
+    def delta_r(self):
+        return self._cached('delta_r', lambda: compute_pairwise_delta_r(self.p))
+
+    @property
+    def transposed(self):
+        return self._cached('transposed', lambda: self.p.transpose(-1, -2).contiguous())
+
+    @property
+    def gram(self):
+        return self._cached('gram', lambda: torch.matmul(self.p, self.transposed))
+
+    @property
+    def squared_norms(self):
+        return self._cached('squared_norms', lambda: torch.diagonal(self.gram, dim1=-2, dim2=-1))
+
+    def _cached_edges(self, name, rows, cols, fn):
+        # keyed by the edge tensors themselves, which the entry keeps alive
+        return self._cached((name, id(rows), id(cols)), lambda: (rows, cols, fn()))[-1]
+
+    def edge_nodes(self, rows, cols):
+        return self._cached_edges('edge_nodes', rows, cols, lambda: (self.p[rows], self.p[cols]))
+
+    def edge_delta_r(self, rows, cols):
+        def fn():
+            p_rows, p_cols = self.edge_nodes(rows, cols)
+            return compute_delta_r(p_rows[:, :3] + 1e-10, p_cols[:, :3] + 1e-10)
+        return self._cached_edges('edge_delta_r', rows, cols, fn)
+
+    def edge_gram(self, rows, cols):
+        def fn():
+            p_rows, p_cols = self.edge_nodes(rows, cols)
+            return (p_rows * p_cols).sum(-1)
+        return self._cached_edges('edge_gram', rows, cols, fn)
@@ -1,10 +1,13 @@
 import math
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
+from scipy.spatial import cKDTree
 
-from ._adjacency import _Adjacency
+from ._adjacency import _Adjacency, logging_lock
+from ..cache import AdjacencyCache
 
 
 def construct_physics_adjacency(alpha=None, R=None, trainable_physics=False):
@@ -16,24 +19,120 @@ def construct_physics_adjacency(alpha=None, R=None, trainable_physics=False):
         return FixedPhysicsAdjacency(alpha=alpha, R=R)
 
 
-def compute_dij(p, alpha, R):
-    p1 = p.unsqueeze(1) + 1e-10
-    p2 = p.unsqueeze(2) + 1e-10
+def compute_delta_r(p_i, p_j):
+    ''' Distance in (eta, phi) between rows of p_i and p_j, with phi wrapped around.
+    '''
+    delta_eta = p_j[...,1] - p_i[...,1]
 
-    delta_eta = p1[:,:,:,1] - p2[:,:,:,1]
-
-    delta_phi = p1[:,:,:,2] - p2[:,:,:,2]
+    delta_phi = p_j[...,2] - p_i[...,2]
     delta_phi = torch.remainder(delta_phi + math.pi, 2*math.pi) - math.pi
 
     delta_r = (delta_phi**2 + delta_eta**2)**0.5
 
-    dij = torch.min(p1[:,:,:,0]**(2.*alpha), p2[:,:,:,0]**(2.*alpha)) * delta_r / R
+    return delta_r
+
+def compute_pairwise_delta_r(p):
+    ''' (B, N, N) delta_r between all pairs of nodes of a padded batch p.
+    '''
+    p = p[..., :3] + 1e-10
+    return compute_delta_r(p.unsqueeze(2), p.unsqueeze(1))
+
+def compute_edge_delta_r(p, rows, cols):
+    ''' delta_r on the edges (rows, cols) of a packed batch of nodes p.
+    '''
+    # only gather the (p, eta, phi) columns for each edge
+    p = p[:, :3] + 1e-10
+    return compute_delta_r(p[rows], p[cols])
+
+def compute_dij(p, alpha, R, delta_r=None):
+    if delta_r is None:
+        delta_r = compute_pairwise_delta_r(p)
+
+    # the momentum term only depends on one node: raise it to the power once per node
+    pt = (p[..., 0] + 1e-10) ** (2.*alpha)
+    dij = torch.min(pt.unsqueeze(1), pt.unsqueeze(2)) * delta_r / R
+
+    return dij
+
+def compute_edge_dij(p, rows, cols, alpha, R, delta_r=None):
+    ''' compute_dij on the edges (rows, cols) of a packed batch of nodes p.
+    '''
+    if delta_r is None:
+        delta_r = compute_edge_delta_r(p, rows, cols)
+
+    pt = (p[:, 0] + 1e-10) ** (2.*alpha)
+    dij = torch.min(pt[cols], pt[rows]) * delta_r / R
 
     return dij
 
+def periodic_tree(p, batch, reach=None):
+    '''
+    One periodic KD-tree in (eta, phi) over the nodes of a packed batch: phi
+    is periodic with period 2 pi and jets are moved apart along eta by more
+    than reach, the largest distance the tree is queried at, so that they
+    never see each other. reach defaults to the diameter of a jet.
+    Returns the tree and the jet of every node.
+    '''
+    points = p[:, 1:3].detach().cpu().double().numpy() + 1e-10
+    jet = batch.segment_ids.cpu().numpy()
+    eta_span = points[:, 0].max() - points[:, 0].min() if len(points) > 0 else 0.
+    if reach is None:
+        reach = math.hypot(eta_span, math.pi)
+    points = np.stack([points[:, 0] + jet * (eta_span + reach + 1), np.mod(points[:, 1], 2 * math.pi)], 1)
+    return cKDTree(points, boxsize=[0, 2 * math.pi]), jet
+
+def knn_edges(p, batch, k):
+    '''
+    Every node and its k nearest nodes of the same jet in (eta, phi), itself
+    included, or all the nodes of its jet if there are no more than k, from
+    k-nearest-neighbour queries on periodic_tree.
+    '''
+    tree, jet = periodic_tree(p, batch)
+    n = tree.n
+    if n == 0:
+        return batch.edges
+    k = min(k, n)
+    # the nodes of the other jets come after all those of the same jet
+    cols = tree.query(tree.data, k=k)[1].reshape(n, k)
+    rows = np.repeat(np.arange(n), k).reshape(n, k)
+    keep = jet[rows] == jet[cols]
+    rows, cols = rows[keep], cols[keep]
+    return sort_edges(torch.from_numpy(rows).to(p.device), torch.from_numpy(cols).to(p.device))
+
+def radius_edges(p, batch, radius):
+    '''
+    All pairs of nodes of a same jet within radius in (eta, phi), self-pairs
+    included, from one pair query on periodic_tree.
+    '''
+    tree, jet = periodic_tree(p, batch, radius)
+    pairs = tree.query_pairs(radius, output_type='ndarray')
+    nodes = np.arange(tree.n)
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1], nodes])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0], nodes])
+    return sort_edges(torch.from_numpy(rows).to(p.device), torch.from_numpy(cols).to(p.device))
+
+def sort_edges(rows, cols):
+    order = torch.sort(cols, stable=True)[1]
+    order = order[torch.sort(rows[order], stable=True)[1]]
+    return rows[order], cols[order]
+
 class _PhysicsAdjacency(_Adjacency):
-    def __init__(self,**kwargs):
+    '''
+    With knn or radius set, each node only exchanges messages with its
+    neighbours: its knn nearest nodes in (eta, phi), or the nodes within
+    radius. They are found with a KD-tree and only exist in the packed
+    engine, which evaluates and normalises the adjacency on these edges
+    only: the dense engine would compute, then mask, every pair of nodes.
+    '''
+    def __init__(self, knn=None, radius=None, **kwargs):
         super().__init__(**kwargs)
+        assert knn is None or radius is None
+        self.knn = knn
+        self.radius = radius
+
+    @property
+    def sparse(self):
+        return self.knn is not None or self.radius is not None
 
     @property
     def alpha(self):
@@ -49,9 +148,37 @@ class _PhysicsAdjacency(_Adjacency):
         #import ipdb; ipdb.set_trace()
         return -dij
 
+    def shared_raw_matrix(self, p, pairwise):
+        return -compute_dij(p, self.alpha, self.R, delta_r=pairwise.delta_r)
+
+    def raw_edges(self, p, rows, cols):
+        return -compute_edge_dij(p, rows, cols, self.alpha, self.R)
+
+    def shared_raw_edges(self, p, rows, cols, pairwise):
+        return -compute_edge_dij(p, rows, cols, self.alpha, self.R, delta_r=pairwise.edge_delta_r(rows, cols))
+
+    def forward(self, p, mask, pairwise=None, **kwargs):
+        if self.sparse:
+            raise ValueError("knn and radius neighbourhoods are only computed by engine='packed'")
+        return super().forward(p, mask, pairwise=pairwise, **kwargs)
+
+    def select_edges(self, p, batch, pairwise=None):
+        if self.knn is not None:
+            return knn_edges(p, batch, self.knn)
+        if self.radius is not None:
+            return radius_edges(p, batch, self.radius)
+        return batch.edges
+
 
 class FixedPhysicsAdjacency(_PhysicsAdjacency):
-    def __init__(self, alpha=None, R=None,index='',**kwargs):
+    '''
+    With no trainable parameters, the activated matrix of a jet only depends
+    on the jet itself. Given adjacency_cache (in MB), matrices are cached
+    across batches and epochs, keyed by jet index; see AdjacencyCache. The
+    cache is only used for batches whose indices are set, i.e. not altered
+    by data augmentation.
+    '''
+    def __init__(self, alpha=None, R=None,index='', adjacency_cache=None, adjacency_cache_dir=None, **kwargs):
         name='phy'+index
         super().__init__(name=name, **kwargs)
         self._alpha = Variable(torch.FloatTensor([alpha]))
@@ -60,6 +187,12 @@ class FixedPhysicsAdjacency(_PhysicsAdjacency):
             self._alpha = self._alpha.cuda()
             self._R = self._R.cuda()
 
+        self.cache = None
+        if adjacency_cache:
+            namespace = '{}-alpha{}-R{}-knn-delta-r{}-radius{}-{}-{}'.format(
+                name, alpha, R, self.knn, self.radius, kwargs.get('activation'), 'sym' if kwargs.get('symmetric') else 'asym')
+            self.cache = AdjacencyCache(int(adjacency_cache * 2**20), namespace, adjacency_cache_dir)
+
     @property
     def alpha(self):
         return self._alpha
@@ -68,6 +201,59 @@ class FixedPhysicsAdjacency(_PhysicsAdjacency):
     def R(self):
         return self._R
 
+    def cached(self, kind, batch):
+        if self.cache is None or batch is None or batch.indices is None:
+            return None
+        return [self.cache.get('{}{}'.format(kind, i), f) for i, f in zip(batch.indices, batch.fingerprints)]
+
+    def forward(self, p, mask, batch=None, **kwargs):
+        blocks = self.cached('dense', batch)
+        if blocks is None:
+            return super().forward(p, mask, **kwargs)
+
+        lengths = batch.lengths.tolist()
+        if any(block is None for block in blocks):
+            M = super().forward(p, mask, **kwargs)
+            for b, (i, f, n, block) in enumerate(zip(batch.indices, batch.fingerprints, lengths, blocks)):
+                if block is None:
+                    self.cache.put('dense{}'.format(i), f, M[b, :n, :n].detach())
+            return M
+
+        M = p.new_zeros(p.size()[0], p.size()[1], p.size()[1])
+        for b, (n, block) in enumerate(zip(lengths, blocks)):
+            M[b, :n, :n] = block
+        if self.monitoring:
+            with logging_lock:
+                self.logging(dij=M, mask=mask, **kwargs)
+        return M
+
+    def packed(self, p, batch, **kwargs):
+        entries = self.cached('packed', batch)
+        if entries is None:
+            return super().packed(p, batch, **kwargs)
+
+        # without neighbourhood selection the edges are the same for every
+        # batch, only the values need to be cached
+        sparse = self.knn is not None or self.radius is not None
+        offsets = batch.offsets.tolist()
+        if any(entry is None for entry in entries):
+            (rows, cols), dij = super().packed(p, batch, **kwargs)
+            # edges are sorted by row, so the edges of a jet are contiguous
+            counts = torch.bincount(batch.segment_ids[rows], minlength=len(batch)).tolist()
+            per_jet = zip(torch.split(rows, counts), torch.split(cols, counts), torch.split(dij.detach(), counts))
+            for i, f, offset, entry, (r, c, d) in zip(batch.indices, batch.fingerprints, offsets, entries, per_jet):
+                if entry is None:
+                    value = ((r - offset).int(), (c - offset).int(), d) if sparse else (d,)
+                    self.cache.put('packed{}'.format(i), f, value)
+            return (rows, cols), dij
+
+        dij = torch.cat([entry[-1].to(p.device) for entry in entries])
+        if not sparse:
+            return batch.edges, dij
+        rows = torch.cat([entry[0].to(p.device).long() + offset for entry, offset in zip(entries, offsets)])
+        cols = torch.cat([entry[1].to(p.device).long() + offset for entry, offset in zip(entries, offsets)])
+        return (rows, cols), dij
+
 
 class TrainablePhysicsAdjacency(_PhysicsAdjacency):
     def __init__(self, alpha_init=0, R_init=0,index='',**kwargs):
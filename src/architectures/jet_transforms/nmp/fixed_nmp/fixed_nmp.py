@@ -16,6 +16,7 @@ from ..message_passing import MP_LAYERS
 from ..adjacency import construct_adjacency
 from .....architectures.readout import READOUTS
 from .....architectures.embedding import EMBEDDINGS
+from .....architectures.utils import sparse_adjacency, checkpointed_layers, segment_sum
 
 from .....monitors import Histogram
 from .....monitors import Collect
@@ -30,12 +31,23 @@ class FixedNMP(nn.Module):
         matrix=None,
         emb_init=None,
         mp_layer=None,
+        engine='dense',
+        checkpoint_mp=0,
+        early_exit=None,
+        masked_readout=False,
         **kwargs
         ):
 
         super().__init__()
 
         self.iters = iters
+        self.engine = engine
+        # the packed readout only sees real nodes, the dense one averages over
+        # the padding as well unless asked otherwise
+        self.masked_readout = masked_readout or engine == 'packed'
+        self.checkpoint_mp = checkpoint_mp
+        self.early_exit = early_exit
+        self.depths = None
 
         emb_kwargs = {x: kwargs[x] for x in ['act', 'wn']}
         self.embedding = EMBEDDINGS['n'](dim_in=features, dim_out=hidden, n_layers=int(emb_init), **emb_kwargs)
@@ -49,12 +61,129 @@ class FixedNMP(nn.Module):
 
         self.adjacency_matrix = construct_adjacency(matrix=matrix, dim_in=features, dim_out=hidden, **kwargs)
 
-    def forward(self, jets, mask=None, **kwargs):
+        if engine == 'packed':
+            self.check_packed(mp_layer, readout)
+        elif self.adjacency_matrix.sparse:
+            raise ValueError("knn and radius neighbourhoods are only computed by engine='packed'")
+
+    def check_packed(self, mp_layer, readout):
+        '''
+        Reject at construction, rather than at the first forward, the options
+        that have no packed implementation.
+        '''
+        if not MP_LAYERS[mp_layer].packed:
+            raise ValueError("mp_layer='{}' has no packed implementation, use engine='dense'".format(mp_layer))
+        if not READOUTS[readout].packed:
+            raise ValueError("readout='{}' has no packed implementation, use engine='dense'".format(readout))
+        self.adjacency_matrix.check_packed()
+
+    def forward(self, jets, mask=None, node_mask=None, **kwargs):
+        if self.engine == 'packed':
+            return self.forward_packed(jets, **kwargs)
 
         h = self.embedding(jets)
         dij = self.adjacency_matrix(jets, mask=mask, **kwargs)
-        for mp in self.mp_layers:
-            h = mp(h=h, mask=mask, dij=dij, **kwargs)
-        out = self.readout(h)
+        if self.adaptive_depth:
+            h = self.early_exit_layers(h, mask, dij, node_mask, **kwargs)
+        else:
+            step = lambda mp, h: mp(h=h, mask=mask, dij=dij, **kwargs)
+            h = checkpointed_layers(step, self.mp_layers, h, self.checkpoint_mp)
+        if node_mask is None or not self.masked_readout:
+            out = self.readout(h)
+        else:
+            out = self.readout(h, mask=node_mask)
 
         return out
+
+    def forward_packed(self, batch, **kwargs):
+        '''
+        Run the same weights on a RaggedJetBatch packed as one block-diagonal
+        graph: nodes are the rows of batch.nodes, the adjacency is evaluated on
+        the sum(n_i^2) within-jet edges only, or on the neighbourhoods selected
+        by a sparse adjacency, and messages are summed with a
+        sparse matrix product, so the cost follows the size of each jet rather than that
+        of the largest jet of the batch.
+        '''
+        jets = batch.nodes
+        h = self.embedding(jets)
+        edges, dij = self.adjacency_matrix.packed(jets, batch, **kwargs)
+        if self.adaptive_depth:
+            h = self.early_exit_packed(h, edges, dij, batch)
+        else:
+            adjacency = sparse_adjacency(dij, *edges, len(jets))
+            step = lambda mp, h: mp.forward_packed(h=h, adjacency=adjacency)
+            h = checkpointed_layers(step, self.mp_layers, h, self.checkpoint_mp)
+        out = self.readout.forward_packed(h, batch)
+
+        return out
+
+    @property
+    def adaptive_depth(self):
+        return self.early_exit is not None and not self.training
+
+    def early_exit_layers(self, h, mask, dij, node_mask=None, **kwargs):
+        '''
+        Inference with adaptive depth: after each layer, the jets whose hidden
+        state changed by less than early_exit, relative to its norm over the
+        real nodes of the jet, are frozen and dropped from the batch, so the
+        next layers only run on the jets that have not converged.
+        self.depths then holds the number of layers each jet went through.
+        '''
+        weights = h.new_ones(h.size()[:2]) if node_mask is None else node_mask.float()
+        active = torch.arange(len(h), device=h.device)
+        self.depths = torch.full((len(h),), len(self.mp_layers), dtype=torch.long, device=h.device)
+        out = h
+        for depth, mp in enumerate(self.mp_layers, 1):
+            h_new = mp(h=h, mask=mask, dij=dij, **kwargs)
+            change = (((h_new - h) ** 2).sum(2) * weights).sum(1)
+            norm = ((h ** 2).sum(2) * weights).sum(1)
+            h = h_new
+            done = change < self.early_exit ** 2 * norm
+            if depth == len(self.mp_layers) or not done.any():
+                continue
+            out = out.index_copy(0, active[done], h[done])
+            self.depths[active[done]] = depth
+            keep = torch.nonzero(~done).squeeze(1)
+            active, h, dij, weights = active[keep], h[keep], dij[keep], weights[keep]
+            mask = None if mask is None else mask[keep]
+            if len(active) == 0:
+                return out
+        return out.index_copy(0, active, h)
+
+    def early_exit_packed(self, h, edges, dij, batch):
+        '''
+        Packed counterpart of early_exit_layers: the nodes and edges of the
+        converged jets are dropped from the graph, and the sparse adjacency
+        is rebuilt over the remaining ones.
+        '''
+        rows, cols = edges
+        segment_ids, n_jets = batch.segment_ids, len(batch)
+        jets = torch.arange(n_jets, device=h.device)
+        nodes = torch.arange(len(h), device=h.device)
+        self.depths = torch.full((n_jets,), len(self.mp_layers), dtype=torch.long, device=h.device)
+        adjacency = sparse_adjacency(dij, rows, cols, len(h))
+        out = h
+        for depth, mp in enumerate(self.mp_layers, 1):
+            h_new = mp.forward_packed(h=h, adjacency=adjacency)
+            change = segment_sum(((h_new - h) ** 2).sum(1), segment_ids, len(jets))
+            norm = segment_sum((h ** 2).sum(1), segment_ids, len(jets))
+            h = h_new
+            done = change < self.early_exit ** 2 * norm
+            if depth == len(self.mp_layers) or not done.any():
+                continue
+            node_done = done[segment_ids]
+            out = out.index_copy(0, nodes[node_done], h[node_done])
+            self.depths[jets[done]] = depth
+
+            # relabel the remaining nodes and jets; the relabelling keeps the
+            # edges sorted by row then column
+            node_ids = torch.cumsum(~node_done, 0) - 1
+            jet_ids = torch.cumsum(~done, 0) - 1
+            edge_kept = ~node_done[rows]
+            rows, cols, dij = node_ids[rows[edge_kept]], node_ids[cols[edge_kept]], dij[edge_kept]
+            segment_ids = jet_ids[segment_ids[~node_done]]
+            jets, nodes, h = jets[~done], nodes[~node_done], h[~node_done]
+            if len(jets) == 0:
+                return out
+            adjacency = sparse_adjacency(dij, rows, cols, len(h))
+        return out.index_copy(0, nodes, h)
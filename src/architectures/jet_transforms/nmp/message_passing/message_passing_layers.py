@@ -6,8 +6,11 @@ from torch.autograd import Variable
 from .vertex_update import VERTEX_UPDATES
 from src.architectures.embedding import EMBEDDINGS
 from src.architectures.embedding import ACTIVATIONS
+from src.architectures.utils import linear_pair_scores
 
 class MessagePassingLayer(nn.Module):
+    packed = True
+
     def __init__(self, hidden=None, update=None, message=None, act=None, **kwargs):
         super().__init__()
         self.activation = ACTIVATIONS[act]()
@@ -26,7 +29,17 @@ class MessagePassingLayer(nn.Module):
         h = self.vertex_update(h, message)
         return h
 
+    def forward_packed(self, h=None, adjacency=None, **kwargs):
+        ''' Packed counterpart of forward: h holds one row per node and
+        adjacency is the sparse block-diagonal matrix of the packed graph.
+        '''
+        message = self.activation(torch.sparse.mm(adjacency, self.message(h)))
+        h = self.vertex_update(h, message)
+        return h
+
 class GraphAttentionalLayer(nn.Module):
+    packed = False
+
     def __init__(self, hidden=None, act=None, **kwargs):
         super().__init__()
         self.W = nn.Linear(hidden, hidden, bias=False)
@@ -36,17 +49,18 @@ class GraphAttentionalLayer(nn.Module):
 
     def forward(self, h=None, **kwargs):
         h = self.W(h)
-        shp = h.size()
-        h_i = h.view(shp[0], shp[1], 1, shp[2]).repeat(1, 1, shp[1], 1)
-        h_j = h.view(shp[0], 1, shp[1], shp[2]).repeat(1, shp[1], 1, 1)
-        h_cat = torch.cat([h_i,h_j], 3)
-        e_ij = self.activation(torch.sum(h_cat * self.a, 3))
+        # a . [h_i, h_j] = a_i . h_i + a_j . h_j
+        a_i, a_j = self.a.view(-1).chunk(2)
+        e_ij = self.activation(linear_pair_scores(h, a_i, a_j))
         a_ij = F.softmax(e_ij, dim=2)
 
         h = self.activation(torch.bmm(a_ij, h))
 
         return h
 
+    def forward_packed(self, **kwargs):
+        raise NotImplementedError('GraphAttentionalLayer only runs with the dense engine')
+
 
 class MPSimple(MessagePassingLayer):
     def __init__(self,**kwargs):
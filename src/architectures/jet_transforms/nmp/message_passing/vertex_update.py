@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from .....architectures.utils import AnyBatchGRUCell
+from .....architectures.utils import AnyBatchGRUCell, FusedGRUCell
 
 class VertexUpdate(nn.Module):
     def __init__(self, message_dim, hidden_dim, vertex_state_dim):
@@ -26,9 +26,11 @@ class VertexUpdate(nn.Module):
 
 
 class GRUUpdate(VertexUpdate):
+    cell = AnyBatchGRUCell
+
     def __init__(self, message_dim, hidden_dim, vertex_state_dim=0):
         super().__init__(message_dim, hidden_dim, vertex_state_dim)
-        self.gru = AnyBatchGRUCell(self.message_dim + self.vertex_state_dim, self.hidden_dim)
+        self.gru = self.cell(self.message_dim + self.vertex_state_dim, self.hidden_dim)
 
     def _forward_with_vertex_state(self, h, message, s):
         if s is None:
@@ -43,6 +45,14 @@ class GRUUpdate(VertexUpdate):
         h = self.gru(message, h)
         return h
 
+
+class FusedGRUUpdate(GRUUpdate):
+    ''' GRUUpdate on a FusedGRUCell: same parameters, less memory kept for
+    backward.
+    '''
+    cell = FusedGRUCell
+
+
 class Overwrite(VertexUpdate):
     def __init__(self, message_dim, hidden_dim, vertex_state_dim=0):
         super().__init__(message_dim, hidden_dim, vertex_state_dim)
@@ -55,5 +65,6 @@ class Overwrite(VertexUpdate):
 
 VERTEX_UPDATES = dict(
     gru=GRUUpdate,
+    fused_gru=FusedGRUUpdate,
     overwrite=Overwrite
 )
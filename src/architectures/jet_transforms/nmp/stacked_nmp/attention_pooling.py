@@ -6,6 +6,7 @@ import torch.nn.functional as F
 
 from .....architectures.readout import READOUTS
 from .....architectures.utils import Attention
+from .....architectures.utils.attention import dot
 from .....monitors import BatchMatrixMonitor
 #from .....visualizing import visualize_batch_matrix
 
@@ -65,7 +66,63 @@ class AttentionPooling(nn.Module):
                 self.monitor(attn=attn)
                 self.monitor.visualize('epoch-{}'.format(epoch), n=10)
 
+class TopKAttentionPooling(AttentionPooling):
+    '''
+    AttentionPooling where each coarse node only attends to the pool_k fine
+    nodes it scores highest, instead of to all of them. The assignments are
+    returned as a sparse (B, nodes_out, N) tensor with pool_k entries per
+    row, so that pooling the hidden states and coarsening the adjacency
+    (see coarsen_adjacency) are sparse-dense products, linear in N.
+    With node_mask, padded nodes are never selected, and jets with fewer
+    than pool_k real nodes get one entry per real node.
+    '''
+    def __init__(self, nodes_out, hidden, pool_k=8, **kwargs):
+        super().__init__(nodes_out, hidden, **kwargs)
+        self.pool_k = pool_k
+
+    def forward(self, h, node_mask=None, **kwargs):
+        z = self.readout(h)
+        # the scores of Attention, softmax over the top pool_k of each row only
+        s = dot(z, h) * h.size()[1] ** 0.5
+        if node_mask is not None:
+            s = s.masked_fill(~node_mask.unsqueeze(1), float('-inf'))
+        scores, index = s.topk(min(self.pool_k, h.size()[1]), dim=2)
+        # a jet shorter than pool_k fills its remaining slots with padding
+        keep = None if node_mask is None else torch.isfinite(scores)
+        attns = sparse_assignments(F.softmax(scores, dim=2), index, h.size()[1], keep)
+        new_hiddens = torch.bmm(attns, h)
+
+        self.logging(attn=attns)
+        return new_hiddens, attns
+
+def sparse_assignments(values, index, n_nodes, keep=None):
+    ''' Sparse (B, M, n_nodes) tensor with values[b, i, j] in column index[b, i, j],
+    for the entries where keep is set (all of them by default).
+    '''
+    # sorted columns make the indices coalesced as built
+    index, order = index.sort(2)
+    values = values.gather(2, order)
+    bs, m, k = index.size()
+    rows = torch.arange(bs * m, device=index.device).repeat_interleave(k)
+    indices = torch.stack([rows // m, rows % m, index.reshape(-1)], 0)
+    values = values.reshape(-1)
+    if keep is not None:
+        # dropping entries keeps the remaining ones sorted
+        keep = keep.gather(2, order).reshape(-1)
+        indices, values = indices[:, keep], values[keep]
+    return torch.sparse_coo_tensor(indices, values, (bs, m, n_nodes), is_coalesced=True, check_invariants=False)
+
+def coarsen_adjacency(attns, dij):
+    ''' attns @ dij @ attns^T, with sparse-dense products for sparse attns.
+    '''
+    dij = torch.bmm(attns, dij)
+    if attns.is_sparse:
+        # (A D) A^T = (A (A D)^T)^T keeps the sparse operand on the left
+        return torch.bmm(attns, dij.transpose(1, 2)).transpose(1, 2)
+    return torch.bmm(dij, attns.transpose(1, 2))
+
 POOLING_LAYERS = dict(
     attn=AttentionPooling,
+    topk=TopKAttentionPooling,
     rec=RecurrentAttentionPooling
 )
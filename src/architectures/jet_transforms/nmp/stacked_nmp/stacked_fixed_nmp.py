@@ -7,9 +7,10 @@ from torch.autograd import Variable
 
 from .....architectures.readout import READOUTS
 from .....architectures.embedding import EMBEDDINGS
-from .attention_pooling import POOLING_LAYERS
+from .attention_pooling import POOLING_LAYERS, coarsen_adjacency
 from ..message_passing import MP_LAYERS
 from ..adjacency import construct_adjacency
+from .....architectures.utils import checkpointed_layers
 
 from .....monitors import BatchMatrixMonitor
 from .....monitors import Histogram
@@ -27,10 +28,12 @@ class AbstractStackedFixedNMP(nn.Module):
         pool_first=False,
         mp_layer=None,
         emb_init=None,
+        checkpoint_mp=0,
         **kwargs
         ):
 
         super().__init__()
+        self.checkpoint_mp = checkpoint_mp
         emb_kwargs = {x: kwargs[x] for x in ['act', 'wn']}
         self.embedding = EMBEDDINGS['n'](dim_in=features, dim_out=hidden, n_layers=int(emb_init), **emb_kwargs)
 
@@ -81,7 +84,7 @@ class StackedFixedNMP(AbstractStackedFixedNMP):
                     for i in range(len(scales) - 1)]
         return nn.ModuleList([m1] + matrices)
 
-    def forward(self, jets, mask=None, **kwargs):
+    def forward(self, jets, mask=None, node_mask=None, **kwargs):
         h = self.embedding(jets)
         attns = None
         #import ipdb; ipdb.set_trace()
@@ -89,21 +92,24 @@ class StackedFixedNMP(AbstractStackedFixedNMP):
         for i, (nmp, pool, adj) in enumerate(zip(self.nmps, self.attn_pools, self.adjs)):
             if i > 0:
                 #mask = None
-                dij = torch.bmm(attns, dij)
-                dij = torch.bmm(dij, attns.transpose(1,2))
+                dij = coarsen_adjacency(attns, dij)
                 #dij = adj(h, mask=None, **kwargs)
             else:
                 dij = adj(jets, mask=mask, **kwargs)
 
+            # only the first pooling sees padded nodes, the coarse ones are all real
+            pool_mask = node_mask if i == 0 else None
+
             if self.pool_first:
-                h, attns = pool(h, **kwargs)
+                h, attns = pool(h, node_mask=pool_mask, **kwargs)
 
             #dij = adj(h, mask=mask)
-            for mp in nmp:
-                h = mp(h=h, mask=mask, dij=dij)
+            # bind this scale's dij: checkpointed layers rerun step during backward
+            step = lambda mp, h, dij=dij: mp(h=h, mask=mask, dij=dij)
+            h = checkpointed_layers(step, nmp, h, self.checkpoint_mp)
 
             if not self.pool_first:
-                h, attns = pool(h, **kwargs)
+                h, attns = pool(h, node_mask=pool_mask, **kwargs)
 
         out = self.readout(h)
         return out
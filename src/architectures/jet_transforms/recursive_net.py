@@ -2,11 +2,11 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from ..utils import AnyBatchGRUCell
 from ..utils import BiDirectionalTreeGRU
+from ..utils import compile_tree_recursion
 
 class GRNNTransformSimple(nn.Module):
-    def __init__(self, features=None, hidden=None,**kwargs):
+    def __init__(self, features=None, hidden=None, compile_trees=False, **kwargs):
         super().__init__()
 
         activation_string = 'relu'
@@ -19,54 +19,23 @@ class GRNNTransformSimple(nn.Module):
         nn.init.xavier_uniform(self.fc_u.weight, gain=gain)
         nn.init.orthogonal(self.fc_h.weight, gain=gain)
 
+        self.recursion = compile_tree_recursion(compile_trees)
 
-    def forward(self, jets, **kwargs):
-        #n_jets = len(jets)
-        #levels, children, n_inners, contents = batch(jets)
-        levels, children, n_inners, contents, n_jets = jets
-
-        #n_jets = len(contents)
-        n_levels = len(levels)
-        embeddings = []
-
-        for i, nodes in enumerate(levels[::-1]):
-            j = n_levels - 1 - i
-            try:
-                inner = nodes[:n_inners[j]]
-            except ValueError:
-                inner = []
-            try:
-                outer = nodes[n_inners[j]:]
-            except ValueError:
-                outer = []
-
-            u_k = self.fc_u(contents[j])
-            u_k = self.activation(u_k)
-
-
-            if len(inner) > 0:
-                zero = torch.zeros(1).long(); one = torch.ones(1).long()
-                if torch.cuda.is_available(): zero = zero.cuda(); one = one.cuda()
-                h_L = embeddings[-1][children[inner, zero]]
-                h_R = embeddings[-1][children[inner, one]]
-
-                h = torch.cat((h_L, h_R, u_k[:n_inners[j]]), 1)
-                h = self.fc_h(h)
-                h = self.activation(h)
+    def cell(self, h_L, h_R, u_k):
+        h = torch.cat((h_L, h_R, u_k), 1)
+        h = self.fc_h(h)
+        h = self.activation(h)
+        return h
 
-                try:
-                    embeddings.append(torch.cat((h, u_k[n_inners[j]:]), 0))
-                except ValueError:
-                    embeddings.append(h)
-
-            else:
-                embeddings.append(u_k)
-
-        return embeddings[-1].view((n_jets, -1))
+    def forward(self, jets, **kwargs):
+        # one fc_u over the nodes of all levels, then the level-wise recursion
+        u = self.activation(self.fc_u(jets.contents))
+        embeddings = self.recursion(self.cell, u, jets.children, jets.level_starts, jets.n_inners)
+        return embeddings[0].view((len(jets), -1))
 
 
 class GRNNTransformGated(nn.Module):
-    def __init__(self, features=None, hidden=None, iters=0, **kwargs):
+    def __init__(self, features=None, hidden=None, iters=0, tree_iters=0, compile_trees=False, **kwargs):
         super().__init__()
         self.hidden = hidden
         self.iters = iters
@@ -85,93 +54,54 @@ class GRNNTransformGated(nn.Module):
         nn.init.xavier_uniform(self.fc_z.weight, gain=gain)
         nn.init.xavier_uniform(self.fc_r.weight, gain=gain)
 
-        if self.iters > 0:
-            self.down_root = nn.Linear(hidden, hidden)
-            self.down_gru = AnyBatchGRUCell(hidden, hidden)
+        self.recursion = compile_tree_recursion(compile_trees)
 
+        # top-down then bottom-up refinement of the up embeddings
+        self.tree_iters = tree_iters
+        if self.tree_iters > 0:
+            self.tree_gru = BiDirectionalTreeGRU(hidden, tree_iters, compile_trees)
 
-    def forward(self, jets, return_states=False, **kwargs):
-
-        #n_jets = len(conte)
-        levels, children, n_inners, contents, n_jets = jets
-        #n_jets = len(contents)
-        #parents= batch_parents(jets)
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # older checkpoints hold a down_root and a down_gru that were never used
+        for key in list(state_dict.keys()):
+            if key.startswith(prefix + 'down_root.') or key.startswith(prefix + 'down_gru.'):
+                del state_dict[key]
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
-        up_embeddings = [None for _ in range(len(levels))]
-        down_embeddings = [None for _ in range(len(levels))]
 
-        self.recursive_embedding(up_embeddings, levels, children, n_inners, contents)
+    def forward(self, jets, return_states=False, **kwargs):
+        up_embeddings = self.recursive_embedding(jets)
+        if self.tree_iters > 0:
+            up_embeddings, down_embeddings = self.tree_gru(up_embeddings, jets)
+        return up_embeddings[0].view((len(jets), -1))
 
-        if True:# or self.iters == 0:
-            return up_embeddings[0].view((n_jets, -1))
-        else:
-            return torch.cat(
-                        (
-                        up_embeddings[0].view((n_jets, -1)),
-                        down_embeddings[0].view((n_jets, -1))
-                        ),
-                    1)
+    def recursive_embedding(self, jets):
+        u = self.activation(self.fc_u(jets.contents))
+        return self.recursion(self.cell, u, jets.children, jets.level_starts, jets.n_inners)
 
-    def recursive_embedding(self, up_embeddings, levels, children, n_inners, contents):
-        n_levels = len(levels)
+    def cell(self, h_L, h_R, u_k):
         hidden = self.hidden
 
-        for i, nodes in enumerate(levels[::-1]):
-            j = n_levels - 1 - i
-            try:
-                inner = nodes[:n_inners[j]]
-            except ValueError:
-                inner = []
-            try:
-                outer = nodes[n_inners[j]:]
-            except ValueError:
-                outer = []
-
-            u_k = self.fc_u(contents[j])
-            u_k = self.activation(u_k)
-
-            if len(inner) > 0:
-                try:
-                    u_k_inners = u_k[:n_inners[j]]
-                except ValueError:
-                    u_k_inners = []
-                try:
-                    u_k_leaves = u_k[n_inners[j]:]
-                except ValueError:
-                    u_k_leaves = []
-
-                zero = torch.zeros(1).long(); one = torch.ones(1).long()
-                if torch.cuda.is_available(): zero = zero.cuda(); one = one.cuda()
-
-                h_L = up_embeddings[j+1][children[inner, zero]]
-                h_R = up_embeddings[j+1][children[inner, one]]
-
-                hhu = torch.cat((h_L, h_R, u_k_inners), 1)
-                r = self.fc_r(hhu)
-                r = F.sigmoid(r)
-
-                h_H = self.fc_h(r * hhu)
-                h_H = self.activation(h_H)
-
-                z = self.fc_z(torch.cat((h_H, hhu), -1))
-
-                z_H = z[:, :hidden]               # new activation
-                z_L = z[:, hidden:2*hidden]     # left activation
-                z_R = z[:, 2*hidden:3*hidden]   # right activation
-                z_N = z[:, 3*hidden:]             # local state
-                z = torch.stack([z_H,z_L,z_R,z_N], 2)
-                z = F.softmax(z)
-
-                h = ((z[:, :, 0] * h_H) +
-                     (z[:, :, 1] * h_L) +
-                     (z[:, :, 2] * h_R) +
-                     (z[:, :, 3] * u_k_inners))
-
-                try:
-                    up_embeddings[j] = torch.cat((h, u_k_leaves), 0)
-                except AttributeError:
-                    up_embeddings[j] = h
-
-
-            else:
-                up_embeddings[j] = u_k
+        hhu = torch.cat((h_L, h_R, u_k), 1)
+        r = self.fc_r(hhu)
+        r = F.sigmoid(r)
+
+        h_H = self.fc_h(r * hhu)
+        h_H = self.activation(h_H)
+
+        z = self.fc_z(torch.cat((h_H, hhu), -1))
+
+        z_H = z[:, :hidden]               # new activation
+        z_L = z[:, hidden:2*hidden]     # left activation
+        z_R = z[:, 2*hidden:3*hidden]   # right activation
+        z_N = z[:, 3*hidden:]             # local state
+        z = torch.stack([z_H,z_L,z_R,z_N], 2)
+        # dim=0 is the implicit softmax dimension of 3d inputs the gates have
+        # always been trained with: it normalizes over the nodes of a level
+        z = F.softmax(z, dim=0)
+
+        h = ((z[:, :, 0] * h_H) +
+             (z[:, :, 1] * h_L) +
+             (z[:, :, 2] * h_R) +
+             (z[:, :, 3] * u_k))
+        return h
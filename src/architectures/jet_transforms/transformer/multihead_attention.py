@@ -1,11 +1,11 @@
 import torch
 import torch.nn as nn
 from torch.nn import init
-from ...utils import Attention
+from ...utils import Attention, ATTENTION_KERNELS
 from ...utils import BottleLinear as Linear
 
 class MultiHeadAttention(nn.Module):
-    def __init__(self, n_head, d_k, d_v, d_model, dropout=False, **kwargs):
+    def __init__(self, n_head, d_k, d_v, d_model, dropout=False, attention='exact', landmarks=32, **kwargs):
         super().__init__()
         #self.query_weights_list = nn.Linear(n_heads * dim_hidden, n_heads * dim_query, bias=False)
         #self.key_weights_list = nn.Linear(n_heads * dim_hidden, n_heads * dim_query, bias=False)
@@ -27,10 +27,17 @@ class MultiHeadAttention(nn.Module):
         self.d_v = d_v
 
         self.attention = Attention()
+        # exact: the original per-head path, which attends over padding too,
+        # otherwise one of ATTENTION_KERNELS behind a fused projection
+        self.kernel = None if attention == 'exact' else ATTENTION_KERNELS[attention]
+        self.landmarks = landmarks
         self.proj = Linear(n_head*d_v, d_model)
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, q, k, v):
+    def forward(self, q, k, v, mask=None):
+        if self.kernel is not None:
+            return self.fused_forward(q, k, v, mask)
+
         d_k, d_v = self.d_k, self.d_v
         n_head = self.n_head
 
@@ -68,3 +75,32 @@ class MultiHeadAttention(nn.Module):
         #heads = torch.cat(heads, 2)
         #output = self.wo(heads)
         return outputs
+
+    def fused_forward(self, q, k, v, mask=None):
+        ''' Same heads as forward, without copying the inputs once per head.
+
+        The projections of all heads are one matmul (a single one for q, k and
+        v in self attention), the heads stay a dimension of the batch, and the
+        kernel only attends over the keys where mask (B, N) is True.
+        '''
+        mb_size, len_q, d_model = q.size()
+        if q is k and k is v:
+            w = torch.cat([self.wqs, self.wks, self.wvs], 2)
+            qkv = self.project(q, w)
+            q_s, k_s, v_s = torch.split(qkv, [self.d_k, self.d_k, self.d_v], -1)
+        else:
+            q_s, k_s, v_s = self.project(q, self.wqs), self.project(k, self.wks), self.project(v, self.wvs)
+
+        outputs = self.kernel(q_s, k_s, v_s, mask, landmarks=self.landmarks) # mb_size x n_head x len_q x d_v
+        outputs = outputs.transpose(1, 2).contiguous().view(mb_size, len_q, -1)
+
+        outputs = self.proj(outputs)
+        outputs = self.dropout(outputs)
+        return outputs
+
+    def project(self, x, w):
+        ''' (B, N, d_model) x (n_head, d_model, d) -> (B, n_head, N, d)
+        '''
+        bs, n, d_model = x.size()
+        w = w.transpose(0, 1).contiguous().view(d_model, -1)
+        return torch.matmul(x, w).view(bs, n, self.n_head, -1).transpose(1, 2)
@@ -14,15 +14,16 @@ class Transformer(nn.Module):
         super().__init__()
         self.transformer_layers = nn.ModuleList([SelfAttentionLayer(hidden, n_heads, **kwargs) for _ in range(n_layers)])
 
-    def forward(self, x, **kwargs):
+    def forward(self, x, mask=None, **kwargs):
         '''
         x has dimension (B, N, D) where
             B = batch size
             N = number of nodes
             D = model dimension
+        mask (B, N) is True on the real nodes, None to attend over all of them
         '''
         for transformer_layer in self.transformer_layers:
-            x = transformer_layer(x)
+            x = transformer_layer(x, mask)
         return x
 
 class SelfAttentionLayer(nn.Module):
@@ -37,8 +38,8 @@ class SelfAttentionLayer(nn.Module):
                     )
         self.ln2 = LayerNorm(hidden)
 
-    def forward(self, x):
-        x = x + self.multihead_attention(x, x, x)
+    def forward(self, x, mask=None):
+        x = x + self.multihead_attention(x, x, x, mask=mask)
         x = self.ln1(x)
         x = x + self.ff(x)
         x = self.ln2(x)
@@ -8,6 +8,8 @@ from ....architectures.readout import READOUTS
 from ....architectures.embedding import EMBEDDINGS
 
 class TransformerTransform(nn.Module):
+    uses_mask = False
+
     def __init__(self,
         features=None,
         hidden=None,
@@ -15,6 +17,7 @@ class TransformerTransform(nn.Module):
         n_layers=None,
         readout=None,
         emb_init=None,
+        attention='exact',
         **kwargs
         ):
         super().__init__()
@@ -24,10 +27,17 @@ class TransformerTransform(nn.Module):
 
         #self.embedding = EMBEDDINGS['n'](dim_in=features, dim_out=hidden, **emb_kwargs)
         self.readout = READOUTS[readout](hidden, hidden)
-        self.transformer = Transformer(hidden, n_heads, n_layers, **kwargs)
+        self.transformer = Transformer(hidden, n_heads, n_layers, attention=attention, **kwargs)
+        # the original exact attention ignores padding, keep it that way
+        self.masked = attention != 'exact'
 
-    def forward(self, jets, **kwargs):
+    def forward(self, jets, mask=None, node_mask=None, **kwargs):
+        if not self.masked:
+            node_mask = None
         h = self.embedding(jets)
-        h = self.transformer(h)
-        out = self.readout(h)
+        h = self.transformer(h, node_mask)
+        if node_mask is None:
+            out = self.readout(h)
+        else:
+            out = self.readout(h, mask=node_mask)
         return out
@@ -4,6 +4,7 @@ import torch.nn.functional as F
 
 from .jet_transforms import construct_transform
 from .readout import READOUTS
+from ..data_ops.jets.RaggedJetBatch import RaggedJetBatch
 
 #from ..data_ops.batching import batch_leaves, batch_trees
 
@@ -47,9 +48,16 @@ class LeafJetClassifier(JetClassifier):
 
     def forward(self, x, **kwargs):
 
-        jets, mask = x
-
-        #jets, mask = batch_leaves(jets)
-        h = self.transform(jets, mask, **kwargs)
+        if isinstance(x, RaggedJetBatch):
+            if getattr(self.transform, 'engine', 'dense') == 'packed':
+                h = self.transform(x, **kwargs)
+            else:
+                # only build the dense mask for transforms that read it
+                mask = x.mask if getattr(self.transform, 'uses_mask', True) else None
+                h = self.transform(x.padded, mask=mask, node_mask=x.node_mask, batch=x, **kwargs)
+        else:
+            jets, mask = x
+            #jets, mask = batch_leaves(jets)
+            h = self.transform(jets, mask=mask, **kwargs)
         outputs = self.predictor(h)
         return outputs
@@ -4,8 +4,12 @@ import numpy as np
 import torch.nn.functional as F
 
 from .set2set import Set2Vec
+from ..utils import segment_mean
 
 class Readout(nn.Module):
+    # readouts that implement node_transform can run on packed nodes
+    packed = False
+
     def __init__(self, hidden_dim, target_dim):
         super().__init__()
         self.hidden_dim = hidden_dim
@@ -14,36 +18,64 @@ class Readout(nn.Module):
     def forward(self, h):
         pass
 
+    def node_transform(self, x):
+        raise NotImplementedError('{} has no packed implementation'.format(type(self).__name__))
+
+    def mean(self, x, mask=None):
+        ''' Mean over the nodes of each jet, ignoring padding when mask is given.
+        '''
+        if mask is None:
+            return x.mean(1)
+        mask = mask.unsqueeze(2).float()
+        return (x * mask).sum(1) / mask.sum(1)
+
+    def forward_packed(self, x, batch):
+        ''' Readout of nodes packed without padding, one row per constituent.
+        '''
+        return segment_mean(self.node_transform(x), batch.segment_ids, len(batch))
+
 class Constant(Readout):
     def __init__(self, hidden_dim, target_dim):
         super().__init__(hidden_dim, target_dim)
 
-    def forward(self, h):
+    def forward(self, h, mask=None):
         return h
 
 class DTNNReadout(Readout):
+    packed = True
+
     def __init__(self, hidden_dim, target_dim):
         super().__init__(hidden_dim, target_dim)
         self.fc1 = nn.Linear(hidden_dim, hidden_dim)
         self.fc2 = nn.Linear(hidden_dim, target_dim)
 
-    def forward(self, x):
-        bs, n_nodes, n_hidden = (s for s in x.size())
+    def node_transform(self, x):
         x = self.fc1(x)
         x = F.tanh(x)
         x = self.fc2(x)
-        x = x.mean(1)
+        return x
+
+    def forward(self, x, mask=None):
+        bs, n_nodes, n_hidden = (s for s in x.size())
+        x = self.node_transform(x)
+        x = self.mean(x, mask)
         return x
 
 class SimpleReadout(Readout):
+    packed = True
+
     def __init__(self, hidden_dim, target_dim):
         super().__init__(hidden_dim, target_dim)
         self.fc = nn.Linear(hidden_dim, target_dim)
 
-    def forward(self, x):
+    def node_transform(self, x):
         x = self.fc(x)
         x = F.tanh(x)
-        x = x.mean(1)
+        return x
+
+    def forward(self, x, mask=None):
+        x = self.node_transform(x)
+        x = self.mean(x, mask)
         return x
 
 class ClassificationReadout(Readout):
@@ -73,7 +105,8 @@ class SetReadout(Readout):
         super().__init__(hidden_dim, target_dim)
         self.set2vec = Set2Vec(hidden_dim, target_dim, hidden_dim)
 
-    def forward(self, h):
+    def forward(self, h, mask=None):
+        # Set2Vec attends over the padding nodes as well
         x = self.set2vec(h)
         return x
 
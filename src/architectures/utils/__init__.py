@@ -1,4 +1,8 @@
-from .attention import Attention
-from .any_batch_gru_cell import AnyBatchGRUCell
+from .attention import Attention, ATTENTION_KERNELS, masked_attention
+from .any_batch_gru_cell import AnyBatchGRUCell, FusedGRUCell
 from .bidirectional_tree_gru import BiDirectionalTreeGRU
 from .bottle import BottleLinear
+from .segment import segment_sum, segment_mean, segment_max, segment_softmax, sparse_adjacency
+from .pairwise import linear_pair_scores, pairwise_distance, row_chunks
+from .tree_recursion import tree_recursion, compile_tree_recursion
+from .checkpointing import checkpointed_layers
@@ -19,3 +19,60 @@ class AnyBatchGRUCell(nn.Module):
         h = (1 - z) * n + z * h
 
         return h
+
+
+def gru_step(gi, gh, h):
+    ''' Pointwise part of the GRU: the new state, and r, z, n and the hidden
+    part of n for the backward.
+    '''
+    i_r, i_z, i_n = gi.chunk(3, -1)
+    h_r, h_z, h_n = gh.chunk(3, -1)
+    r = torch.sigmoid(i_r + h_r)
+    z = torch.sigmoid(i_z + h_z)
+    n = torch.tanh(i_n + r * h_n)
+    # (1 - z) * n + z * h; h_n is returned as a copy so that gh is freed
+    return torch.lerp(n, h, z), r, z, n, h_n.contiguous()
+
+def gru_step_backward(grad, r, z, n, h_n, h):
+    grad_n = grad * (1 - z) * (1 - n * n)
+    grad_r = grad_n * h_n * r * (1 - r)
+    grad_z = grad * (h - n) * z * (1 - z)
+    grad_gi = torch.cat((grad_r, grad_z, grad_n), -1)
+    grad_gh = torch.cat((grad_r, grad_z, grad_n * r), -1)
+    return grad_gi, grad_gh, grad * z
+
+if hasattr(torch, 'compile'):
+    # each body becomes one generated kernel instead of one launch per
+    # elementwise op; dynamic shapes, as the number of nodes changes with
+    # every batch
+    gru_step = torch.compile(gru_step, dynamic=True)
+    gru_step_backward = torch.compile(gru_step_backward, dynamic=True)
+
+
+class FusedGRUStep(torch.autograd.Function):
+    ''' Pointwise part of the GRU in one step with a hand-written backward.
+
+    gi and gh are the (..., 3H) outputs of linear_ih and linear_hh and h the
+    (..., H) previous state. The forward and the backward each run as a
+    single compiled kernel, and only r, z, n, the hidden part of n and h are
+    kept for backward, instead of every intermediate of the elementwise ops
+    of the autograd version.
+    '''
+    @staticmethod
+    def forward(ctx, gi, gh, h):
+        h_new, r, z, n, h_n = gru_step(gi, gh, h)
+        ctx.save_for_backward(r, z, n, h_n, h)
+        return h_new
+
+    @staticmethod
+    def backward(ctx, grad):
+        return gru_step_backward(grad, *ctx.saved_tensors)
+
+
+class FusedGRUCell(AnyBatchGRUCell):
+    ''' AnyBatchGRUCell with the gate nonlinearities and the state update
+    fused in FusedGRUStep. The parameters are those of AnyBatchGRUCell, so
+    the two cells load each other's weights.
+    '''
+    def forward(self, i, h):
+        return FusedGRUStep.apply(self.linear_ih(i), self.linear_hh(h), h)
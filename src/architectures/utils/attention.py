@@ -1,3 +1,4 @@
+import logging
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -67,12 +68,144 @@ class Attention(nn.Module):
         #import ipdb; ipdb.set_trace()
         s = dot(query, key)
         if dimensions is None:
-            dimensions  = Variable(torch.FloatTensor([key.size()[1]]).view(1, 1, 1).expand_as(s))
-        if torch.cuda.is_available():
-            dimensions = dimensions.cuda()
-        scaling_factor = torch.sqrt(1 / dimensions)
-        alpha = F.softmax(s / scaling_factor, dim=2)
+            # plain float, no tensor to build and copy to the device per call
+            s = s * key.size()[1] ** 0.5
+        else:
+            s = s / torch.sqrt(1 / dimensions)
+        alpha = F.softmax(s, dim=2)
         #alpha = alpha.transpose(0,2)
         #import ipdb; ipdb.set_trace()
         output = torch.bmm(alpha, value)
         return output, alpha
+
+def key_mask_view(key_mask, query):
+    ''' Reshape a (B, N) key mask to broadcast against (B, ..., M, N) scores.
+    '''
+    return key_mask.view(key_mask.size()[0], *([1] * (query.dim() - 2)), key_mask.size()[1])
+
+def masked_attention(query, key, value, key_mask=None, **kwargs):
+    ''' Attention of Attention.forward, batched over any dimensions between
+    the batch and the nodes (e.g. heads), and restricted to real keys.
+
+    Inputs:
+        query <- (B, ..., M, D)
+        key <- (B, ..., N, D)
+        value <- (B, ..., N, D_v)
+        key_mask <- (B, N) bool, True on real keys, or None for no padding
+    Output:
+        (B, ..., M, D_v)
+
+    Scores are scaled by the square root of the number of keys, as in
+    Attention, counting only the real keys of each jet so that the output of
+    a jet does not depend on how much the batch pads it. Runs the fused
+    F.scaled_dot_product_attention kernels when torch has them.
+    '''
+    if key_mask is None:
+        query = query * key.size()[-2] ** 0.5
+        attn_mask = None
+    else:
+        n_keys = key_mask.sum(1).to(query.dtype)
+        query = query * n_keys.sqrt().view(-1, *([1] * (query.dim() - 1)))
+        attn_mask = key_mask_view(key_mask, query)
+
+    if hasattr(F, 'scaled_dot_product_attention'):
+        return F.scaled_dot_product_attention(query, key, value, attn_mask=attn_mask, scale=1.)
+
+    s = torch.matmul(query, key.transpose(-1, -2))
+    if attn_mask is not None:
+        s = s.masked_fill(~attn_mask, float('-inf'))
+    return torch.matmul(F.softmax(s, dim=-1), value)
+
+def linear_attention(query, key, value, key_mask=None, **kwargs):
+    ''' Kernelized attention in O(N) time and memory, same inputs as masked_attention.
+
+    exp(q . k) is replaced by phi(q) . phi(k) with phi = elu + 1, so that
+    the sums over keys factor out of the queries:
+        out_i = phi(q_i) . sum_j phi(k_j) v_j^T / phi(q_i) . sum_j phi(k_j)
+    This is a different model than softmax attention, not an approximation
+    of a trained one.
+    '''
+    query = F.elu(query) + 1
+    key = F.elu(key) + 1
+    if key_mask is not None:
+        key = key * key_mask_view(key_mask, key).transpose(-1, -2).to(key.dtype)
+    kv = torch.matmul(key.transpose(-1, -2), value) # (B, ..., D, D_v)
+    normalizer = torch.matmul(query, key.sum(-2).unsqueeze(-1)) # (B, ..., M, 1)
+    return torch.matmul(query, kv) / normalizer
+
+def landmark_weights(node_mask, n, landmarks, device=None):
+    ''' (B, N, landmarks) weights averaging the real nodes of each jet over
+    landmarks consecutive segments of equal size, and the (B, landmarks)
+    mask of the segments that are not empty.
+    '''
+    if node_mask is None:
+        lengths = torch.full((1, 1), n, dtype=torch.long, device=device)
+        node_mask = torch.ones(1, n, dtype=torch.bool, device=device)
+    else:
+        lengths = node_mask.sum(1, keepdim=True)
+    position = torch.arange(n, device=node_mask.device).unsqueeze(0)
+    segment = torch.clamp(position * landmarks // lengths.clamp(min=1), max=landmarks - 1)
+    weights = F.one_hot(segment, landmarks).float() * node_mask.unsqueeze(2).float()
+    counts = weights.sum(1)
+    return weights / counts.clamp(min=1).unsqueeze(1), counts > 0
+
+def iterative_pinv(matrix, n_iter=6):
+    ''' Newton-Schulz approximation of the pseudo-inverse of a batch of square
+    matrices with non-negative entries (Xiong et al., Nystromformer). Plain
+    matmuls, and better behaved than an exact pinv on the ill-conditioned
+    softmax kernels.
+    '''
+    identity = torch.eye(matrix.size()[-1], dtype=matrix.dtype, device=matrix.device)
+    norm = matrix.sum(-2).amax(-1) * matrix.sum(-1).amax(-1)
+    z = matrix.transpose(-1, -2) / norm.clamp(min=1e-12)[..., None, None]
+    for _ in range(n_iter):
+        mz = torch.matmul(matrix, z)
+        z = 0.25 * torch.matmul(z, 13 * identity - torch.matmul(mz, 15 * identity - torch.matmul(mz, 7 * identity - mz)))
+    return z
+
+def nystrom_attention(query, key, value, key_mask=None, landmarks=32, **kwargs):
+    ''' Nystrom approximation of masked_attention in O(N x landmarks), for self
+    attention (query and key over the same nodes).
+
+    The softmax matrix S = softmax(Q K^T) is approximated through landmark
+    queries and keys, the segment means of the real nodes of each jet:
+        S ~ softmax(Q K~^T) pinv(softmax(Q~ K~^T)) softmax(Q~ K^T)
+    Batches of at most landmarks constituents fall back to exact attention.
+    '''
+    n = key.size()[-2]
+    if n <= landmarks:
+        return masked_attention(query, key, value, key_mask)
+
+    if key_mask is None:
+        query = query * n ** 0.5
+    else:
+        n_keys = key_mask.sum(1).to(query.dtype)
+        query = query * n_keys.sqrt().view(-1, *([1] * (query.dim() - 1)))
+
+    weights, landmark_mask = landmark_weights(key_mask, n, landmarks, query.device)
+    weights = weights.transpose(1, 2).reshape(len(weights), *([1] * (query.dim() - 3)), landmarks, n).to(query.dtype)
+    query_landmarks = torch.matmul(weights, query) # (B, ..., landmarks, D)
+    key_landmarks = torch.matmul(weights, key)
+
+    landmark_mask = key_mask_view(landmark_mask, query)
+    def softmax(s, mask):
+        return F.softmax(s.masked_fill(~mask, float('-inf')), dim=-1)
+
+    kernel_1 = softmax(torch.matmul(query, key_landmarks.transpose(-1, -2)), landmark_mask)
+    kernel_2 = softmax(torch.matmul(query_landmarks, key_landmarks.transpose(-1, -2)), landmark_mask)
+    kernel_3 = torch.matmul(query_landmarks, key.transpose(-1, -2))
+    if key_mask is not None:
+        kernel_3 = kernel_3.masked_fill(~key_mask_view(key_mask, query), float('-inf'))
+    kernel_3 = F.softmax(kernel_3, dim=-1)
+
+    # empty landmarks get zero rows, so the pseudo-inverse leaves them out
+    empty = landmark_mask.transpose(-1, -2).to(query.dtype)
+    kernel_2 = kernel_2 * empty
+    kernel_3 = kernel_3 * empty
+    return torch.matmul(kernel_1, torch.matmul(iterative_pinv(kernel_2), torch.matmul(kernel_3, value)))
+
+ATTENTION_KERNELS = dict(
+    sdpa=masked_attention,
+    linear=linear_attention,
+    nystrom=nystrom_attention,
+)
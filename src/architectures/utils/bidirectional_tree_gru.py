@@ -2,8 +2,26 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .any_batch_gru_cell import AnyBatchGRUCell
+from .tree_recursion import compile_tree_recursion
+
 class BiDirectionalTreeGRU(nn.Module):
-    def __init__(self, n_hidden=None, n_iters=1):
+    '''
+    Top-down and bottom-up passes over a TreeBatch, giving every node the
+    context of the rest of its tree.
+
+    down_the_tree: the roots start from their up embedding, every other node
+        runs down_gru on its up embedding and the down state of its parent
+    up_the_tree: every node refines its up embedding with up_gru, reading the
+        down state of the node for leaves, and the sum of the refined
+        children for inner nodes
+
+    Embeddings are lists of (n_nodes_d, H) tensors, one per level. Each level
+    is one gather of the parent or children positions precomputed by the
+    TreeBatch and one batched GRU call: every level is produced whole, in
+    order, so nothing is scattered into zero-initialized buffers.
+    '''
+    def __init__(self, n_hidden=None, n_iters=1, compile=False):
         super().__init__()
         self.n_hidden = n_hidden
         self.n_iters = n_iters
@@ -13,92 +31,29 @@ class BiDirectionalTreeGRU(nn.Module):
         self.up_leaf = nn.Linear(n_hidden, n_hidden)
         self.up_gru = AnyBatchGRUCell(n_hidden, n_hidden)
 
-    def forward(self, up_embeddings, down_embeddings, levels, children, n_inners):
-        for _ in range(self.n_iters):
-            self.down_the_tree(states, up_embeddings, down_embeddings, levels, children, n_inners)
-            self.up_the_tree(states, up_embeddings, down_embeddings, levels, children, n_inners)
-
-    def up_the_tree(self, up_embeddings, down_embeddings, levels, children, n_inners):
-
-        zero = torch.zeros(1).long(); one = torch.ones(1).long()
-        if torch.cuda.is_available(): zero = zero.cuda(); one = one.cuda()
-
-        for i, nodes in enumerate(levels[::-1]):
-            j = n_levels - 1 - i
-            try:
-                inner = nodes[:n_inners[j]]
-            except ValueError:
-                inner = []
-            try:
-                outer = nodes[n_inners[j]:]
-            except ValueError:
-                outer = []
-
-
-            if len(inner) > 0:
-                try:
-                    u_k_inners = u_k[:n_inners[j]]
-                except ValueError:
-                    u_k_inners = []
-                try:
-                    u_k_leaves = u_k[n_inners[j]:]
-                except ValueError:
-                    u_k_leaves = []
-
-                h_L = embeddings[j+1][children[inner, zero]]
-                h_R = embeddings[j+1][children[inner, one]]
-
-                hhu = torch.cat((h_L, h_R, u_k_inners), 1)
-                r = self.fc_r(hhu)
-                if self.bn: r = self.bn_r(r)
-                r = F.sigmoid(r)
-
-                h_H = self.fc_h(r * hhu)
-                if self.bn: h_H = self.bn_h(h_H)
-                h_H = self.activation(h_H)
-
-                z = self.fc_z(torch.cat((h_H, hhu), -1))
-                if self.bn: z = self.bn_z(z)
-
-                z_H = z[:, :n_hidden]               # new activation
-                z_L = z[:, n_hidden:2*n_hidden]     # left activation
-                z_R = z[:, 2*n_hidden:3*n_hidden]   # right activation
-                z_N = z[:, 3*n_hidden:]             # local state
-                z = torch.stack([z_H,z_L,z_R,z_N], 2)
-                z = F.softmax(z)
+        self.recursion = compile_tree_recursion(compile)
 
-                h = ((z[:, :, 0] * h_H) +
-                     (z[:, :, 1] * h_L) +
-                     (z[:, :, 2] * h_R) +
-                     (z[:, :, 3] * u_k_inners))
-
-                try:
-                    embeddings.append(torch.cat((h, u_k_leaves), 0))
-                except AttributeError:
-                    embeddings.append(h)
-
-
-            else:
-                embeddings.append(u_k)
-
-
-    def down_the_tree(self, up_embeddings, down_embeddings, levels, children, n_inners):
-
-        down_embeddings[0] = F.tanh(self.down_root(up_embeddings[0])) # root nodes
-
-        zero = torch.zeros(1).long(); one = torch.ones(1).long()
-        if torch.cuda.is_available(): zero = zero.cuda(); one = one.cuda()
-
-        for j, nodes in enumerate(levels[:-1]):
-
-            down_parent = down_embeddings[j]
-            up_L = up_embeddings[j+1][children[nodes, zero]]
-            up_R = up_embeddings[j+1][children[nodes, one]]
-
-            down_L = self.down_gru(up_L, down_parent)
-            down_R = self.down_gru(up_R, down_parent)
-
-            h = Variable(torch.zeros(down_L.size()[0] * 2, down_L.size()[1]))
-            h[children[nodes, zero]] = down_L
-            h[children[nodes, one]] = down_R
-            down_embeddings[j] = h
+    def forward(self, up_embeddings, jets):
+        down_embeddings = None
+        for _ in range(self.n_iters):
+            down_embeddings = self.down_the_tree(up_embeddings, jets)
+            up_embeddings = self.up_the_tree(up_embeddings, down_embeddings, jets)
+        return up_embeddings, down_embeddings
+
+    def down_the_tree(self, up_embeddings, jets):
+        down_embeddings = [F.tanh(self.down_root(up_embeddings[0]))] # root nodes
+        for d in range(1, jets.n_levels):
+            parents = jets.parents[jets.level_starts[d]:jets.level_starts[d + 1]]
+            down_embeddings.append(self.down_gru(up_embeddings[d], down_embeddings[d - 1][parents]))
+        return down_embeddings
+
+    def up_the_tree(self, up_embeddings, down_embeddings, jets):
+        # the leaves of every level are its last rows: only they read the down
+        # pass, the inner nodes are recomputed from their children
+        down_leaves = torch.cat([down[n:] for down, n in zip(down_embeddings, jets.n_inners)], 0)
+        up_leaves = torch.cat([up[n:] for up, n in zip(up_embeddings, jets.n_inners)], 0)
+        leaves = self.up_gru(F.tanh(self.up_leaf(down_leaves)), up_leaves)
+        return self.recursion(self.up_cell, torch.cat(up_embeddings, 0), jets.children, jets.level_starts, jets.n_inners, leaves)
+
+    def up_cell(self, h_L, h_R, up):
+        return self.up_gru(h_L + h_R, up)
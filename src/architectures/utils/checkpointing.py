@@ -0,0 +1,27 @@
+import torch
+from torch.utils.checkpoint import checkpoint
+
+def checkpointed_layers(step, layers, h, group_size=0):
+    ''' h = step(layer, h) for every layer in turn, under activation
+    checkpointing over groups of group_size consecutive layers.
+
+    Only the h entering each group is kept for backward: the activations
+    inside a group (message embeddings, gates, ...) are recomputed when the
+    gradient gets there, trading about one extra forward for memory that no
+    longer grows with the number of layers. group_size 0, or running without
+    gradients, runs the layers as usual.
+    '''
+    if group_size <= 0 or not torch.is_grad_enabled():
+        for layer in layers:
+            h = step(layer, h)
+        return h
+
+    for start in range(0, len(layers), group_size):
+        def run_group(h, group=layers[start:start + group_size]):
+            for layer in group:
+                h = step(layer, h)
+            return h
+        # non-reentrant checkpointing also recomputes through tensors the
+        # layers close over, such as a learned adjacency matrix
+        h = checkpoint(run_group, h, use_reentrant=False)
+    return h
@@ -0,0 +1,32 @@
+import torch
+
+'''
+Pairwise scores s(h_i, h_j) over all pairs of nodes of a batch, computed
+without (B, N, N, D) intermediates. Scores that are linear in the pair split
+into one projection per node, broadcast into the (B, N, N) output, and
+distances run through a fused kernel, optionally over blocks of rows to
+bound the peak memory of very large jets.
+'''
+
+def linear_pair_scores(h, w_i, w_j, bias=None):
+    ''' scores[b, i, j] = w_i . h[b, i] + w_j . h[b, j] (+ bias)
+    '''
+    scores = torch.matmul(h, w_i).unsqueeze(2) + torch.matmul(h, w_j).unsqueeze(1)
+    if bias is not None:
+        scores = scores + bias
+    return scores
+
+def row_chunks(fn, h, chunk_size=None):
+    ''' Apply fn(h_rows, h) to blocks of at most chunk_size rows of h and
+    concatenate the (B, rows, N) outputs.
+    '''
+    if chunk_size is None or chunk_size >= h.size()[1]:
+        return fn(h, h)
+    return torch.cat([fn(h_rows, h) for h_rows in torch.split(h, chunk_size, 1)], 1)
+
+def pairwise_distance(h, chunk_size=None):
+    ''' distances[b, i, j] = ||h[b, i] - h[b, j]||_2
+    '''
+    # the direct kernel is exact at zero distance, unlike the matmul expansion
+    cdist = lambda x, y: torch.cdist(x, y, compute_mode='donot_use_mm_for_euclid_dist')
+    return row_chunks(cdist, h, chunk_size)
@@ -0,0 +1,36 @@
+import torch
+
+'''
+Reductions over segments of a flat tensor, for batches of graphs packed
+without padding. Row k of values belongs to segment segment_ids[k].
+'''
+
+def segment_sum(values, segment_ids, n_segments):
+    out = values.new_zeros((n_segments,) + values.size()[1:])
+    return out.index_add_(0, segment_ids, values)
+
+def segment_mean(values, segment_ids, n_segments):
+    counts = segment_sum(torch.ones_like(segment_ids, dtype=values.dtype), segment_ids, n_segments)
+    return segment_sum(values, segment_ids, n_segments) / counts.clamp(min=1).view(-1, *([1] * (values.dim() - 1)))
+
+def segment_max(values, segment_ids, n_segments):
+    out = values.new_full((n_segments,) + values.size()[1:], -float('inf'))
+    index = segment_ids.view(-1, *([1] * (values.dim() - 1))).expand_as(values)
+    return out.scatter_reduce(0, index, values, reduce='amax', include_self=True)
+
+def segment_softmax(values, segment_ids, n_segments):
+    ''' Softmax of values within each segment.
+    '''
+    shift = segment_max(values, segment_ids, n_segments).detach()[segment_ids]
+    exp = torch.exp(values - shift)
+    return exp / segment_sum(exp, segment_ids, n_segments)[segment_ids]
+
+def sparse_adjacency(values, rows, cols, n_nodes):
+    '''
+    Sparse (n_nodes, n_nodes) matrix with values on the edges (rows, cols),
+    which must be sorted by row then column (see RaggedJetBatch.edges).
+    torch.sparse.mm with it sums the messages of each node's neighbours
+    without materialising one message per edge.
+    '''
+    indices = torch.stack([rows, cols], 0)
+    return torch.sparse_coo_tensor(indices, values, (n_nodes, n_nodes), is_coalesced=True, check_invariants=False)
@@ -0,0 +1,50 @@
+import torch
+
+def tree_recursion(cell, u, children, level_starts, n_inners, leaves=None):
+    ''' Bottom-up pass over the flat layout of a TreeBatch.
+
+    Leaves keep their embedding u (or leaves, when given), and inner nodes
+    get cell(h_L, h_R, u) of the embeddings of their children, one level at
+    a time from the deepest.
+
+    Inputs:
+        cell <- (h_L, h_R, u) -> h, all (n, H), for the inner nodes of a level
+        u <- (n_nodes, H) embedding of the contents of every node
+        children, level_starts, n_inners <- layout of the TreeBatch
+        leaves <- (n_leaves, H) embedding taken by the leaves, in the order of
+            their rows, the rows of u by default
+    Output:
+        list of the (n_nodes_d, H) embeddings of the nodes of every level d
+
+    The loop only slices with python ints and gathers with the precomputed
+    children positions: no device syncs or data-dependent branches, so it can
+    be traced as a whole by torch.compile.
+    '''
+    # one split of u into the inner nodes and the leaves of every level: a
+    # single backward, where slicing level by level would write a full
+    # size gradient of u for every slice
+    n_levels = len(n_inners)
+    sizes = []
+    for d in range(n_levels):
+        sizes += [n_inners[d], level_starts[d + 1] - level_starts[d] - n_inners[d]]
+    blocks = torch.split(u, sizes, 0)
+    leaf_blocks = blocks[1::2] if leaves is None else torch.split(leaves, sizes[1::2], 0)
+
+    embeddings = [u] * n_levels
+    for d in range(n_levels - 1, -1, -1):
+        u_inner, u_leaves = blocks[2 * d], leaf_blocks[d]
+        if n_inners[d] == 0:
+            embeddings[d] = u_leaves
+            continue
+        below = embeddings[d + 1]
+        child = children[level_starts[d]:level_starts[d] + n_inners[d]]
+        h = cell(below[child[:, 0]], below[child[:, 1]], u_inner)
+        embeddings[d] = torch.cat((h, u_leaves), 0)
+    return embeddings
+
+def compile_tree_recursion(compile=False):
+    ''' tree_recursion, compiled with dynamic shapes when compile is set.
+    '''
+    if compile and hasattr(torch, 'compile'):
+        return torch.compile(tree_recursion, dynamic=True)
+    return tree_recursion
@@ -0,0 +1,51 @@
+'''
+Throughput and memory of the MultiHeadAttention kernels of the transformer,
+forward and backward, as the number of constituents grows.
+
+    python -m src.benchmarks.attention --n 32 128 512 --attention exact sdpa linear nystrom
+
+Jets in a batch get random lengths between n/2 and n, so the masked kernels
+see realistic padding.
+'''
+import argparse
+
+import torch
+
+from src.architectures.jet_transforms.transformer.multihead_attention import MultiHeadAttention
+from .utils import time_fn, peak_memory, device, format_table
+
+def make_batch(batch_size, n, hidden):
+    x = torch.randn(batch_size, n, hidden, device=device())
+    lengths = torch.randint(n // 2 + 1, n + 1, (batch_size,), device=device())
+    mask = torch.arange(n, device=device()).unsqueeze(0) < lengths.unsqueeze(1)
+    return x, mask
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, nargs='+', default=[32, 64, 128, 256])
+    parser.add_argument("--attention", type=str, nargs='+', default=['exact', 'sdpa', 'linear', 'nystrom'])
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--n_heads", type=int, default=8)
+    parser.add_argument("--dq", type=int, default=32)
+    parser.add_argument("--n_repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = []
+    for n in args.n:
+        x, mask = make_batch(args.batch_size, n, args.hidden)
+        x.requires_grad_()
+        for attention in args.attention:
+            torch.manual_seed(0)
+            layer = MultiHeadAttention(args.n_heads, args.dq, args.dq, args.hidden, dropout=0., attention=attention).to(device())
+
+            def step():
+                layer(x, x, x, mask=mask).sum().backward()
+
+            seconds = time_fn(step, args.n_repeats)
+            rows.append([n, attention, '{:.1f}'.format(1e3 * seconds), '{:.0f}'.format(args.batch_size / seconds), '{:.1f}'.format(peak_memory(step))])
+
+    print(format_table(['n', 'attention', 'ms/batch', 'jets/s', 'peak MB'], rows))
+
+if __name__ == '__main__':
+    main()
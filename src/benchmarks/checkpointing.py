@@ -0,0 +1,59 @@
+'''
+Memory and step time of NMP training steps with activation checkpointing of
+the message passing layers (--checkpoint_mp), to pick the group size that
+fits a larger batch for an acceptable recompute cost.
+
+    python -m src.benchmarks.checkpointing --iters 10 --checkpoint_mp 0 1 2 5
+
+For each group size, reports the step time (forward and backward), the
+memory autograd keeps for backward (not counting the one h per group kept
+by the checkpoints), and the peak memory of the step (process resident
+set growth on the CPU, which the allocator's reuse makes coarse).
+'''
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+
+from src.architectures import construct_classifier
+from .utils import MODEL_KWARGS, random_leaf_batch, time_fn, peak_memory, saved_activation_memory, device, format_table
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint_mp", type=int, nargs='+', default=[0, 1, 2, 5])
+    parser.add_argument("--stack", action='store_true', default=False, help='benchmark StackedFixedNMP over --scales instead of FixedNMP')
+    parser.add_argument("--engine", type=str, default='dense')
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--scales", type=int, nargs='+', default=[20, 5])
+    parser.add_argument("--max_length", type=int, default=120)
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--n_repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    batch = random_leaf_batch(args.batch_size, args.max_length)
+    rows = []
+    for group_size in args.checkpoint_mp:
+        kwargs = dict(MODEL_KWARGS, engine=args.engine, iters=args.iters, hidden=args.hidden, checkpoint_mp=group_size)
+        if args.stack:
+            # the pooling layers write their attention plots under logger.plotsdir
+            kwargs.update(scales=args.scales, logger=SimpleNamespace(plotsdir=tempfile.mkdtemp()))
+        torch.manual_seed(0)
+        model = construct_classifier(kwargs['predict'], **kwargs).to(device())
+        step = lambda: model(batch).sum().backward()
+
+        seconds = time_fn(step, args.n_repeats)
+        rows.append([
+            group_size if group_size > 0 else 'off',
+            '{:.1f}'.format(1e3 * seconds),
+            '{:.1f}'.format(saved_activation_memory(step)),
+            '{:.1f}'.format(peak_memory(step)),
+        ])
+
+    print('{} ({} engine), {} layers{}, batch of {} jets up to {} constituents'.format(
+        'StackedFixedNMP' if args.stack else 'FixedNMP', args.engine, args.iters, ' per scale' if args.stack else '', args.batch_size, args.max_length))
+    print(format_table(['checkpoint_mp', 'ms/step', 'saved MB', 'peak MB'], rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+'''
+Time of a combination of adjacencies (--adj a b ...) evaluated one component
+after the other, or on several CPU threads (--combo_threads).
+
+    python -m src.benchmarks.combo --adj phy sum dm --combo_threads 0 2 3 --batch_size 100 --max_length 60
+
+For each thread count, reports the time of the dense forward alone and with
+backward, and of the packed forward.
+'''
+import argparse
+
+import torch
+
+from src.architectures.jet_transforms.nmp.adjacency import construct_adjacency
+from .utils import MODEL_KWARGS, random_leaf_batch, time_fn, format_table
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--adj", type=str, nargs='+', default=['phy', 'sum', 'dm'])
+    parser.add_argument("--combo_threads", type=int, nargs='+', default=[0, 2, 3])
+    parser.add_argument("--equal_weight", action='store_true', default=False)
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--max_length", type=int, default=60)
+    parser.add_argument("--n_repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    batch = random_leaf_batch(args.batch_size, args.max_length)
+    jets, mask = batch.padded, batch.mask
+    kwargs = {k: v for k, v in MODEL_KWARGS.items() if k != 'features'}
+    kwargs.update(matrix=args.adj, learned_tradeoff=not args.equal_weight, dim_in=MODEL_KWARGS['features'])
+
+    rows = []
+    for n_threads in args.combo_threads:
+        torch.manual_seed(0)
+        adjacency = construct_adjacency(**dict(kwargs, combo_threads=n_threads))
+        trainable = any(p.requires_grad for p in adjacency.parameters())
+        with torch.no_grad():
+            forward = time_fn(lambda: adjacency(jets, mask), args.n_repeats)
+            packed = time_fn(lambda: adjacency.packed(batch.nodes, batch), args.n_repeats)
+        backward = time_fn(lambda: adjacency(jets, mask).sum().backward(), args.n_repeats) if trainable else None
+        rows.append([
+            n_threads if n_threads > 1 else 'off',
+            '{:.2f}'.format(1e3 * forward),
+            '{:.2f}'.format(1e3 * backward) if backward is not None else '-',
+            '{:.2f}'.format(1e3 * packed),
+        ])
+
+    print('{} adjacency, batch of {} jets up to {} constituents, {} intra-op threads'.format(
+        ' + '.join(args.adj), args.batch_size, args.max_length, torch.get_num_threads()))
+    print(format_table(['combo_threads', 'forward ms', 'fwd+bwd ms', 'packed ms'], rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+'''
+Accuracy and latency of FixedNMP inference with adaptive depth (--early_exit),
+over a range of tolerances.
+
+    python -m src.benchmarks.early_exit --load MODEL_DIR --dataset w --n_valid 10000 --tolerances 0 .01 .03 .1
+
+With --load, runs a trained model on the validation split of --dataset and
+reports the ROC AUC at each tolerance. Without it, runs a freshly initialised
+model on random jets, where only the depth, the time and the deviation from
+full-depth predictions are meaningful. Tolerance 0 is the full-depth baseline.
+'''
+import argparse
+import os
+
+import numpy as np
+import torch
+from sklearn.metrics import roc_auc_score
+
+from src.architectures import construct_classifier
+from src.data_ops.load_dataset import load_train_dataset
+from src.data_ops.wrapping import wrap_batch, unwrap
+from src.data_ops.jets.JetLoader import LeafJetLoader
+from src.loading.model import load_model
+from src.misc.constants import DATASETS, DATA_DIR
+from .utils import MODEL_KWARGS, random_leaf_batch, time_fn, device, format_table
+
+def validation_batches(args):
+    intermediate_dir, data_filename = DATASETS[args.dataset]
+    data_dir = os.path.join(args.data_dir, intermediate_dir)
+    _, valid_dataset = load_train_dataset(data_dir, data_filename, 1, args.n_valid, False, True, columnar=args.columnar)
+    loader = LeafJetLoader(valid_dataset, batch_size=args.batch_size)
+    batches = [wrap_batch(batch) for batch in loader]
+    return [x for x, _ in batches], np.concatenate([unwrap(y) for _, y in batches]), valid_dataset.weights
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tolerances", type=float, nargs='+', default=[0, .01, .03, .1, .3])
+    parser.add_argument("--load", type=str, default=None, help='directory of a trained FixedNMP model')
+    parser.add_argument("--data_dir", type=str, default=DATA_DIR)
+    parser.add_argument("--dataset", type=str, default='w')
+    parser.add_argument("--columnar", action='store_true', default=False)
+    parser.add_argument("--n_valid", type=int, default=10000)
+    parser.add_argument("--engine", type=str, default='dense', help='engine of the random model')
+    parser.add_argument("--iters", type=int, default=10, help='depth of the random model')
+    parser.add_argument("--max_length", type=int, default=120)
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--n_batches", type=int, default=5)
+    parser.add_argument("--n_repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.load is not None:
+        model = load_model(args.load)
+        batches, yy, weights = validation_batches(args)
+    else:
+        torch.manual_seed(0)
+        kwargs = dict(MODEL_KWARGS, engine=args.engine, iters=args.iters)
+        model = construct_classifier(kwargs['predict'], **kwargs).to(device())
+        batches = [random_leaf_batch(args.batch_size, args.max_length, seed=seed) for seed in range(args.n_batches)]
+        yy = None
+    model.eval()
+    n_jets = sum(len(x) for x in batches)
+
+    rows = []
+    full = None
+    with torch.no_grad():
+        for tolerance in args.tolerances:
+            model.transform.early_exit = tolerance if tolerance > 0 else None
+            predict = lambda: [model(x) for x in batches]
+            seconds = time_fn(predict, args.n_repeats, n_warmup=1)
+
+            depths = []
+            yy_pred = []
+            for x in batches:
+                yy_pred.append(unwrap(model(x)).reshape(-1))
+                depths.append(unwrap(model.transform.depths) if tolerance > 0 else np.full(len(x), model.transform.iters))
+            yy_pred = np.concatenate(yy_pred)
+            if full is None:
+                full = yy_pred
+
+            rows.append([
+                tolerance,
+                '{:.2f}'.format(np.concatenate(depths).mean()),
+                '{:.3f}'.format(1e3 * seconds / n_jets),
+                '{:.4f}'.format(roc_auc_score(yy, yy_pred, sample_weight=weights)) if yy is not None else '-',
+                '{:.1e}'.format(np.abs(yy_pred - full).max()),
+            ])
+
+    print('FixedNMP ({} engine), {} layers, {} jets'.format(model.transform.engine, model.transform.iters, n_jets))
+    print(format_table(['tolerance', 'depth', 'ms/jet', 'ROC AUC', 'max |dp|'], rows))
+
+if __name__ == '__main__':
+    main()
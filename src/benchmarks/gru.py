@@ -0,0 +1,54 @@
+'''
+Step time and saved memory of the GRU cell of the vertex update (--update gru
+against fused_gru), forward and backward over a (B, N, H) batch of nodes.
+
+    python -m src.benchmarks.gru --hidden 64 128 --batch_size 100 --max_length 120
+
+For each hidden size, reports the time of a forward and backward step and the
+memory autograd keeps for backward, for AnyBatchGRUCell, FusedGRUCell (whose
+pointwise forward and backward are compiled), and the whole AnyBatchGRUCell
+under torch.compile when --compile is given. The first step of a compiled
+cell, which pays for compilation, is excluded by the warm-up of time_fn.
+'''
+import argparse
+
+import torch
+
+from src.architectures.utils import AnyBatchGRUCell, FusedGRUCell
+from .utils import time_fn, saved_activation_memory, device, format_table
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hidden", type=int, nargs='+', default=[64, 128])
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--max_length", type=int, default=120)
+    parser.add_argument("--compile", action='store_true', default=False)
+    parser.add_argument("--n_repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    rows = []
+    for hidden in args.hidden:
+        torch.manual_seed(0)
+        cells = dict(autograd=AnyBatchGRUCell(hidden, hidden).to(device()))
+        cells['fused'] = FusedGRUCell(hidden, hidden).to(device())
+        cells['fused'].load_state_dict(cells['autograd'].state_dict())
+        if args.compile:
+            cells['compiled'] = torch.compile(cells['autograd'])
+
+        i = torch.randn(args.batch_size, args.max_length, hidden, device=device(), requires_grad=True)
+        h = torch.randn(args.batch_size, args.max_length, hidden, device=device(), requires_grad=True)
+        for name, cell in cells.items():
+            step = lambda: cell(i, h).sum().backward()
+            seconds = time_fn(step, args.n_repeats)
+            rows.append([
+                hidden,
+                name,
+                '{:.2f}'.format(1e3 * seconds),
+                '{:.1f}'.format(saved_activation_memory(step)),
+            ])
+
+    print('GRU cell, {} x {} nodes'.format(args.batch_size, args.max_length))
+    print(format_table(['hidden', 'cell', 'ms/step', 'saved MB'], rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+'''
+Dense attention pooling (--pool attn) against top-k sparse pooling (--pool topk)
+in StackedFixedNMP, on batches of large jets.
+
+    python -m src.benchmarks.pooling --max_length 300 600 1000 --scales 30 8 --pool_k 8 16
+
+For each jet size and pooling, reports the time of coarsening the adjacency of
+the first scale (attns @ dij @ attns^T, forward and backward, for a fixed
+physics dij), and the step time and memory kept for backward of the whole
+model, unless --no_model.
+'''
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+import torch
+
+from src.architectures import construct_classifier
+from src.architectures.jet_transforms.nmp.stacked_nmp.attention_pooling import POOLING_LAYERS, coarsen_adjacency
+from .utils import MODEL_KWARGS, random_leaf_batch, time_fn, saved_activation_memory, device, format_table
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pool_k", type=int, nargs='+', default=[8, 16])
+    parser.add_argument("--scales", type=int, nargs='+', default=[30, 8])
+    parser.add_argument("--iters", type=int, default=2)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--max_length", type=int, nargs='+', default=[300, 600, 1000])
+    parser.add_argument("--batch_size", type=int, default=10)
+    parser.add_argument("--no_model", action='store_true', default=False)
+    parser.add_argument("--n_repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    # pooling layers write their attention plots under logger.plotsdir
+    logger = SimpleNamespace(plotsdir=tempfile.mkdtemp())
+    rows = []
+    for max_length in args.max_length:
+        batch = random_leaf_batch(args.batch_size, max_length)
+        n = batch.max_length
+        h = torch.randn(len(batch), n, args.hidden, device=device())
+        dij = torch.softmax(torch.randn(len(batch), n, n, device=device()), 2)
+
+        for pool, k in [('attn', None)] + [('topk', k) for k in args.pool_k]:
+            torch.manual_seed(0)
+            layer = POOLING_LAYERS[pool](args.scales[0], args.hidden, pool_k=k, logger=logger).to(device())
+            _, attns = layer(h)
+            attns = attns.detach().requires_grad_()
+            coarsen = lambda: coarsen_adjacency(attns, dij).sum().backward()
+            row = [n, pool if k is None else '{} k={}'.format(pool, k), '{:.2f}'.format(1e3 * time_fn(coarsen, args.n_repeats))]
+
+            if not args.no_model:
+                kwargs = dict(MODEL_KWARGS, scales=args.scales, pooling_layer=pool, pool_k=k, iters=args.iters, hidden=args.hidden, logger=logger)
+                torch.manual_seed(0)
+                model = construct_classifier(kwargs['predict'], **kwargs).to(device())
+                step = lambda: model(batch).sum().backward()
+                row += ['{:.1f}'.format(1e3 * time_fn(step, args.n_repeats)), '{:.1f}'.format(saved_activation_memory(step))]
+            else:
+                row += ['-', '-']
+            rows.append(row)
+
+    print('StackedFixedNMP, scales {}, {} layers per scale, batches of {} jets'.format(args.scales, args.iters, args.batch_size))
+    print(format_table(['N', 'pooling', 'coarsen ms', 'model ms/step', 'saved MB'], rows))
+
+if __name__ == '__main__':
+    main()
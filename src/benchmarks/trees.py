@@ -0,0 +1,95 @@
+'''
+Throughput of the recursive (GRNN) transforms, forward and backward: the
+shared level-wise executor, eager and compiled, against the per-level loop
+the transforms used before, on batches of random binary trees.
+
+    python -m src.benchmarks.trees --model recs recg --leaves 20 60
+'''
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from src.architectures.jet_transforms import GRNNTransformGated, GRNNTransformSimple
+from src.data_ops.jets.JetLoader import TreeJetLoader
+from src.data_ops.jets.Jet import Jet
+from .utils import time_fn, device, format_table
+
+TRANSFORMS = dict(recs=GRNNTransformSimple, recg=GRNNTransformGated)
+
+def random_tree(n_leaves, rng):
+    ''' Binary tree grown by splitting random leaves, root at row 0.
+    '''
+    tree = [[-1, -1]]
+    leaves = [0]
+    while len(leaves) < n_leaves:
+        node = leaves.pop(rng.randint(len(leaves)))
+        tree[node] = [len(tree), len(tree) + 1]
+        leaves += [len(tree), len(tree) + 1]
+        tree += [[-1, -1], [-1, -1]]
+    return np.array(tree, dtype=np.int64)
+
+def random_jets(n_jets, max_leaves, features, rng):
+    jets = []
+    for i in range(n_jets):
+        tree = random_tree(rng.randint(2, max_leaves + 1), rng)
+        content = rng.randn(len(tree), features).astype(np.float32)
+        jets.append(Jet(y=i % 2, constituents=content, tree=tree, tree_content=content, root_id=0, pt=1., mass=1., eta=0., phi=0.))
+    return jets
+
+def level_loop(transform, jets):
+    ''' The per-level loop of the transforms before the shared executor: one
+    fc_u per level, index tensors rebuilt on every level, and a concatenation
+    of the inner and leaf embeddings of each level.
+    '''
+    n_levels = jets.n_levels
+    embeddings = [None] * n_levels
+    for j in range(n_levels - 1, -1, -1):
+        start, end, n_inner = jets.level_starts[j], jets.level_starts[j + 1], jets.n_inners[j]
+        u_k = transform.activation(transform.fc_u(jets.contents[start:end]))
+        if n_inner > 0:
+            zero = torch.zeros(1).long().to(u_k.device); one = torch.ones(1).long().to(u_k.device)
+            children = jets.children[start:start + n_inner]
+            h = transform.cell(embeddings[j + 1][children[:, zero].view(-1)], embeddings[j + 1][children[:, one].view(-1)], u_k[:n_inner])
+            embeddings[j] = torch.cat((h, u_k[n_inner:]), 0)
+        else:
+            embeddings[j] = u_k
+    return embeddings[0].view((len(jets), -1))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, nargs='+', default=['recs', 'recg'])
+    parser.add_argument("--leaves", type=int, nargs='+', default=[20, 60], help='maximum number of leaves per jet')
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument("--features", type=int, default=7)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--n_repeats", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    for max_leaves in args.leaves:
+        jets = random_jets(args.batch_size, max_leaves, args.features, np.random.RandomState(args.seed))
+        batch = TreeJetLoader.batch_trees(jets)
+        if torch.cuda.is_available():
+            batch = batch.cuda()
+        for model in args.model:
+            torch.manual_seed(args.seed)
+            transform = TRANSFORMS[model](features=args.features, hidden=args.hidden).to(device())
+            compiled = TRANSFORMS[model](features=args.features, hidden=args.hidden, compile_trees=True).to(device())
+            compiled.load_state_dict(transform.state_dict())
+
+            runs = [
+                ('level loop', lambda: level_loop(transform, batch)),
+                ('executor', lambda: transform(batch)),
+                ('compiled', lambda: compiled(batch)),
+            ]
+            for name, fn in runs:
+                seconds = time_fn(lambda: fn().sum().backward(), args.n_repeats)
+                rows.append([max_leaves, batch.n_levels, model, name, '{:.1f}'.format(1e3 * seconds), '{:.0f}'.format(args.batch_size / seconds)])
+
+    print(format_table(['leaves', 'levels', 'model', 'executor', 'ms/batch', 'jets/s'], rows))
+
+if __name__ == '__main__':
+    main()
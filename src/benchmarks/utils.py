@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import torch
+from memory_profiler import memory_usage
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def time_fn(fn, n_repeats=10, n_warmup=2):
+    ''' Mean wall time of fn() in seconds, after a few warmup calls.
+    '''
+    for _ in range(n_warmup):
+        fn()
+    synchronize()
+    t0 = time.time()
+    for _ in range(n_repeats):
+        fn()
+    synchronize()
+    return (time.time() - t0) / n_repeats
+
+def peak_memory(fn):
+    ''' Peak memory in MB used by one call of fn(): allocated device memory on
+    the GPU, growth of the resident set size of the process on the CPU.
+    '''
+    if torch.cuda.is_available():
+        synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        baseline = torch.cuda.memory_allocated()
+        fn()
+        synchronize()
+        return (torch.cuda.max_memory_allocated() - baseline) / 2 ** 20
+    baseline = memory_usage(-1, interval=.01, timeout=.05, max_usage=True)
+    return max(memory_usage((fn, (), {}), interval=.005, max_usage=True) - baseline, 0.)
+
+def saved_activation_memory(fn):
+    ''' MB of the tensors autograd keeps for backward during fn(), counting
+    every storage once. Exact on any device, unlike the process-level peak
+    on the CPU. Tensors saved inside checkpointed regions are not seen.
+    '''
+    storages = {}
+    def pack(tensor):
+        if tensor.layout == torch.strided:
+            storage = tensor.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+    return sum(storages.values()) / 2 ** 20
+
+def device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def format_table(header, rows):
+    widths = [max(len(str(x)) for x in column) for column in zip(header, *rows)]
+    lines = ['  '.join(str(x).rjust(w) for x, w in zip(row, widths)) for row in [header] + rows]
+    return '\n'.join(lines)
+
+# train.py defaults of the options the leaf-based models read
+MODEL_KWARGS = dict(
+    features=8, hidden=64, logging_frequency=20, act='leakyrelu', predict='simple',
+    jet_transform='nmp', iters=10, update='gru', message='2', emb_init='1', mp_layer='simple',
+    symmetric=True, readout='dtnn', matrix='phy', activation='soft', wn=False, engine='dense', masked_readout=False,
+    pairwise_chunk=None, checkpoint_mp=0, early_exit=None, combo_threads=0,
+    scales=None, pooling_layer='attn', pool_first=False, pool_k=8,
+    alpha=1, R=1, trainable_physics=False, knn=None, radius=None, adjacency_cache=0,
+    adjacency_cache_dir=None, learned_tradeoff=True, n_heads=8, n_layers=3, dq=32, dv=32,
+    attention='exact', landmarks=32, dropout=1.,
+)
+
+def random_leaf_batch(batch_size, max_length, features=7, seed=0):
+    ''' RaggedJetBatch of random constituents, with geometric jet sizes
+    capped at max_length like the long tails of real datasets.
+    '''
+    from src.data_ops.jets.RaggedJetBatch import RaggedJetBatch
+    rng = np.random.RandomState(seed)
+    lengths = np.minimum(rng.geometric(3. / max_length, size=batch_size) + 1, max_length)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    batch = RaggedJetBatch.from_arrays(rng.randn(offsets[-1], features).astype(np.float32), offsets)
+    return batch.cuda() if torch.cuda.is_available() else batch
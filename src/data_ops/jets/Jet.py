@@ -15,6 +15,9 @@ class Jet:
             tree=None,
             root_id=None,
             tree_content=None,
+            tree_schedule=None,
+            tree_schedule_version=None,
+            index=None,
             **kwargs
             ):
 
@@ -28,6 +31,10 @@ class Jet:
         self.tree = tree
         self.root_id = root_id
         self.tree_content = tree_content
+        self.tree_schedule = tree_schedule
+        self.tree_schedule_version = tree_schedule_version
+        # position of the jet in its data file, used as a cache key
+        self.index = index
 
     def to_tensor(self):
         return torch.Tensor(self.constituents)
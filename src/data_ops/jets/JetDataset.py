@@ -3,6 +3,8 @@ from torch.utils.data import Dataset
 import numpy as np
 import math
 
+from .JetStore import JetStore
+
 class JetDataset(Dataset):
     def __init__(self, jets, weights=None, problem=None, subproblem=None):
         super().__init__()
@@ -19,11 +21,32 @@ class JetDataset(Dataset):
 
     def shuffle(self):
         perm = np.random.permutation(len(self.jets))
-        self.jets = [self.jets[i] for i in perm]
+        self.jets = self.take(perm)
         #self.y = [self.y[i] for i in perm]
         if self.weights is not None:
             self.weights = [self.weights[i] for i in perm]
 
+    def take(self, indices):
+        if isinstance(self.jets, JetStore):
+            return self.jets[np.asarray(indices, dtype=np.int64)]
+        return [self.jets[i] for i in indices]
+
+    def column(self, name):
+        if isinstance(self.jets, JetStore):
+            return self.jets.column(name)
+        return np.array([getattr(jet, name) for jet in self.jets])
+
+    def lengths(self):
+        if isinstance(self.jets, JetStore):
+            return self.jets.lengths()
+        return np.array([len(jet) for jet in self.jets])
+
+    def tree_sizes(self):
+        if isinstance(self.jets, JetStore):
+            offsets = self.jets.columns['tree_offsets']
+            return offsets[self.jets.indices + 1] - offsets[self.jets.indices]
+        return np.array([len(jet.tree) for jet in self.jets])
+
     @property
     def dim(self):
         return self.jets[0].constituents.shape[1]
@@ -60,49 +83,33 @@ class JetDataset(Dataset):
         photon_pt_min = 100
         delta_phi_min = 2 * math.pi / 3
 
-        good_jets = []
-        bad_jets = []
-        #good_indices = []
-        pt_filter = 0
-        eta_filter = 0
-        photon_pt_filter = 0
-        photon_eta_filter = 0
-        delta_phi_filter = 0
-
-        for i, j in enumerate(jets):
-            good = True
-            if j.pt <= pt_min:
-                good = False
-                pt_filter += 1
-            if abs(j.eta) >= eta_max:
-                good = False
-                eta_filter += 1
-            if abs(j.photon_eta) >= eta_max:
-                good = False
-                photon_eta_filter += 1
-            if j.photon_pt <= photon_pt_min:
-                good = False
-                photon_pt_filter += 1
-
-            delta_phi = abs(j.phi - j.photon_phi)
-            if delta_phi > math.pi:
-                delta_phi = delta_phi - math.pi
-            if delta_phi <= delta_phi_min:
-                good = False
-                delta_phi_filter += 1
-
-            if good:
-                good_jets.append(j)
-            else:
-                bad_jets.append(j)
+        pt = self.column('pt')
+        eta = self.column('eta')
+        phi = self.column('phi')
+        photon_pt = self.column('photon_pt')
+        photon_eta = self.column('photon_eta')
+        photon_phi = self.column('photon_phi')
+
+        bad_pt = pt <= pt_min
+        bad_eta = np.abs(eta) >= eta_max
+        bad_photon_eta = np.abs(photon_eta) >= eta_max
+        bad_photon_pt = photon_pt <= photon_pt_min
+
+        delta_phi = np.abs(phi - photon_phi)
+        delta_phi = np.where(delta_phi > math.pi, delta_phi - math.pi, delta_phi)
+        bad_delta_phi = delta_phi <= delta_phi_min
+
+        good = ~(bad_pt | bad_eta | bad_photon_eta | bad_photon_pt | bad_delta_phi)
+        good_jets = self.take(np.flatnonzero(good))
+        bad_jets = self.take(np.flatnonzero(~good))
 
         logging.warning('applied cuts to {} jets'.format(len(jets)))
 
-        logging.warning('bad pt = {}'.format(pt_filter))
-        logging.warning('bad eta = {}'.format(eta_filter))
-        logging.warning('bad photon_pt = {}'.format(photon_pt_filter))
-        logging.warning('bad photon_eta = {}'.format(photon_eta_filter))
-        logging.warning('bad delta_phi = {}'.format(delta_phi_filter))
+        logging.warning('bad pt = {}'.format(bad_pt.sum()))
+        logging.warning('bad eta = {}'.format(bad_eta.sum()))
+        logging.warning('bad photon_pt = {}'.format(bad_photon_pt.sum()))
+        logging.warning('bad photon_eta = {}'.format(bad_photon_eta.sum()))
+        logging.warning('bad delta_phi = {}'.format(bad_delta_phi.sum()))
 
         return good_jets, bad_jets, None
 
@@ -110,7 +117,6 @@ class JetDataset(Dataset):
     def _crop_w_vs_qcd(self):
         #print("___CROP")
 
-        jets = self.jets
         #logging.warning("Cropping...")
         if self.subproblem == 'antikt-kt-pileup':
             pt_min, pt_max, m_min, m_max = 300, 365, 150, 220
@@ -119,42 +125,30 @@ class JetDataset(Dataset):
         else:
             raise ValueError("Only subproblems accepted are antikt-kt or antikt-kt-pileup (got {})".format(self.subproblem))
 
+        pt = self.column('pt')
+        mass = self.column('mass')
+        y = self.column('y')
 
-        good_jets = []
-        bad_jets = []
-        #good_indices = []
-        for i, j in enumerate(jets):
-            if pt_min < j.pt < pt_max and m_min < j.mass < m_max:
-                good_jets.append(j)
-                #good_indices.append(i)
-            else:
-                bad_jets.append(j)
+        good = (pt_min < pt) & (pt < pt_max) & (m_min < mass) & (mass < m_max)
+        good_indices = np.flatnonzero(good)
+        good_jets = self.take(good_indices)
+        bad_jets = self.take(np.flatnonzero(~good))
 
         # Weights for flatness in pt
         w = np.zeros(len(good_jets))
-        y_ = np.array([jet.y for jet in good_jets])
-
-        jets_0 = [jet for jet in good_jets if jet.y == 0]
-        pdf, edges = np.histogram([j.pt for j in jets_0], density=True, range=[pt_min, pt_max], bins=50)
-        pts = [j.pt for j in jets_0]
-        indices = np.searchsorted(edges, pts) - 1
-        inv_w = 1. / pdf[indices]
-        inv_w /= inv_w.sum()
-        #w[y_==0] = inv_w
-        for i, (iw, jet) in enumerate(zip(inv_w, good_jets)):
-            if jet.y == 0:
-                w[i] = iw
-
-        jets_1 = [jet for jet in good_jets if jet.y == 1]
-        pdf, edges = np.histogram([j.pt for j in jets_1], density=True, range=[pt_min, pt_max], bins=50)
-        pts = [j.pt for j in jets_1]
-        indices = np.searchsorted(edges, pts) - 1
-        inv_w = 1. / pdf[indices]
-        inv_w /= inv_w.sum()
-        #w[y_==1] = inv_w
-        for i, (iw, jet) in enumerate(zip(inv_w, good_jets)):
-            if jet.y == 1:
-                w[i] = iw
+        pt_ = pt[good_indices]
+        y_ = y[good_indices]
+
+        for label in [0, 1]:
+            pts = pt_[y_ == label]
+            pdf, edges = np.histogram(pts, density=True, range=[pt_min, pt_max], bins=50)
+            indices = np.searchsorted(edges, pts) - 1
+            inv_w = 1. / pdf[indices]
+            inv_w /= inv_w.sum()
+            #w[y_==label] = inv_w
+            n = len(inv_w)
+            selected = np.flatnonzero(y_[:n] == label)
+            w[selected] = inv_w[selected]
 
 
         return good_jets, bad_jets, w
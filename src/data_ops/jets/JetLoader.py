@@ -1,46 +1,78 @@
 import numpy as np
 import torch
-from torch.autograd import Variable
 
 from ..utils import _DataLoader
-from ..utils import pad_tensors
-from ..utils import dropout
-from ..wrapping import wrap
+from ..utils import SeedStream, ragged_offsets, ragged_dropout, ragged_permutation, segment_ids
+from ..utils import BucketBatchSampler, TokenBudgetBatchSampler
+from .RaggedJetBatch import RaggedJetBatch
+from .TreeBatch import TreeBatch
+from .trees import concatenate_trees, level_schedule, merge_tree_schedules, SCHEDULE_VERSION
 
 
 class JetLoader(_DataLoader):
-    def __init__(self, dataset, batch_size):
-        super().__init__(dataset, batch_size)
+    def __init__(self, dataset, batch_size, batch_sampler=None, num_workers=0, prefetch_factor=2, pin_memory=False):
+        super().__init__(dataset, batch_size, batch_sampler, num_workers=num_workers, prefetch_factor=prefetch_factor, pin_memory=pin_memory)
 
     def preprocess_y(self, y_list):
         y = torch.stack([torch.Tensor([int(y)]) for y in y_list], 0)
         if y.size()[1] == 1:
             y = y.squeeze(1)
-        y = wrap(y)
         return y
 
 class LeafJetLoader(JetLoader):
-    def __init__(self, dataset, batch_size, dropout=None, permute_particles=False):
-        super().__init__(dataset, batch_size)
-        self.dropout = dropout
+    def __init__(self, dataset, batch_size, dropout=None, permute_particles=False, bucketing=False, bucket_pool=50, batch_budget=None, shuffle=True, num_workers=0, prefetch_factor=2, pin_memory=False, seed=None, **kwargs):
+        if batch_budget is not None:
+            batch_sampler = TokenBudgetBatchSampler(dataset.lengths(), batch_budget, 'quadratic', shuffle=shuffle)
+        elif bucketing:
+            batch_sampler = BucketBatchSampler(dataset.lengths(), batch_size, bucket_pool, shuffle=shuffle)
+        else:
+            batch_sampler = None
+        super().__init__(dataset, batch_size, batch_sampler, num_workers=num_workers, prefetch_factor=prefetch_factor, pin_memory=pin_memory)
+        # dropout is a keep probability: keeping every constituent is no
+        # augmentation, and leaves the batches to the per-jet caches
+        self.dropout = dropout if dropout is not None and dropout < 1 else None
         self.permute_particles = permute_particles
+        self.seeds = SeedStream(seed)
+
+    def __iter__(self):
+        self.seeds.next_epoch()
+        return super().__iter__()
+
+    def padding_efficiency(self):
+        # only tracked for length-aware samplers, which keep the batches of the last epoch
+        if isinstance(self.batch_sampler, BucketBatchSampler):
+            return self.batch_sampler.padding_efficiency()
+        return None
 
     def preprocess_x(self, x_list):
-        x_list = [x.constituents for x in x_list]
+        # augment the whole batch at once on a flat buffer of constituents
+        constituents = np.concatenate([x.constituents for x in x_list], 0)
+        offsets = ragged_offsets([len(x.constituents) for x in x_list])
+        rng = self.seeds.rng
+
         if self.permute_particles:
-            data = [torch.from_numpy(np.random.permutation(x)) for x in x_list]
-        else:
-            data = [torch.from_numpy(x) for x in x_list]
+            constituents = constituents[ragged_permutation(offsets, rng)]
 
         if self.dropout is not None:
-            data = dropout(data, self.dropout)
+            keep = ragged_dropout(offsets, self.dropout, rng)
+            constituents = constituents[keep]
+            offsets = ragged_offsets(np.bincount(segment_ids(offsets)[keep], minlength=len(x_list)))
+
+        # jets altered by augmentation must not hit per-jet caches
+        indices = [x.index for x in x_list]
+        if self.permute_particles or self.dropout is not None or None in indices:
+            indices = None
 
-        return pad_tensors(data)
+        return RaggedJetBatch.from_arrays(constituents, offsets, indices)
 
 
 class TreeJetLoader(JetLoader):
-    def __init__(self, dataset, batch_size,**kwargs):
-        super().__init__(dataset, batch_size)
+    def __init__(self, dataset, batch_size, batch_budget=None, shuffle=True, num_workers=0, prefetch_factor=2, pin_memory=False, **kwargs):
+        if batch_budget is not None:
+            batch_sampler = TokenBudgetBatchSampler(dataset.tree_sizes(), batch_budget, 'linear', shuffle=shuffle)
+        else:
+            batch_sampler = None
+        super().__init__(dataset, batch_size, batch_sampler, num_workers=num_workers, prefetch_factor=prefetch_factor, pin_memory=pin_memory)
 
     def preprocess_x(self, x_list):
         return TreeJetLoader.batch_trees(x_list)
@@ -59,93 +91,17 @@ class TreeJetLoader(JetLoader):
         #
         # jet_contents: array of shape [n_nodes, n_features]
         #     jet_contents[node_id] is the feature vector of node_id
-        jet_children = []
         n_jets = len(jets)
-        offset = 0
-
-        for j, jet in enumerate(jets):
-            tree = np.copy(jet.tree)
-            tree[tree != -1] += offset
-
-            jet_children.append(tree)
-            offset += len(tree)
-
-        jet_children = np.vstack(jet_children)
-        jet_contents = torch.cat([Variable(torch.from_numpy(jet.tree_content).float()) for jet in jets], 0)
-        if torch.cuda.is_available():
-            jet_contents = jet_contents.cuda()
-        #import ipdb; ipdb.set_trace()
-        n_nodes = offset
-
-        # Level-wise traversal
-        level_children = np.zeros((n_nodes, 4), dtype=np.int32)
-        level_children[:, [0, 2]] -= 1
-
-        inners = []   # Inner nodes at level i
-        outers = []   # Outer nodes at level i
-        offset = 0
-
-        for jet in jets:
-            queue = [(jet.root_id + offset, -1, True, 0)]
-
-            while len(queue) > 0:
-                node, parent, is_left, depth = queue.pop(0)
-
-                if len(inners) < depth + 1:
-                    inners.append([])
-                if len(outers) < depth + 1:
-                    outers.append([])
-
-                # Inner node
-                if jet_children[node, 0] != -1:
-                    inners[depth].append(node)
-                    position = len(inners[depth]) - 1
-                    is_leaf = False
-
-                    queue.append((jet_children[node, 0], node, True, depth + 1))
-                    queue.append((jet_children[node, 1], node, False, depth + 1))
-
-                # Outer node
-                else:
-                    outers[depth].append(node)
-                    position = len(outers[depth]) - 1
-                    is_leaf = True
-
-                # Register node at its parent
-                if parent >= 0:
-                    if is_left:
-                        level_children[parent, 0] = position
-                        level_children[parent, 1] = is_leaf
-                    else:
-                        level_children[parent, 2] = position
-                        level_children[parent, 3] = is_leaf
-
-            offset += len(jet.tree)
-
-        # Reorganize levels[i] so that inner nodes appear first, then outer nodes
-        levels = []
-        n_inners = []
-        contents = []
-
-        prev_inner = np.array([], dtype=int)
-
-        for inner, outer in zip(inners, outers):
-            n_inners.append(len(inner))
-            inner = np.array(inner, dtype=int)
-            outer = np.array(outer, dtype=int)
-            level = np.concatenate((inner, outer))
-            level = torch.from_numpy(level)
-            if torch.cuda.is_available(): level = level.cuda()
-            levels.append(level)
-
-            left = prev_inner[level_children[prev_inner, 1] == 1]
-            level_children[left, 0] += len(inner)
-            right = prev_inner[level_children[prev_inner, 3] == 1]
-            level_children[right, 2] += len(inner)
-
-            contents.append(jet_contents[levels[-1]])
-
-            prev_inner = inner
+        jet_children, roots, _ = concatenate_trees([jet.tree for jet in jets], [jet.root_id for jet in jets])
+
+        jet_contents = np.concatenate([np.asarray(jet.tree_content) for jet in jets], 0)
+
+        # Level-wise traversal: merge the schedules cached at preprocessing time
+        # when they are up to date, otherwise compute them for the whole batch
+        if all(getattr(jet, 'tree_schedule_version', None) == SCHEDULE_VERSION for jet in jets):
+            levels, level_children, n_inners = merge_tree_schedules(jet_children, [jet.tree_schedule for jet in jets])
+        else:
+            levels, level_children, n_inners = level_schedule(jet_children, roots)
 
         # levels: list of arrays
         #     levels[i][j] is a node id at a level i in one of the trees
@@ -162,14 +118,8 @@ class TreeJetLoader(JetLoader):
         #     n_inners[i] is the number of inner nodes at level i, accross all
         #     trees
         #
-        # contents: array of shape [n_nodes, n_features]
-        #     contents[sum(len(l) for l in layers[:i]) + j] is the feature vector
-        #     or node layers[i][j]
-
-        level_children = torch.from_numpy(level_children).long()
-        n_inners = torch.from_numpy(np.array(n_inners)).long()
-        if torch.cuda.is_available():
-            level_children = level_children.cuda()
-            n_inners = n_inners.cuda()
+        # The recursive models read the levels concatenated in one flat
+        # layout, with the child rows of every inner node precomputed here
+        # (see TreeBatch).
 
-        return (levels, level_children[:, [0, 2]], n_inners, contents, n_jets)
+        return TreeBatch.from_schedule(jet_contents, levels, level_children, n_inners, n_jets)
@@ -0,0 +1,232 @@
+import json
+import os
+
+import numpy as np
+
+from .Jet import Jet, QuarkGluonJet
+
+STORE_VERSION = 1
+
+SCALAR_COLUMNS = ['pt', 'mass', 'eta', 'phi', 'y', 'root_id']
+QUARK_GLUON_COLUMNS = ['photon_pt', 'photon_eta', 'photon_phi', 'env']
+
+COLUMN_DTYPES = dict(
+    constituents=np.float32,
+    constituent_offsets=np.int64,
+    tree=np.int32,
+    tree_content=np.float32,
+    tree_offsets=np.int64,
+    tree_schedule=np.int32,
+    pt=np.float64,
+    mass=np.float64,
+    eta=np.float64,
+    phi=np.float64,
+    y=np.int64,
+    root_id=np.int64,
+    photon_pt=np.float64,
+    photon_eta=np.float64,
+    photon_phi=np.float64,
+    env=np.int64,
+)
+
+JET_CLASSES = dict(
+    jet=Jet,
+    quark_gluon=QuarkGluonJet,
+)
+
+
+class JetStore:
+    '''
+    Read-only columnar view of a dataset of jets.
+
+    The jets live on disk as flat arrays: all constituents stacked in one
+    float32 array, all tree nodes in another, with offset arrays delimiting
+    each jet, plus one array per scalar attribute. Every array is opened
+    with np.memmap, so opening a store is instantaneous and pages are only
+    read when a jet is accessed.
+
+    A JetStore behaves like the list of Jets it replaces: integer indexing
+    builds a Jet whose arrays are views into the memory maps, while slicing
+    and index arrays return a new JetStore over the selected jets.
+    '''
+    def __init__(self, path, indices=None):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError('Jet store at {} has version {} (expected {})'.format(path, self.meta.get('version'), STORE_VERSION))
+        self.JetClass = JET_CLASSES[self.meta['jet_class']]
+        self.progenitors = {int(y): p for y, p in self.meta['progenitors'].items()}
+        self._columns = None
+        if indices is None:
+            indices = np.arange(self.meta['n_jets'])
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = {}
+            for name, info in self.meta['columns'].items():
+                shape = tuple(info['shape'])
+                filename = os.path.join(self.path, name + '.bin')
+                if np.prod(shape) == 0:
+                    self._columns[name] = np.zeros(shape, dtype=info['dtype'])
+                else:
+                    self._columns[name] = np.memmap(filename, dtype=info['dtype'], mode='c', shape=shape)
+        return self._columns
+
+    @property
+    def has_tree(self):
+        return 'tree' in self.meta['columns']
+
+    def column(self, name):
+        return np.asarray(self.columns[name][self.indices])
+
+    def lengths(self):
+        offsets = self.columns['constituent_offsets']
+        return offsets[self.indices + 1] - offsets[self.indices]
+
+    def get_jet(self, index):
+        columns = self.columns
+
+        start, end = columns['constituent_offsets'][index:index+2]
+        kwargs = {name: columns[name][index].item() for name in SCALAR_COLUMNS + QUARK_GLUON_COLUMNS if name in columns}
+        kwargs['constituents'] = columns['constituents'][start:end]
+        kwargs['progenitor'] = self.progenitors.get(kwargs['y'], None)
+        kwargs['index'] = int(index)
+
+        if self.has_tree:
+            start, end = columns['tree_offsets'][index:index+2]
+            kwargs['tree'] = columns['tree'][start:end]
+            kwargs['tree_content'] = columns['tree_content'][start:end]
+            if 'tree_schedule' in columns:
+                kwargs['tree_schedule'] = columns['tree_schedule'][start:end]
+                kwargs['tree_schedule_version'] = self.meta.get('tree_schedule_version', None)
+
+        return self.JetClass(**kwargs)
+
+    def write_column(self, name, array, **meta):
+        ''' Replace or add a whole column of the store on disk.
+        '''
+        array = np.ascontiguousarray(array, dtype=COLUMN_DTYPES[name])
+        filename = os.path.join(self.path, name + '.bin')
+        # write next to the old file and rename, so live memory maps keep the old data
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(array.tobytes())
+        os.replace(filename + '.tmp', filename)
+        self.meta['columns'][name] = dict(dtype=np.dtype(COLUMN_DTYPES[name]).name, shape=list(array.shape))
+        self.meta.update(meta)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        self._columns = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.get_jet(self.indices[idx])
+        return JetStore(self.path, self.indices[idx])
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.get_jet(index)
+
+    def __add__(self, other):
+        if isinstance(other, JetStore) and os.path.abspath(other.path) == os.path.abspath(self.path):
+            return JetStore(self.path, np.concatenate([self.indices, other.indices]))
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __getstate__(self):
+        # never pickle the memory maps themselves, reopen them on the other side
+        return dict(path=self.path, indices=self.indices)
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['indices'])
+
+
+class JetStoreWriter:
+    '''
+    Write jet dicts to a JetStore directory in chunks.
+
+    Each column is appended to its own binary file as chunks arrive, so a
+    store can be filled from a stream of jets without holding the whole
+    dataset in memory. meta.json is written on close().
+    '''
+    def __init__(self, path, jet_class='jet'):
+        self.path = path
+        self.jet_class = jet_class
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.files = {}
+        self.shapes = {}
+        self.progenitors = {}
+        self.n_jets = 0
+        self.n_constituents = 0
+        self.n_nodes = 0
+        self.tree_schedule_version = None
+        self.write('constituent_offsets', np.zeros(1))
+
+    def write(self, name, array):
+        array = np.ascontiguousarray(array, dtype=COLUMN_DTYPES[name])
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.path, name + '.bin'), 'wb')
+            self.shapes[name] = [0] + list(array.shape[1:])
+        assert list(array.shape[1:]) == self.shapes[name][1:]
+        self.files[name].write(array.tobytes())
+        self.shapes[name][0] += len(array)
+
+    def append(self, jet_dicts):
+        if len(jet_dicts) == 0:
+            return
+
+        lengths = np.array([len(jd['constituents']) for jd in jet_dicts])
+        self.write('constituents', np.concatenate([jd['constituents'] for jd in jet_dicts], 0))
+        self.write('constituent_offsets', self.n_constituents + np.cumsum(lengths))
+        self.n_constituents += lengths.sum()
+
+        if jet_dicts[0].get('tree', None) is not None:
+            if self.n_jets == 0:
+                self.write('tree_offsets', np.zeros(1))
+            lengths = np.array([len(jd['tree']) for jd in jet_dicts])
+            self.write('tree', np.concatenate([jd['tree'] for jd in jet_dicts], 0))
+            self.write('tree_content', np.concatenate([jd['tree_content'] for jd in jet_dicts], 0))
+            if jet_dicts[0].get('tree_schedule', None) is not None:
+                self.write('tree_schedule', np.concatenate([jd['tree_schedule'] for jd in jet_dicts], 0))
+                self.tree_schedule_version = jet_dicts[0]['tree_schedule_version']
+            self.write('tree_offsets', self.n_nodes + np.cumsum(lengths))
+            self.n_nodes += lengths.sum()
+
+        for name in SCALAR_COLUMNS + QUARK_GLUON_COLUMNS:
+            if jet_dicts[0].get(name, None) is not None:
+                self.write(name, np.array([jd[name] for jd in jet_dicts]))
+
+        for jd in jet_dicts:
+            self.progenitors[str(int(jd['y']))] = jd.get('progenitor', None)
+        self.n_jets += len(jet_dicts)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        meta = dict(
+            version=STORE_VERSION,
+            jet_class=self.jet_class,
+            n_jets=int(self.n_jets),
+            progenitors=self.progenitors,
+            tree_schedule_version=self.tree_schedule_version,
+            columns={
+                name: dict(dtype=np.dtype(COLUMN_DTYPES[name]).name, shape=[int(s) for s in shape])
+                for name, shape in self.shapes.items()
+            }
+        )
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,148 @@
+import numpy as np
+import torch
+
+
+class RaggedJetBatch:
+    '''
+    Batch of jets of varying sizes, stored without padding.
+
+    The constituents of all jets are stacked in one flat [n_constituents, F]
+    tensor, and jet i owns rows offsets[i]:offsets[i+1]. This is what the
+    loaders collate and what is copied to the device.
+
+    Padded views are built on demand, on the device of the batch, and cached,
+    so each module only pays for what it reads:
+        padded <- (B, N_max, F+1) constituents, with a last column set to 1 on
+            padding rows, as produced by pad_tensors
+        node_mask <- (B, N_max) bool, True on real constituents
+        mask <- (B, N_max, N_max) float, 1 where both nodes are real
+
+    indices holds the index of each jet in its data file when the batch shows
+    the jets exactly as stored, and is None when augmentation changed them,
+    so that anything cached per jet is only reused on unaltered inputs.
+    fingerprints then holds (size, sum of constituents) of every jet, to
+    check cached entries against.
+    '''
+    def __init__(self, constituents, offsets, indices=None, fingerprints=None):
+        self.constituents = constituents
+        self.indices = indices
+        self.fingerprints = fingerprints
+        self.offsets = torch.as_tensor(np.asarray(offsets), dtype=torch.long)
+        lengths = np.diff(np.asarray(offsets))
+        self.max_length = int(lengths.max()) if len(lengths) > 0 else 0
+        self._lengths = torch.from_numpy(lengths).long()
+        self._cache = {}
+
+    @classmethod
+    def from_arrays(cls, constituents, offsets, indices=None):
+        constituents = torch.from_numpy(np.asarray(constituents)).float()
+        fingerprints = None
+        if indices is not None:
+            # computed once on the CPU, where the sums are deterministic
+            lengths = np.diff(offsets)
+            sums = np.zeros(len(lengths))
+            np.add.at(sums, np.repeat(np.arange(len(lengths)), lengths), constituents.numpy().astype(np.float64).sum(1))
+            fingerprints = list(zip(lengths.tolist(), sums.tolist()))
+        return cls(constituents, offsets, indices, fingerprints)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return self._lengths
+
+    @property
+    def device(self):
+        return self.constituents.device
+
+    def _cached(self, name, fn):
+        if name not in self._cache:
+            self._cache[name] = fn()
+        return self._cache[name]
+
+    @property
+    def segment_ids(self):
+        ''' segment_ids[k] is the jet owning constituent k.
+        '''
+        return self._cached('segment_ids', lambda: torch.repeat_interleave(
+            torch.arange(len(self), device=self.device), self.lengths))
+
+    @property
+    def positions(self):
+        ''' positions[k] is the row of constituent k inside its jet.
+        '''
+        return self._cached('positions', lambda: torch.arange(len(self.constituents), device=self.device) - self.offsets[self.segment_ids])
+
+    @property
+    def node_mask(self):
+        return self._cached('node_mask', lambda: torch.arange(self.max_length, device=self.device).unsqueeze(0) < self.lengths.unsqueeze(1))
+
+    @property
+    def padded(self):
+        def pad():
+            n_features = self.constituents.size()[-1]
+            padded = self.constituents.new_zeros(len(self), self.max_length, n_features + 1)
+            padded[self.segment_ids, self.positions, :n_features] = self.constituents
+            padded[:, :, -1] = (~self.node_mask).float()
+            return padded
+        return self._cached('padded', pad)
+
+    @property
+    def mask(self):
+        return self._cached('mask', lambda: (self.node_mask.unsqueeze(2) & self.node_mask.unsqueeze(1)).float())
+
+    @property
+    def nodes(self):
+        ''' (n_constituents, F+1) rows of padded for the real constituents only.
+        '''
+        return self._cached('nodes', lambda: torch.cat([self.constituents, self.constituents.new_zeros(len(self.constituents), 1)], 1))
+
+    def _edge_index(self):
+        # every ordered pair (i, j) of nodes of a same jet, jet after jet,
+        # row-major within a jet: sum(n_i^2) edges instead of B x N_max^2
+        n_pairs = self.lengths.to(self.device) ** 2
+        jet = torch.repeat_interleave(torch.arange(len(self), device=self.device), n_pairs)
+        first = torch.cumsum(n_pairs, 0) - n_pairs
+        k = torch.arange(len(jet), device=self.device) - first[jet]
+        n = self.lengths.to(self.device)[jet]
+        i, j = k // n, k % n
+        offsets = self.offsets[jet]
+        return dict(edges=(offsets + i, offsets + j), edge_transpose=first[jet] + j * n + i)
+
+    @property
+    def edges(self):
+        ''' (rows, cols) global node ids of the block-diagonal graph of the batch.
+
+        Edge e carries a message from node cols[e] to node rows[e], in the
+        way dense adjacency entry A[b, i, j] weighs node j in the update of i.
+        '''
+        if 'edges' not in self._cache:
+            self._cache.update(self._edge_index())
+        return self._cache['edges']
+
+    @property
+    def edge_transpose(self):
+        ''' edge_transpose[e] is the id of the edge going the other way.
+        '''
+        if 'edge_transpose' not in self._cache:
+            self._cache.update(self._edge_index())
+        return self._cache['edge_transpose']
+
+    def _apply(self, fn):
+        batch = RaggedJetBatch.__new__(RaggedJetBatch)
+        batch.constituents = fn(self.constituents)
+        batch.offsets = fn(self.offsets)
+        batch._lengths = fn(self._lengths)
+        batch.max_length = self.max_length
+        batch.indices = self.indices
+        batch.fingerprints = self.fingerprints
+        batch._cache = {}
+        return batch
+
+    def cuda(self, non_blocking=False):
+        return self._apply(lambda x: x.cuda(non_blocking=non_blocking))
+
+    def pin_memory(self):
+        # called by the DataLoader when pin_memory=True
+        return self._apply(lambda x: x.pin_memory())
@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+
+
+class TreeBatch:
+    '''
+    Batch of binary jet trees in a flat, level-major layout for the recursive
+    models.
+
+    Nodes are renumbered level after level from the roots down, and within a
+    level inner nodes come first, then leaves, each in breadth-first order
+    (see level_schedule). Every level is then a contiguous range of rows and
+    the recursion runs on slices and precomputed gathers only:
+        contents <- (n_nodes, F) features of every node
+        children <- (n_nodes, 2) positions in the next level of the left and
+            right children of each inner node, -1 for leaves
+        parents <- (n_nodes,) position in the previous level of the parent of
+            each node, -1 for roots
+        level_starts <- level d holds rows level_starts[d]:level_starts[d+1]
+        n_inners <- the first n_inners[d] rows of level d are inner nodes
+    level_starts and n_inners are python lists, so that walking the levels
+    never reads back from the device. The roots are the first n_jets rows,
+    in jet order when every jet has at least one inner node.
+    '''
+    def __init__(self, contents, children, parents, level_starts, n_inners, n_jets):
+        self.contents = contents
+        self.children = children
+        self.parents = parents
+        self.level_starts = level_starts
+        self.n_inners = n_inners
+        self.n_jets = n_jets
+
+    @classmethod
+    def from_schedule(cls, contents, levels, level_children, n_inners, n_jets):
+        ''' Build the flat layout from the level schedule of level_schedule or
+        merge_tree_schedules and the (n_nodes, F) contents of the original ids.
+        '''
+        sizes = np.array([len(level) for level in levels], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        nodes = np.concatenate(levels) if len(levels) > 0 else np.zeros(0, dtype=np.int64)
+        n_inners = np.asarray(n_inners, dtype=np.int64)
+
+        depth = np.repeat(np.arange(len(levels)), sizes)
+        inner = np.arange(len(nodes)) - starts[depth] < n_inners[depth]
+
+        children = np.full((len(nodes), 2), -1, dtype=np.int64)
+        children[inner] = level_children[nodes[inner]]
+        parents = np.full(len(nodes), -1, dtype=np.int64)
+        rows = starts[depth[inner] + 1][:, None] + children[inner]
+        parents[rows.reshape(-1)] = np.repeat(np.flatnonzero(inner) - starts[depth[inner]], 2)
+
+        return cls(
+            torch.from_numpy(np.asarray(contents)[nodes]).float(),
+            torch.from_numpy(children),
+            torch.from_numpy(parents),
+            starts.tolist(),
+            n_inners.tolist(),
+            n_jets
+        )
+
+    def __len__(self):
+        return self.n_jets
+
+    @property
+    def n_levels(self):
+        return len(self.n_inners)
+
+    def _apply(self, fn):
+        return TreeBatch(fn(self.contents), fn(self.children), fn(self.parents), self.level_starts, self.n_inners, self.n_jets)
+
+    def cuda(self, non_blocking=False):
+        return self._apply(lambda x: x.cuda(non_blocking=non_blocking))
+
+    def pin_memory(self):
+        # called by the DataLoader when pin_memory=True
+        return self._apply(lambda x: x.pin_memory())
@@ -1,5 +1,9 @@
+import logging
 import pickle
+import numpy as np
 from .Jet import Jet, QuarkGluonJet
+from .JetStore import JetStore, JetStoreWriter
+from .trees import tree_schedules, SCHEDULE_VERSION
 
 def save_jets_to_pickle(jets, filename):
     jet_dicts = [vars(jet) for jet in jets]
@@ -23,3 +27,46 @@ def load_jets_from_pickle(filename):
         JetClass = Jet
     jets = [JetClass(**jd) for jd in jet_dicts]
     return jets
+
+def save_jet_dicts_to_store(jet_dicts, path, jet_class='jet', chunk_size=10000):
+    with JetStoreWriter(path, jet_class) as writer:
+        for i in range(0, len(jet_dicts), chunk_size):
+            writer.append(jet_dicts[i:i+chunk_size])
+
+def convert_pickle_to_store(filename, path):
+    jet_dicts = load_jet_dicts_from_pickle(filename)
+    jet_class = 'quark_gluon' if 'quark-gluon' in filename else 'jet'
+    save_jet_dicts_to_store(jet_dicts, path, jet_class)
+
+def load_jets_from_store(path):
+    return JetStore(path)
+
+def refresh_tree_schedules(jets, filename, chunk_size=10000):
+    ''' Rebuild cached tree schedules that are missing or were built by an older version.
+
+    Pickled jets are updated and saved back to filename; a JetStore gets its
+    tree_schedule column rewritten. Returns the (possibly reopened) jets.
+    '''
+    if isinstance(jets, JetStore):
+        if not jets.has_tree or jets.meta.get('tree_schedule_version', None) == SCHEDULE_VERSION:
+            return jets
+        logging.warning("\tRebuilding stale tree schedules in {}".format(jets.path))
+        store = JetStore(jets.path)
+        schedules = []
+        for i in range(0, len(store), chunk_size):
+            chunk = [store[j] for j in range(i, min(i + chunk_size, len(store)))]
+            schedules.extend(tree_schedules([jet.tree for jet in chunk], [jet.root_id for jet in chunk]))
+        store.write_column('tree_schedule', np.concatenate(schedules, 0), tree_schedule_version=SCHEDULE_VERSION)
+        return JetStore(jets.path, jets.indices)
+
+    stale = [jet for jet in jets if jet.tree is not None and jet.tree_schedule_version != SCHEDULE_VERSION]
+    if len(stale) == 0:
+        return jets
+    logging.warning("\tRebuilding {} stale tree schedules in {}".format(len(stale), filename))
+    for i in range(0, len(stale), chunk_size):
+        chunk = stale[i:i + chunk_size]
+        for jet, schedule in zip(chunk, tree_schedules([jet.tree for jet in chunk], [jet.root_id for jet in chunk])):
+            jet.tree_schedule = schedule
+            jet.tree_schedule_version = SCHEDULE_VERSION
+    save_jets_to_pickle(jets, filename)
+    return jets
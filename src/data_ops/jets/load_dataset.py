@@ -4,16 +4,30 @@ import pickle
 import numpy as np
 
 from .io import load_jets_from_pickle, save_jets_to_pickle
+from .io import load_jets_from_store, convert_pickle_to_store
+from .io import refresh_tree_schedules
 from .JetDataset import JetDataset
 
-def load_jets(data_dir, filename, redo=False):
+def load_jets(data_dir, filename, redo=False, preprocessing_workers=0, columnar=False):
     #preprocessed_dir = os.path.join(data_dir, 'preprocessed')
 
     raw_data_dir = os.path.join(data_dir, 'raw')
     preprocessed_dir = os.path.join(data_dir, 'preprocessed')
     path_to_preprocessed = os.path.join(preprocessed_dir, filename)
+    path_to_store = os.path.splitext(path_to_preprocessed)[0] + '.store'
+    store_exists = os.path.exists(os.path.join(path_to_store, 'meta.json'))
 
-    if not os.path.exists(path_to_preprocessed) or redo:
+    if columnar and not store_exists and os.path.exists(path_to_preprocessed) and not redo:
+        logging.warning("\tConverting {} to a columnar jet store".format(path_to_preprocessed))
+        convert_pickle_to_store(path_to_preprocessed, path_to_store)
+        store_exists = True
+
+    if columnar:
+        path_to_preprocessed, preprocessed = path_to_store, store_exists
+    else:
+        preprocessed = os.path.exists(path_to_preprocessed)
+
+    if not preprocessed or redo:
         if not os.path.exists(preprocessed_dir):
             os.makedirs(preprocessed_dir)
 
@@ -26,25 +40,31 @@ def load_jets(data_dir, filename, redo=False):
         else:
             raise ValueError('Unrecognized data_dir!')
 
-        preprocess(raw_data_dir, preprocessed_dir, filename)
+        preprocess(raw_data_dir, preprocessed_dir, filename, n_workers=preprocessing_workers, columnar=columnar)
 
         logging.warning("\tPreprocessed the data and saved it to {}".format(path_to_preprocessed))
     else:
         logging.warning("\tData at {} and already preprocessed".format(path_to_preprocessed))
 
-    jets = load_jets_from_pickle(path_to_preprocessed)
+    if columnar:
+        jets = load_jets_from_store(path_to_store)
+    else:
+        jets = load_jets_from_pickle(path_to_preprocessed)
+        for i, jet in enumerate(jets):
+            jet.index = i
+    jets = refresh_tree_schedules(jets, path_to_preprocessed)
     logging.warning("\tSuccessfully loaded data")
     return jets
 
 
-def load_train_dataset(data_dir, filename, n_train, n_valid, redo, no_cropped):
+def load_train_dataset(data_dir, filename, n_train, n_valid, redo, no_cropped, preprocessing_workers=0, columnar=False):
     problem = data_dir.split('/')[-1]
     subproblem = filename
 
     logging.warning("\n")
     logging.warning("Loading data...")
     filename = "{}-train.pickle".format(filename)
-    jets = load_jets(data_dir, filename, redo)
+    jets = load_jets(data_dir, filename, redo, preprocessing_workers, columnar)
 
     logging.warning("Found {} jets in total".format(len(jets)))
 
@@ -85,11 +105,11 @@ def load_train_dataset(data_dir, filename, n_train, n_valid, redo, no_cropped):
 
     return train_dataset, valid_dataset
 
-def load_test_dataset(data_dir, filename, n_test, redo):
+def load_test_dataset(data_dir, filename, n_test, redo, preprocessing_workers=0, columnar=False):
     logging.warning("\n")
     logging.warning("Loading test data...")
     filename = "{}-test.pickle".format(filename)
-    jets = load_jets(data_dir, filename, redo)
+    jets = load_jets(data_dir, filename, redo, preprocessing_workers, columnar)
     jets = jets[:n_test]
 
     dataset = JetDataset(jets)
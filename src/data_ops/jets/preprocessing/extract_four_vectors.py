@@ -4,28 +4,55 @@ def extract_four_vectors(four_vectors):
     ''' Convert an array of four-vectors into 7-dim jet constituent representation.
     '''
     assert four_vectors.shape[1] == 4
+    offsets = np.array([0, len(four_vectors)])
+    return extract_four_vectors_batch(four_vectors, offsets)
+
+def extract_four_vectors_batch(four_vectors, offsets):
+    ''' Convert the four-vectors of many jets into the 7-dim constituent
+    representation in a single pass.
+
+    Inputs:
+        four_vectors <- (n_constituents, 4) array of (px, py, pz, E), the
+            constituents of all jets stacked one jet after the other
+        offsets <- (n_jets + 1) array, jet i owns rows offsets[i]:offsets[i+1]
+    Output:
+        content <- (n_constituents, 7) array, rows in the same order as the input
+    '''
+    four_vectors = np.asarray(four_vectors, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    assert four_vectors.shape[1] == 4
+    assert offsets[0] == 0 and offsets[-1] == len(four_vectors)
 
     content = np.zeros((len(four_vectors), 7))
+    if len(four_vectors) == 0:
+        return content
+
+    px = four_vectors[:, 0]
+    py = four_vectors[:, 1]
+    pz = four_vectors[:, 2]
+    E = four_vectors[:, 3]
 
-    for i in range(len(four_vectors)):
-        px = four_vectors[i, 0]
-        py = four_vectors[i, 1]
-        pz = four_vectors[i, 2]
-        E = four_vectors[i, 3]
-        total_E = sum(four_vectors[:, 3])
+    # per-jet energy totals as a segment reduction over the flat array
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    total_E = np.zeros(len(lengths))
+    total_E[nonempty] = np.add.reduceat(E, offsets[:-1][nonempty])
+    total_E = np.repeat(total_E, lengths)
 
-        p = (four_vectors[i, 0:3] ** 2).sum() ** 0.5
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        p = (four_vectors[:, 0:3] ** 2).sum(1) ** 0.5
         eta = 0.5 * (np.log(p + pz) - np.log(p - pz))
         theta = 2 * np.arctan(np.exp(-eta))
         pt = p / np.cosh(eta)
         phi = np.arctan2(py, px)
+        e_fraction = E / total_E
 
-        content[i, 0] = p
-        content[i, 1] = eta if np.isfinite(eta) else 0.0
-        content[i, 2] = phi
-        content[i, 3] = E
-        content[i, 4] = E / total_E
-        content[i, 5] = pt if np.isfinite(pt) else 0.0
-        content[i, 6] = theta if np.isfinite(theta) else 0.0
+    content[:, 0] = p
+    content[:, 1] = np.where(np.isfinite(eta), eta, 0.0)
+    content[:, 2] = phi
+    content[:, 3] = E
+    content[:, 4] = e_fraction
+    content[:, 5] = np.where(np.isfinite(pt), pt, 0.0)
+    content[:, 6] = np.where(np.isfinite(theta), theta, 0.0)
 
     return content
@@ -2,77 +2,106 @@
 import torch
 import os
 import pickle
+import shutil
 
 import numpy as np
-from .extract_four_vectors import extract_four_vectors
+from .extract_four_vectors import extract_four_vectors_batch
+from .sharding import split_into_shards, map_shards, merge_shards, fit_scaler
+from .sharding import iter_chunks, imap_shards, reservoir_sample_rows
 from ..io import save_jet_dicts_to_pickle
+from ..JetStore import JetStore, JetStoreWriter
 
 from sklearn.preprocessing import RobustScaler
 
-def process_textfile(contents):
-    jet_contents = []
-
-    line_index = 0
-    contents = [''] + contents
-    while line_index < len(contents):
-        line = contents[line_index]
-        if len(line) == 0:
-            counter = 0
-            line_index += 1
-            header = contents[line_index]
-            if len(header) == 0:
-                break
+def iter_entries(lines):
+    ''' Yield (constituent lines, header line) for each jet in a stream of lines.
+
+    Jets are separated by a blank line and the stream ends at the first
+    empty header, so this consumes one jet at a time from an open file.
+    '''
+    header = None
+    constituents = []
+    for line in lines:
+        line = line.strip()
+        if header is None:
+            if len(line) == 0:
+                return
+            header = line
+        elif len(line) == 0:
+            yield constituents, header
+            header = None
             constituents = []
-            line_index += 1
-            line = contents[line_index]
-            while len(line) > 0:
-                constituents.append(line)
-                counter += 1
-                line_index += 1
-                line = contents[line_index]
-            jet_contents.append((constituents, header))
-    return jet_contents
+        else:
+            constituents.append(line)
+    if header is not None:
+        yield constituents, header
 
+def process_textfile(contents):
+    return list(iter_entries(contents))
 
-def convert_to_jet_dict(entry, progenitor, y, env):
+
+def parse_entry(entry):
     constituents, header = entry
 
-    header = [float(x) for x in header.split('\t')]
+    # bulk conversion of the whole block of constituent lines
+    header = np.fromstring(header, sep='\t').tolist()
+    if len(constituents) > 0:
+        constituents = np.fromstring('\t'.join(constituents), sep='\t').reshape(len(constituents), -1)
+    else:
+        constituents = np.zeros((0, 4))
 
-    (mass,
-    photon_pt,
-    photon_eta,
-    photon_phi,
-    jet_pt,
-    jet_eta,
-    jet_phi,
-    n_constituents
-    ) = header
+    return constituents, header
 
-    constituents = [[float(x) for x in particle.split('\t')] for particle in constituents]
-    constituents = extract_four_vectors(np.array(constituents))
 
-    assert len(constituents) == n_constituents
+def convert_to_jet_dict(entry, progenitor, y, env):
+    return convert_to_jet_dicts([entry], progenitor, y, env)[0]
 
-    jet_dict = dict(
-        progenitor=progenitor,
-        constituents=constituents,
-        mass=mass,
-        photon_pt=photon_pt,
-        photon_eta=photon_eta,
-        photon_phi=photon_phi,
-        pt=jet_pt,
-        eta=jet_eta,
-        phi=jet_phi,
-        y=y,
-        env=env
-    )
-    return jet_dict
+
+def convert_to_jet_dicts(entries, progenitor, y, env):
+    parsed = [parse_entry(entry) for entry in entries]
+    if len(parsed) == 0:
+        return []
+
+    # extract the constituent features of all jets in one pass
+    lengths = [len(constituents) for constituents, _ in parsed]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    four_vectors = np.vstack([constituents.reshape(-1, 4) for constituents, _ in parsed])
+    all_constituents = np.split(extract_four_vectors_batch(four_vectors, offsets), offsets[1:-1])
+
+    jet_dicts = []
+    for (_, header), constituents in zip(parsed, all_constituents):
+        (mass,
+        photon_pt,
+        photon_eta,
+        photon_phi,
+        jet_pt,
+        jet_eta,
+        jet_phi,
+        n_constituents
+        ) = header
+
+        assert len(constituents) == n_constituents
+
+        jet_dict = dict(
+            progenitor=progenitor,
+            constituents=constituents,
+            mass=mass,
+            photon_pt=photon_pt,
+            photon_eta=photon_eta,
+            photon_phi=photon_phi,
+            pt=jet_pt,
+            eta=jet_eta,
+            phi=jet_phi,
+            y=y,
+            env=env
+        )
+        jet_dicts.append(jet_dict)
+    return jet_dicts
 
 
 
 
-def make_jet_dicts_from_textfile(filename):
+def parse_filename(filename):
     tail = filename.split('/')[-1]
     if 'quark' in tail:
         progenitor = 'quark'
@@ -88,21 +117,35 @@ def make_jet_dicts_from_textfile(filename):
         env = 1
     else:
         raise ValueError('unrecognised env')
+    return progenitor, y, env
 
-    with open(filename, 'r') as f:
-        contents = [l.strip() for l in f.read().split('\n')]
+def make_jet_dicts_from_textfile(filename, n_workers=0, shard_size=10000):
+    progenitor, y, env = parse_filename(filename)
 
-    entries = process_textfile(contents)
+    with open(filename, 'r') as f:
+        entries = process_textfile(f)
 
-    jet_dicts = []
-    for entry in entries:
-        jet_dict = convert_to_jet_dict(entry, progenitor, y, env)
-        jet_dicts.append(jet_dict)
+    shards = split_into_shards(entries, shard_size)
+    shard_outputs = map_shards(convert_to_jet_dicts, shards, n_workers, progenitor=progenitor, y=y, env=env)
+    jet_dicts = merge_shards(shard_outputs)
 
 
     return jet_dicts
 
-def preprocess(raw_data_dir, preprocessed_dir, filename):
+def iter_jet_dicts_from_textfile(filename, n_workers=0, shard_size=10000):
+    ''' Yield lists of at most shard_size jet dicts, reading the file lazily.
+    '''
+    progenitor, y, env = parse_filename(filename)
+
+    with open(filename, 'r') as f:
+        shards = iter_chunks(iter_entries(f), shard_size)
+        for jet_dicts in imap_shards(convert_to_jet_dicts, shards, n_workers, progenitor=progenitor, y=y, env=env):
+            yield jet_dicts
+
+def preprocess(raw_data_dir, preprocessed_dir, filename, n_workers=0, shard_size=10000, columnar=False):
+    if columnar:
+        return preprocess_to_store(raw_data_dir, preprocessed_dir, filename, n_workers, shard_size)
+
     #raw_data_dir = os.path.join(data_dir, 'raw')
     #preprocessed_dir = os.path.join(data_dir, 'preprocessed')
 
@@ -110,8 +153,8 @@ def preprocess(raw_data_dir, preprocessed_dir, filename):
     quark_filename = os.path.join(raw_data_dir, 'quark_' + env_type + '.txt')
     gluon_filename = os.path.join(raw_data_dir, 'gluon_' + env_type + '.txt')
 
-    quark_jet_dicts = make_jet_dicts_from_textfile(quark_filename)
-    gluon_jet_dicts = make_jet_dicts_from_textfile(gluon_filename)
+    quark_jet_dicts = make_jet_dicts_from_textfile(quark_filename, n_workers, shard_size)
+    gluon_jet_dicts = make_jet_dicts_from_textfile(gluon_filename, n_workers, shard_size)
     jet_dicts = quark_jet_dicts + gluon_jet_dicts
 
     perm = np.random.permutation(len(jet_dicts))
@@ -123,7 +166,7 @@ def preprocess(raw_data_dir, preprocessed_dir, filename):
     test_jet_dicts = jet_dicts[:n_test]
     train_jet_dicts = jet_dicts[n_test:]
 
-    tf = RobustScaler().fit(np.vstack([jet_dict['constituents'] for jet_dict in train_jet_dicts]))
+    tf = fit_scaler([train_jet_dicts])
 
     new_test_jet_dicts, new_train_jet_dicts = [], []
     for i, jet_dict in enumerate(jet_dicts):
@@ -137,4 +180,48 @@ def preprocess(raw_data_dir, preprocessed_dir, filename):
     save_jet_dicts_to_pickle(new_test_jet_dicts, os.path.join(preprocessed_dir, env_type + '-test.pickle'))
 
 
+    return None
+
+def preprocess_to_store(raw_data_dir, preprocessed_dir, filename, n_workers=0, shard_size=10000, scaler_rows=1000000):
+    ''' Streaming version of preprocess that writes columnar jet stores.
+
+    The raw text files are parsed one shard of jets at a time and appended to
+    an unscaled store. The train/test split and the RobustScaler fit are then
+    done from that store's memory maps, and the scaled jets are written out
+    shard by shard, so memory never depends on the size of the text files.
+    '''
+    env_type = filename.split('-')[0]
+    quark_filename = os.path.join(raw_data_dir, 'quark_' + env_type + '.txt')
+    gluon_filename = os.path.join(raw_data_dir, 'gluon_' + env_type + '.txt')
+
+    unscaled_path = os.path.join(preprocessed_dir, env_type + '-unscaled.store')
+    with JetStoreWriter(unscaled_path, 'quark_gluon') as writer:
+        for raw_filename in [quark_filename, gluon_filename]:
+            for jet_dicts in iter_jet_dicts_from_textfile(raw_filename, n_workers, shard_size):
+                writer.append(jet_dicts)
+    jets = JetStore(unscaled_path)
+
+    perm = np.random.permutation(len(jets))
+
+    # split into train and test
+    test_fraction = 0.1
+    n_test = int(len(jets) * test_fraction)
+
+    # fit the scaler on a bounded sample of the training constituents only
+    is_train = np.ones(len(jets), dtype=bool)
+    is_train[perm[:n_test]] = False
+    sample = reservoir_sample_rows(jets.columns['constituents'], jets.columns['constituent_offsets'], is_train, scaler_rows, shard_size)
+    tf = RobustScaler().fit(sample)
+
+    for split, indices in [('test', perm[:n_test]), ('train', perm[n_test:])]:
+        path = os.path.join(preprocessed_dir, env_type + '-' + split + '.store')
+        with JetStoreWriter(path, 'quark_gluon') as writer:
+            for chunk in split_into_shards(indices, shard_size):
+                jet_dicts = [vars(jet) for jet in jets[chunk]]
+                for jet_dict in jet_dicts:
+                    jet_dict['constituents'] = tf.transform(jet_dict['constituents'])
+                writer.append(jet_dicts)
+
+    shutil.rmtree(unscaled_path)
+
     return None
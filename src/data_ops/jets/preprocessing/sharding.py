@@ -0,0 +1,89 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+import numpy as np
+from sklearn.preprocessing import RobustScaler
+
+def split_into_shards(items, shard_size):
+    ''' Split a sequence into consecutive chunks of at most shard_size items.
+    '''
+    shard_size = max(int(shard_size), 1)
+    return [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+
+def map_shards(fn, shards, n_workers=0, **kwargs):
+    ''' Apply fn(shard, **kwargs) to every shard and return the outputs in shard order.
+
+    With n_workers > 1 the shards are converted in a ProcessPoolExecutor, so fn
+    must be a module-level function. executor.map yields results in submission
+    order, which keeps the merged output independent of worker scheduling.
+    '''
+    fn = partial(fn, **kwargs)
+    if n_workers is None or n_workers <= 1 or len(shards) <= 1:
+        return [fn(shard) for shard in shards]
+
+    logging.warning("\tConverting {} shards on {} workers".format(len(shards), n_workers))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(fn, shards))
+
+def iter_chunks(iterable, chunk_size):
+    ''' Lazily group an iterable into lists of at most chunk_size items.
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def imap_shards(fn, shards, n_workers=0, **kwargs):
+    ''' Streaming version of map_shards over an iterable of shards.
+
+    At most n_workers shards are read ahead and in flight at once, so memory
+    stays bounded by the window size rather than the length of the stream.
+    '''
+    fn = partial(fn, **kwargs)
+    if n_workers is None or n_workers <= 1:
+        for shard in shards:
+            yield fn(shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for window in iter_chunks(shards, n_workers):
+            for output in executor.map(fn, window):
+                yield output
+
+def merge_shards(shard_outputs):
+    ''' Concatenate per-shard lists of jet dicts in shard order.
+    '''
+    return [jet_dict for shard in shard_outputs for jet_dict in shard]
+
+def fit_scaler(shard_outputs):
+    ''' Second pass over the converted shards: fit a RobustScaler on all constituents.
+    '''
+    return RobustScaler().fit(np.vstack([jet_dict['constituents'] for shard in shard_outputs for jet_dict in shard]))
+
+def reservoir_sample_rows(rows, offsets, keep, n_samples, chunk_size=10000, rng=None):
+    ''' Uniform sample of at most n_samples rows from the jets flagged in keep.
+
+    rows is a flat (possibly memory-mapped) array of constituents and offsets
+    the jet boundaries into it. Jets are read chunk_size at a time and the
+    selected rows fed through a reservoir (algorithm R), so memory is bounded
+    by n_samples and one chunk regardless of the size of rows.
+    '''
+    rng = np.random.default_rng() if rng is None else rng
+    reservoir = np.empty((n_samples,) + rows.shape[1:], dtype=rows.dtype)
+    n_seen = 0
+    for start in range(0, len(keep), chunk_size):
+        stop = min(start + chunk_size, len(keep))
+        chunk = np.asarray(rows[offsets[start]:offsets[stop]])
+        chunk = chunk[np.repeat(keep[start:stop], np.diff(offsets[start:stop + 1]))]
+
+        seen = n_seen + np.arange(len(chunk))
+        slots = np.where(seen < n_samples, seen, np.floor(rng.random(len(chunk)) * (seen + 1)).astype(np.int64))
+        selected = slots < n_samples
+        # later rows overwrite earlier ones on repeated slots, as in the sequential algorithm
+        reservoir[slots[selected]] = chunk[selected]
+        n_seen += len(chunk)
+    return reservoir[:min(n_seen, n_samples)]
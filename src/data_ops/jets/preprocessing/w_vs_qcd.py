@@ -2,17 +2,10 @@ import os
 import pickle
 import numpy as np
 
-from .extract_four_vectors import extract_four_vectors
-from ..io import save_jet_dicts_to_pickle
-
-from sklearn.preprocessing import RobustScaler
-
-def _pt(v):
-    pz = v[2]
-    p = (v[0:3] ** 2).sum() ** 0.5
-    eta = 0.5 * (np.log(p + pz) - np.log(p - pz))
-    pt = p / np.cosh(eta)
-    return pt
+from .extract_four_vectors import extract_four_vectors_batch
+from .. import trees
+from .sharding import split_into_shards, map_shards, merge_shards, fit_scaler
+from ..io import save_jet_dicts_to_pickle, save_jet_dicts_to_store
 
 def permute_by_pt(jet, root_id=None):
     # ensure that the left sub-jet has always a larger pt than the right
@@ -20,19 +13,8 @@ def permute_by_pt(jet, root_id=None):
     if root_id is None:
         root_id = jet["root_id"]
 
-    if jet["tree"][root_id][0] != -1:
-        left = jet["tree"][root_id][0]
-        right = jet["tree"][root_id][1]
-
-        pt_left = _pt(jet["content"][left])
-        pt_right = _pt(jet["content"][right])
-
-        if pt_left < pt_right:
-            jet["tree"][root_id][0] = right
-            jet["tree"][root_id][1] = left
-
-        permute_by_pt(jet, left)
-        permute_by_pt(jet, right)
+    levels = trees.bfs_levels(jet["tree"], [root_id])
+    trees.permute_by_pt(jet["content"], jet["tree"], levels)
 
     return jet
 
@@ -42,19 +24,8 @@ def rewrite_content(jet):
     if jet["content"].shape[1] == 5:
         pflow = jet["content"][:, 4].copy()
 
-    content = jet["content"]
-    tree = jet["tree"]
-
-    def _rec(i):
-        if tree[i, 0] == -1:
-            pass
-        else:
-            _rec(tree[i, 0])
-            _rec(tree[i, 1])
-            c = content[tree[i, 0]] + content[tree[i, 1]]
-            content[i] = c
-
-    _rec(jet["root_id"])
+    levels = trees.bfs_levels(jet["tree"], [jet["root_id"]])
+    trees.rewrite_contents(jet["content"], jet["tree"], levels)
 
     if jet["content"].shape[1] == 5:
         jet["content"][:, 4] = pflow
@@ -62,52 +33,80 @@ def rewrite_content(jet):
     return jet
 
 def convert_to_jet_dict(x, y):
-    x = permute_by_pt(rewrite_content(x))
-
-    tree_content = x['content']
-    tree = x['tree']
-    root_id = x['root_id']
-    eta = x['eta']
-    phi = x['phi']
-    pt = x['pt']
-    mass = x['mass']
-
-    outers = [node for node in range(len(x['content'])) if x['tree'][node,0] == -1]
-    tree_content = extract_four_vectors(tree_content)
-    constituents = np.stack([tree_content[i] for i in outers], 0)
-    #constituents = extract_four_vectors(np.stack([tree_content[i] for i in outers], 0))
-    progenitor = 'w' if y == 1 else 'qcd'
-
-    jet_dict = dict(
-        progenitor=progenitor,
-        constituents=constituents,
-        mass=mass,
-        pt=pt,
-        eta=eta,
-        phi=phi,
-        y=y,
-        tree=tree,
-        root_id=root_id,
-        tree_content=tree_content
-    )
-    
-    return jet_dict
-
-def preprocess(raw_data_dir, preprocessed_dir, filename):
+    return convert_to_jet_dicts([x], [y])[0]
+
+def convert_to_jet_dicts(X, Y):
+    if len(X) == 0:
+        return []
+
+    contents, canonical_trees = trees.canonicalize_trees(
+        [x['content'] for x in X], [x['tree'] for x in X], [x['root_id'] for x in X])
+    schedules = trees.tree_schedules(canonical_trees, [x['root_id'] for x in X])
+    for x, content, tree in zip(X, contents, canonical_trees):
+        x['content'] = content
+        x['tree'] = tree
+
+    # extract the features of every tree node of every jet in one pass
+    lengths = [len(x['content']) for x in X]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    four_vectors = np.vstack([x['content'] for x in X])
+    all_tree_content = np.split(extract_four_vectors_batch(four_vectors, offsets), offsets[1:-1])
+
+    jet_dicts = []
+    for x, y, tree_content, tree_schedule in zip(X, Y, all_tree_content, schedules):
+        tree = x['tree']
+        root_id = x['root_id']
+        eta = x['eta']
+        phi = x['phi']
+        pt = x['pt']
+        mass = x['mass']
+
+        outers = np.flatnonzero(tree[:, 0] == -1)
+        constituents = tree_content[outers]
+        #constituents = extract_four_vectors(np.stack([tree_content[i] for i in outers], 0))
+        progenitor = 'w' if y == 1 else 'qcd'
+
+        jet_dict = dict(
+            progenitor=progenitor,
+            constituents=constituents,
+            mass=mass,
+            pt=pt,
+            eta=eta,
+            phi=phi,
+            y=y,
+            tree=tree,
+            root_id=root_id,
+            tree_content=tree_content,
+            tree_schedule=tree_schedule,
+            tree_schedule_version=trees.SCHEDULE_VERSION
+        )
+        jet_dicts.append(jet_dict)
+
+    return jet_dicts
+
+def convert_shard_to_jet_dicts(shard):
+    X, Y = zip(*shard)
+    return convert_to_jet_dicts(X, Y)
+
+def preprocess(raw_data_dir, preprocessed_dir, filename, n_workers=0, shard_size=10000, columnar=False):
 
     raw_filename = os.path.join(raw_data_dir, filename)
     with open(raw_filename, 'rb') as f:
         X, Y = pickle.load(f, encoding='latin-1')
-    jet_dicts = [convert_to_jet_dict(x, y) for x, y in zip(X, Y)]
 
-    new_jet_dicts = []
-    tf = RobustScaler().fit(np.vstack([jet_dict['constituents'] for jet_dict in jet_dicts]))
-    for ij, jet_dict in enumerate(jet_dicts):
+    shards = split_into_shards(list(zip(X, Y)), shard_size)
+    shard_outputs = map_shards(convert_shard_to_jet_dicts, shards, n_workers)
+
+    tf = fit_scaler(shard_outputs)
+    jet_dicts = merge_shards(shard_outputs)
+    for jet_dict in jet_dicts:
         jet_dict['constituents'] = tf.transform(jet_dict['constituents'])
-        new_jet_dicts.append(jet_dict)
-    jet_dicts = new_jet_dicts
 
-    save_jet_dicts_to_pickle(jet_dicts, os.path.join(preprocessed_dir, filename))
+    if columnar:
+        path_to_store = os.path.join(preprocessed_dir, os.path.splitext(filename)[0] + '.store')
+        save_jet_dicts_to_store(jet_dicts, path_to_store, 'jet', shard_size)
+    else:
+        save_jet_dicts_to_pickle(jet_dicts, os.path.join(preprocessed_dir, filename))
 
 
     return None
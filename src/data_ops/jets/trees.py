@@ -0,0 +1,211 @@
+import numpy as np
+
+'''
+Array-based traversal of batches of binary jet trees.
+
+A batch of trees is held as one flat children array of shape [n_nodes, 2],
+where children[node] holds the global ids of the left and right children of
+node (or -1, -1 for a leaf), plus the global ids of the roots. Instead of
+recursing node by node, the traversals below work on whole levels at a time:
+the breadth-first order of the batch is an explicit list of node arrays, read
+top-down for pre-order work and bottom-up for post-order work.
+'''
+
+# Bump whenever the layout or the meaning of a cached tree schedule changes,
+# so that schedules stored by an older preprocessing are rebuilt on load.
+SCHEDULE_VERSION = 1
+
+def concatenate_trees(trees, root_ids):
+    ''' Reindex the local node ids of several trees into one flat children array.
+
+    Returns (children, roots, offsets) where offsets[i] is the global id of
+    the first node of tree i.
+    '''
+    lengths = np.array([len(tree) for tree in trees], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    if len(trees) == 0:
+        return np.zeros((0, 2), dtype=np.int64), offsets, offsets
+
+    children = np.concatenate([np.asarray(tree).reshape(-1, 2) for tree in trees], 0).astype(np.int64)
+    node_offsets = np.repeat(offsets, lengths)
+    inner = children[:, 0] != -1
+    children[inner] += node_offsets[inner, None]
+    roots = np.asarray(root_ids, dtype=np.int64) + offsets
+    return children, roots, offsets
+
+def bfs_levels(children, roots):
+    ''' Breadth-first levels of a batch of trees.
+
+    levels[d] holds the ids of all nodes at depth d. Within a level, nodes are
+    ordered by tree, then in the order a per-tree BFS queue would visit them
+    (left child before right child).
+    '''
+    levels = []
+    frontier = np.asarray(roots, dtype=np.int64)
+    while len(frontier) > 0:
+        levels.append(frontier)
+        inner = frontier[children[frontier, 0] != -1]
+        frontier = children[inner].reshape(-1)
+    return levels
+
+def node_pt(content):
+    ''' Transverse momentum of each row of an array of (px, py, pz, E, ...) vectors.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        pz = content[:, 2]
+        p = (content[:, 0:3] ** 2).sum(1) ** 0.5
+        eta = 0.5 * (np.log(p + pz) - np.log(p - pz))
+        pt = p / np.cosh(eta)
+    return pt
+
+def rewrite_contents(content, children, levels):
+    ''' Post-order pass: set every inner node to the sum of its children, in place.
+    '''
+    for level in levels[::-1]:
+        inner = level[children[level, 0] != -1]
+        content[inner] = content[children[inner, 0]] + content[children[inner, 1]]
+    return content
+
+def permute_by_pt(content, children, levels):
+    ''' Swap children in place so that the left child always has the larger pt.
+    '''
+    nodes = np.concatenate(levels) if len(levels) > 0 else np.zeros(0, dtype=np.int64)
+    inner = nodes[children[nodes, 0] != -1]
+    pt = node_pt(content)
+    swap = inner[pt[children[inner, 0]] < pt[children[inner, 1]]]
+    children[swap] = children[swap][:, ::-1]
+    return children
+
+def canonicalize_trees(contents, trees, root_ids):
+    ''' Rewrite inner-node contents bottom-up and order children by pt for a batch of trees.
+
+    Returns new per-tree (content, tree) arrays; the inputs are left untouched.
+    A fifth content column (particle-flow id) is not summed, matching the
+    per-jet preprocessing.
+    '''
+    children, roots, offsets = concatenate_trees(trees, root_ids)
+    if len(contents) == 0:
+        return [], []
+    content = np.concatenate(contents, 0)
+
+    if content.shape[1] == 5:
+        pflow = content[:, 4].copy()
+
+    levels = bfs_levels(children, roots)
+    rewrite_contents(content, children, levels)
+    permute_by_pt(content, children, levels)
+
+    if content.shape[1] == 5:
+        content[:, 4] = pflow
+
+    # back to local ids
+    node_offsets = np.repeat(offsets, [len(tree) for tree in trees])
+    inner = children[:, 0] != -1
+    children[inner] -= node_offsets[inner, None]
+
+    split = offsets[1:]
+    new_contents = np.split(content, split)
+    new_trees = [tree.astype(np.asarray(old).dtype) for tree, old in zip(np.split(children, split), trees)]
+    return new_contents, new_trees
+
+def level_schedule(children, roots):
+    ''' Level-wise execution schedule of a batch of trees for the recursive models.
+
+    Returns (levels, level_children, n_inners):
+        levels[d] is the array of node ids at depth d, inner nodes first, then
+            leaves, each group in breadth-first order
+        level_children[node] holds the positions in levels[d+1] of the left and
+            right children of an inner node at depth d, and -1 for leaves
+        n_inners[d] is the number of inner nodes at depth d
+    '''
+    bfs = bfs_levels(children, roots)
+    if len(bfs) == 0:
+        return [], np.full((len(children), 2), -1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    level_sizes = np.array([len(level) for level in bfs])
+    nodes = np.concatenate(bfs)
+    depth = np.repeat(np.arange(len(bfs)), level_sizes)
+    is_leaf = children[nodes, 0] == -1
+
+    # stable sort keeps the BFS order inside each (depth, inner/leaf) group
+    order = np.argsort(2 * depth + is_leaf, kind='stable')
+    nodes = nodes[order]
+    level_starts = np.concatenate([[0], np.cumsum(level_sizes)[:-1]])
+    position = np.zeros(len(children), dtype=np.int64)
+    position[nodes] = np.arange(len(nodes)) - level_starts[depth[order]]
+
+    n_inners = np.bincount(depth[~is_leaf], minlength=len(bfs))
+    levels = np.split(nodes, np.cumsum(level_sizes)[:-1])
+
+    level_children = np.full((len(children), 2), -1, dtype=np.int64)
+    inner = nodes[~is_leaf[order]]
+    level_children[inner] = position[children[inner]]
+
+    return levels, level_children, n_inners
+
+def tree_schedules(trees, root_ids):
+    ''' Per-jet level schedules, cached next to the trees at preprocessing time.
+
+    Returns one int32 array of shape [n_nodes, 3] per tree, where row i holds
+        0: the depth of node i (-1 if unreachable from the root)
+        1: the position of node i among the nodes of its tree with the same
+           depth and the same inner/leaf type, in breadth-first order
+        2: 1 if node i is a leaf, 0 otherwise
+    '''
+    children, roots, offsets = concatenate_trees(trees, root_ids)
+    lengths = [len(tree) for tree in trees]
+    jet_of_node = np.repeat(np.arange(len(trees)), lengths)
+
+    depth = np.full(len(children), -1, dtype=np.int64)
+    bfs = bfs_levels(children, roots)
+    for d, level in enumerate(bfs):
+        depth[level] = d
+    is_leaf = (children[:, 0] == -1).astype(np.int64)
+
+    # group nodes by (depth, inner/leaf, tree), keeping the BFS order inside groups
+    nodes = np.concatenate(bfs) if len(bfs) > 0 else np.zeros(0, dtype=np.int64)
+    nodes = nodes[np.argsort(2 * depth[nodes] + is_leaf[nodes], kind='stable')]
+    group = (2 * depth[nodes] + is_leaf[nodes]) * len(trees) + jet_of_node[nodes]
+    starts = np.concatenate([[True], group[1:] != group[:-1]])
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(nodes)), 0))
+
+    position = np.full(len(children), -1, dtype=np.int64)
+    position[nodes] = np.arange(len(nodes)) - first
+
+    schedule = np.stack([depth, position, is_leaf], 1).astype(np.int32)
+    return np.split(schedule, offsets[1:])
+
+def merge_tree_schedules(children, schedules):
+    ''' Combine cached per-jet schedules into the batch schedule of level_schedule.
+
+    children is the flat children array of the batch (see concatenate_trees)
+    and schedules the matching per-jet outputs of tree_schedules. Only offset
+    arithmetic and one sort are needed, no traversal of the trees.
+    '''
+    lengths = [len(schedule) for schedule in schedules]
+    schedule = np.concatenate(schedules, 0).astype(np.int64)
+    jet_of_node = np.repeat(np.arange(len(schedules)), lengths)
+    depth, local_position, is_leaf = schedule[:, 0], schedule[:, 1], schedule[:, 2]
+
+    nodes = np.flatnonzero(depth >= 0)
+    n_levels = depth.max() + 1 if len(nodes) > 0 else 0
+    group = 2 * depth[nodes] + is_leaf[nodes]
+
+    # counts[j, g] is the number of nodes of jet j in group g = (depth, inner/leaf)
+    counts = np.bincount(jet_of_node[nodes] * 2 * n_levels + group, minlength=len(schedules) * 2 * n_levels)
+    counts = counts.reshape(len(schedules), 2 * n_levels)
+    base = np.cumsum(counts, 0) - counts
+    n_inners = counts[:, 0::2].sum(0)
+    level_sizes = n_inners + counts[:, 1::2].sum(0)
+
+    position = np.zeros(len(children), dtype=np.int64)
+    position[nodes] = base[jet_of_node[nodes], group] + local_position[nodes] + is_leaf[nodes] * n_inners[depth[nodes]]
+
+    nodes = nodes[np.lexsort((position[nodes], depth[nodes]))]
+    levels = np.split(nodes, np.cumsum(level_sizes)[:-1]) if n_levels > 0 else []
+
+    level_children = np.full((len(children), 2), -1, dtype=np.int64)
+    inner = nodes[is_leaf[nodes] == 0]
+    level_children[inner] = position[children[inner]]
+
+    return levels, level_children, n_inners
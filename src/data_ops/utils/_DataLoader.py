@@ -1,8 +1,30 @@
+import numpy as np
+import torch
 from torch.utils.data import DataLoader
 
+def _seed_worker(worker_id):
+    # torch seeds each worker differently, numpy would otherwise inherit the
+    # same state in every forked worker and draw the same permutations
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
 class _DataLoader(DataLoader):
-    def __init__(self, dataset, batch_size):
-        super().__init__(dataset, batch_size, collate_fn=self.collate)
+    '''
+    Collation happens on the CPU, in the worker processes when num_workers > 0,
+    so preprocess_x and preprocess_y must return CPU tensors. Moving a batch to
+    the GPU is left to the consumer (see wrapping.wrap_batch and Prefetcher).
+    '''
+    def __init__(self, dataset, batch_size, batch_sampler=None, num_workers=0, prefetch_factor=2, pin_memory=False):
+        kwargs = dict(
+            collate_fn=self.collate,
+            num_workers=num_workers,
+            pin_memory=pin_memory and torch.cuda.is_available(),
+        )
+        if num_workers > 0:
+            kwargs.update(prefetch_factor=prefetch_factor, worker_init_fn=_seed_worker)
+        if batch_sampler is None:
+            super().__init__(dataset, batch_size, **kwargs)
+        else:
+            super().__init__(dataset, batch_sampler=batch_sampler, **kwargs)
 
     def collate(self, xy_pairs):
         X = self.preprocess_x([x for x, _ in xy_pairs])
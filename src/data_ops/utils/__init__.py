@@ -1,3 +1,6 @@
 from ._DataLoader import _DataLoader
 from .pad_tensors import pad_tensors
 from .dropout import dropout
+from .samplers import BucketBatchSampler, TokenBudgetBatchSampler, padding_efficiency
+from .prefetch import Prefetcher
+from .augmentation import SeedStream, ragged_offsets, ragged_dropout, ragged_permutation, segment_ids
@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+
+'''
+Batched data augmentation on ragged batches.
+
+A batch of jets is held as one flat array of constituents, all jets stacked
+one after the other, plus an offsets array: jet i owns rows
+offsets[i]:offsets[i+1]. Masks and permutations for the whole batch are drawn
+with a single call to the random generator instead of one call per jet.
+'''
+
+def ragged_offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+def segment_ids(offsets):
+    ''' segment_ids(offsets)[k] is the jet owning row k of the flat buffer.
+    '''
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def ragged_permutation(offsets, rng):
+    ''' Index array that shuffles the rows of every jet, keeping jets in place.
+    '''
+    jet = segment_ids(offsets)
+    return np.lexsort((rng.random(len(jet)), jet))
+
+def ragged_dropout(offsets, keep_probability, rng):
+    ''' Boolean mask keeping each row with probability keep_probability.
+
+    Every non-empty jet keeps at least one row: the masks of jets that lost
+    all of their rows are redrawn, which samples from the same distribution
+    as redrawing until the mask is non-empty.
+    '''
+    lengths = np.diff(offsets)
+    jet = segment_ids(offsets)
+    keep = rng.random(len(jet)) < keep_probability
+    empty = np.flatnonzero((np.bincount(jet[keep], minlength=len(lengths)) == 0) & (lengths > 0))
+    while len(empty) > 0:
+        rows = np.concatenate([np.arange(offsets[i], offsets[i+1]) for i in empty])
+        keep[rows] = rng.random(len(rows)) < keep_probability
+        empty = empty[np.bincount(jet[rows][keep[rows]], minlength=len(lengths))[empty] == 0]
+    return keep
+
+class SeedStream:
+    '''
+    Reproducible random generators for augmentation, one per epoch and per
+    data loading process.
+
+    Generators are derived from (seed, epoch, worker id), so a run replays the
+    same masks and permutations for a given seed and number of workers, and
+    DataLoader workers, which are forked anew every epoch, never repeat the
+    draws of another worker or of a previous epoch.
+    '''
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = np.random.randint(2**31)
+        self.seed = seed
+        self.epoch = 0
+        self._rng = None
+
+    def next_epoch(self):
+        self.epoch += 1
+        self._rng = None
+
+    @property
+    def rng(self):
+        if self._rng is None:
+            worker = torch.utils.data.get_worker_info()
+            worker_id = 0 if worker is None else worker.id + 1
+            self._rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        return self._rng
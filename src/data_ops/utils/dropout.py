@@ -1,12 +1,15 @@
-
+import numpy as np
 import torch
 
-def dropout(tensor_list, dropout_probability):
-    data_dim = tensor_list[0].size()[1]
-    for i, x in enumerate(tensor_list):
-        dm = torch.bernoulli(torch.zeros(x.shape[0]).fill_(dropout_probability)).byte()
-        while dm.sum() == 0:
-            dm = torch.bernoulli(torch.zeros(x.shape[0]).fill_(dropout_probability)).byte()
-        tensor_list[i] = torch.masked_select(tensor_list[i], dm.unsqueeze(1).repeat(1, tensor_list[i].shape[1])).view(-1, data_dim)
+from .augmentation import ragged_offsets, ragged_dropout
 
-    return tensor_list
+def dropout(tensor_list, dropout_probability, rng=None):
+    ''' Keep each row of each tensor with probability dropout_probability,
+    always leaving at least one row per tensor.
+    '''
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(2**31))
+    offsets = ragged_offsets([len(x) for x in tensor_list])
+    keep = torch.from_numpy(ragged_dropout(offsets, dropout_probability, rng))
+    kept = torch.split(keep, np.diff(offsets).tolist())
+    return [x[k] for x, k in zip(tensor_list, kept)]
@@ -1,5 +1,4 @@
 import torch
-from src.data_ops.wrapping import wrap
 
 def pad_tensors(tensor_list):
     data = tensor_list
@@ -19,7 +18,6 @@ def pad_tensors(tensor_list):
         padded_data[i, :len_x, :data_dim] = x
         if len_x < max_seq_length:
             padded_data[i, len(x):, -1] = 1
-    padded_data = wrap(padded_data)
 
     mask = torch.ones(len(data), max_seq_length, max_seq_length)
     for i, x in enumerate(data):
@@ -27,6 +25,5 @@ def pad_tensors(tensor_list):
         if seq_length < max_seq_length:
             mask[i, seq_length:, :].fill_(0)
             mask[i, :, seq_length:].fill_(0)
-    mask = wrap(mask)
 
     return (padded_data, mask)
@@ -0,0 +1,69 @@
+import queue
+import threading
+
+from ..wrapping import wrap_batch
+
+_END = object()
+
+class Prefetcher:
+    '''
+    Iterate over a data loader from a background thread.
+
+    The thread pulls the next batches from the loader and moves them to the
+    device while the main thread runs forward and backward on the current
+    batch, so batch construction and host-to-device copies overlap with
+    compute. At most depth batches wait in the queue; depth=0 disables the
+    thread and moves each batch synchronously.
+    '''
+    def __init__(self, loader, depth=2):
+        self.loader = loader
+        self.depth = depth
+        self.non_blocking = getattr(loader, 'pin_memory', False)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for batch in self.loader:
+                yield wrap_batch(batch, self.non_blocking)
+            return
+
+        q = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            # give up as soon as the consumer stops, so that join() never hangs
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.loader:
+                    if not put(wrap_batch(batch, self.non_blocking)):
+                        return
+                put(_END)
+            except Exception as e:
+                put(e)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = q.get()
+                if batch is _END:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,128 @@
+import numpy as np
+from torch.utils.data import Sampler
+
+def padding_efficiency(lengths, batches):
+    ''' Fraction of the padded batch entries that hold real constituents.
+    '''
+    lengths = np.asarray(lengths)
+    real = sum(lengths[batch].sum() for batch in batches)
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches if len(batch) > 0)
+    return real / max(padded, 1)
+
+class BucketBatchSampler(Sampler):
+    '''
+    Batch sampler that groups items of similar length.
+
+    Each epoch the indices are shuffled and cut into pools of
+    bucket_pool * batch_size items. Each pool is sorted by length and cut into
+    batches, and the order of all batches is shuffled, so batches are
+    length-homogeneous but their order (and composition) changes every epoch.
+
+    With shuffle=False (for evaluation) all items are sorted by length as a
+    single pool and the batches come out in that order, identical each epoch.
+    '''
+    def __init__(self, lengths, batch_size, bucket_pool=50, drop_last=False, shuffle=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_pool = bucket_pool
+        self.drop_last = drop_last
+        self.shuffle = shuffle
+        self.batches = None
+
+    def permutation(self):
+        if self.shuffle:
+            return np.random.permutation(len(self.lengths))
+        return np.arange(len(self.lengths))
+
+    def shuffled(self, batches):
+        if not self.shuffle:
+            return batches
+        order = np.random.permutation(len(batches))
+        return [batches[i] for i in order]
+
+    def make_batches(self):
+        perm = self.permutation()
+        pool_size = self.batch_size * self.bucket_pool if self.shuffle else max(len(perm), 1)
+
+        batches = []
+        for i in range(0, len(perm), pool_size):
+            pool = perm[i:i+pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches.extend(pool[j:j+self.batch_size] for j in range(0, len(pool), self.batch_size))
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+
+        return self.shuffled(batches)
+
+    def padding_efficiency(self):
+        if self.batches is None:
+            self.batches = self.make_batches()
+        return padding_efficiency(self.lengths, self.batches)
+
+    def __iter__(self):
+        self.batches = self.make_batches()
+        for batch in self.batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return int(np.ceil(len(self.lengths) / self.batch_size))
+
+BATCH_COSTS = dict(
+    # padded leaf batches cost B x N_max x N_max (adjacency and messages)
+    quadratic=lambda max_length, n_items, total_length: n_items * max_length ** 2,
+    # tree batches cost the total number of nodes
+    linear=lambda max_length, n_items, total_length: total_length,
+)
+
+class TokenBudgetBatchSampler(BucketBatchSampler):
+    '''
+    Batch sampler that packs items until a compute budget is reached.
+
+    Pools of pool_size items are sorted by length as in BucketBatchSampler, then
+    consumed greedily: an item joins the current batch as long as the cost
+    of the batch stays within budget. A batch always holds at least one item.
+    The number of batches therefore varies from epoch to epoch; len() returns
+    the number of batches of the upcoming epoch.
+    '''
+    def __init__(self, lengths, budget, cost='quadratic', pool_size=10000, shuffle=True):
+        super().__init__(lengths, batch_size=None, bucket_pool=None, shuffle=shuffle)
+        self.budget = budget
+        self.cost = BATCH_COSTS[cost]
+        self.pool_size = pool_size
+        self.next_batches = None
+
+    def make_batches(self):
+        perm = self.permutation()
+        pool_size = self.pool_size if self.shuffle else max(len(perm), 1)
+
+        batches = []
+        for i in range(0, len(perm), pool_size):
+            pool = perm[i:i+pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batch, max_length, total_length = [], 0, 0
+            for index in pool:
+                length = self.lengths[index]
+                if len(batch) > 0 and self.cost(max(max_length, length), len(batch) + 1, total_length + length) > self.budget:
+                    batches.append(np.array(batch))
+                    batch, max_length, total_length = [], 0, 0
+                batch.append(index)
+                max_length = max(max_length, length)
+                total_length += length
+            if len(batch) > 0:
+                batches.append(np.array(batch))
+
+        return self.shuffled(batches)
+
+    def __iter__(self):
+        if self.next_batches is None:
+            self.next_batches = self.make_batches()
+        self.batches, self.next_batches = self.next_batches, None
+        for batch in self.batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        if self.next_batches is None:
+            self.next_batches = self.make_batches()
+        return len(self.next_batches)
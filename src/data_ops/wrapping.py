@@ -8,6 +8,25 @@ def wrap(x):
     return x
 
 
+def wrap_batch(batch, non_blocking=False):
+    ''' Move every tensor of a collated batch to the GPU, if there is one.
+
+    Batches are nested tuples and lists of tensors, or of objects with a
+    cuda() method such as RaggedJetBatch (plus plain python values such as
+    the number of jets), built on the CPU by the data loaders. With
+    pinned host memory, non_blocking lets the copy overlap with compute.
+    '''
+    if torch.is_tensor(batch) or hasattr(batch, 'cuda'):
+        if torch.cuda.is_available():
+            batch = batch.cuda(non_blocking=non_blocking)
+        return batch
+    if isinstance(batch, tuple):
+        return tuple(wrap_batch(x, non_blocking) for x in batch)
+    if isinstance(batch, list):
+        return [wrap_batch(x, non_blocking) for x in batch]
+    return batch
+
+
 def unwrap(y_wrap):
     if y_wrap.is_cuda:
         y = y_wrap.cpu().data.numpy()
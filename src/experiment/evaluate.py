@@ -17,6 +17,7 @@ from ..misc.constants import *
 
 from ..data_ops.load_dataset import load_test_dataset
 from ..data_ops.wrapping import unwrap
+from ..data_ops.wrapping import wrap_batch
 from ..data_ops.jets.JetLoader import LeafJetLoader
 from ..data_ops.jets.JetLoader import TreeJetLoader
 
@@ -73,6 +74,7 @@ def evaluate(args):
                     #n_batches, remainder = np.divmod(len(X), batch_size)
                     #test_loss = []
                     for i, (x, y) in enumerate(test_data_loader):
+                        x, y = wrap_batch((x, y))
                         y_pred = model(x)
                         #l = unwrap(loss(y_pred, y)); test_loss.append(l)
                         y = unwrap(y); y_pred = unwrap(y_pred)
@@ -11,6 +11,7 @@ import numpy as np
 
 from ..data_ops.load_dataset import load_train_dataset
 from ..data_ops.wrapping import unwrap
+from ..data_ops.utils import Prefetcher
 from ..data_ops.jets.JetLoader import LeafJetLoader
 from ..data_ops.jets.JetLoader import TreeJetLoader
 
@@ -87,14 +88,31 @@ def train(
     '''----------------------------------------------------------------------- '''
     intermediate_dir, data_filename = DATASETS[data_args.dataset]
     data_dir = os.path.join(admin_args.data_dir, intermediate_dir)
-    train_dataset, valid_dataset = load_train_dataset(data_dir, data_filename, data_args.n_train, data_args.n_valid, data_args.pp, data_args.no_cropped)
+    train_dataset, valid_dataset = load_train_dataset(data_dir, data_filename, data_args.n_train, data_args.n_valid, data_args.pp, data_args.no_cropped, preprocessing_workers=data_args.preprocessing_workers, columnar=data_args.columnar)
 
     if model_args.model in ['recs', 'recg']:
         DataLoader = TreeJetLoader
     else:
         DataLoader = LeafJetLoader
-    train_data_loader = DataLoader(train_dataset, batch_size = training_args.batch_size, dropout=data_args.data_dropout, permute_particles=data_args.permute_particles)
-    valid_data_loader = DataLoader(valid_dataset, batch_size = training_args.batch_size, dropout=data_args.data_dropout, permute_particles=data_args.permute_particles)
+    loader_kwargs = dict(
+        dropout=data_args.data_dropout,
+        permute_particles=data_args.permute_particles,
+        bucketing=data_args.bucketing,
+        bucket_pool=data_args.bucket_pool,
+        batch_budget=training_args.batch_budget,
+        num_workers=data_args.num_workers,
+        prefetch_factor=data_args.prefetch_factor,
+        pin_memory=data_args.pin_memory,
+        seed=eh.seed,
+    )
+    # batches are collated on the CPU and moved to the device by a background
+    # thread, one step ahead of the training loop
+    train_data_loader = Prefetcher(DataLoader(train_dataset, batch_size = training_args.batch_size, **loader_kwargs), data_args.prefetch_factor)
+    # validation batches are bucketed deterministically, without shuffling,
+    # and not augmented: the same jets every epoch, which the per-jet caches
+    # can serve
+    valid_loader_kwargs = dict(loader_kwargs, dropout=None, permute_particles=False)
+    valid_data_loader = Prefetcher(DataLoader(valid_dataset, batch_size = training_args.batch_size, shuffle=False, **valid_loader_kwargs), data_args.prefetch_factor)
 
     ''' MODEL '''
     '''----------------------------------------------------------------------- '''
@@ -123,6 +141,15 @@ def train(
     def loss(y_pred, y):
         return F.binary_cross_entropy(y_pred.squeeze(1), y)
 
+    if training_args.batch_budget is not None:
+        # batches hold varying numbers of jets: normalise the summed loss by the
+        # average batch size so that every jet carries the same weight
+        jets_per_batch = len(train_dataset) / len(train_data_loader)
+        def train_loss_fn(y_pred, y):
+            return loss(y_pred, y) * len(y) / jets_per_batch
+    else:
+        train_loss_fn = loss
+
     def validation(epoch, model, **train_dict):
 
             t0 = time.time()
@@ -130,15 +157,23 @@ def train(
 
             valid_loss = 0.
             yy, yy_pred = [], []
+            # message passing depth of each jet, with --early_exit
+            adaptive = getattr(model.transform, 'early_exit', None) is not None
+            depths = []
             for i, (x, y) in enumerate(valid_data_loader):
                 y_pred = model(x)
-                vl = loss(y_pred, y); valid_loss += unwrap(vl)[0]
+                vl = loss(y_pred, y); valid_loss += unwrap(vl)[0] * len(y)
                 yv = unwrap(y); y_pred = unwrap(y_pred)
                 yy.append(yv); yy_pred.append(y_pred)
+                if adaptive:
+                    depths.append(unwrap(model.transform.depths))
+
+            if adaptive:
+                logging.info("Average message passing depth = {:.2f} of {}".format(np.concatenate(depths).mean(), model.transform.iters))
 
 
             #valid_loss.backward()
-            valid_loss /= len(valid_data_loader)
+            valid_loss /= len(valid_dataset)
 
             yy = np.concatenate(yy, 0)
             yy_pred = np.concatenate(yy_pred, 0)
@@ -167,7 +202,6 @@ def train(
     eh.save(model, settings)
     logging.warning("Training...")
     iteration=1
-    n_batches = len(train_data_loader)
 
     for i in range(training_args.epochs):
         logging.info("epoch = %d" % i)
@@ -176,6 +210,8 @@ def train(
         t0 = time.time()
 
         train_loss = 0.0
+        n_jets = 0
+        n_batches = len(train_data_loader)
         t_train = time.time()
 
         for j, (x, y) in enumerate(train_data_loader):
@@ -185,27 +221,31 @@ def train(
             model.train()
             optimizer.zero_grad()
             y_pred = model(x, logger=eh.stats_logger, epoch=i, iters=j, iters_left=n_batches-j-1)
-            l = loss(y_pred, y)
+            l = train_loss_fn(y_pred, y)
 
             # backward
             l.backward()
             if optim_args.clip is not None:
                 torch.nn.utils.clip_grad_norm(model.parameters(), optim_args.clip)
 
-            if iteration % n_batches == 0:
+            if j == n_batches - 1:
                 old_params = torch.cat([p.view(-1) for p in model.parameters()], 0)
                 grads = torch.cat([p.grad.view(-1) for p in model.parameters()], 0)
 
             optimizer.step()
 
-            if iteration % n_batches == 0:
+            if j == n_batches - 1:
                 new_params = torch.cat([p.view(-1) for p in model.parameters()], 0)
 
             train_loss += unwrap(l)[0]
+            n_jets += len(y)
 
         train_loss = train_loss / n_batches
         train_time = time.time() - t_train
-        logging.warning("Training {} batches took {:.1f} seconds at {:.1f} examples per second".format(n_batches, train_time, len(train_dataset)/train_time))
+        logging.warning("Training {} batches took {:.1f} seconds at {:.1f} jets per second".format(n_batches, train_time, n_jets/train_time))
+        efficiency = train_data_loader.padding_efficiency() if hasattr(train_data_loader, 'padding_efficiency') else None
+        if efficiency is not None:
+            logging.info("Padding efficiency = {:.1f}%".format(100 * efficiency))
 
         # validation
         t_valid = time.time()
@@ -32,26 +32,43 @@ def construct_model_kwargs(args):
         'matrix':args.adj[0] if len(args.adj) == 1 else args.adj,
         'activation':args.m_act,
         'wn': args.wn,
+        'engine': args.engine,
+        'masked_readout': args.masked_readout,
+        'pairwise_chunk': args.pairwise_chunk,
+        'checkpoint_mp': args.checkpoint_mp,
+        'early_exit': args.early_exit,
+        'combo_threads': args.combo_threads,
 
         # Stacked NMP
         'scales': args.scales,
         'pooling_layer':args.pool,
         'pool_first':args.pool_first,
+        'pool_k':args.pool_k,
 
         # Physics NMP
         'alpha':args.alpha,
         'R':args.R,
         'trainable_physics':args.trainable_physics,
+        'knn':args.knn,
+        'radius':args.radius,
+        'adjacency_cache':args.adjacency_cache,
+        'adjacency_cache_dir':args.adjacency_cache_dir,
 
         # Physics plus learned NMP
         #'physics_component':args.physics_component,
         'learned_tradeoff':not args.equal_weight,
 
+        # Recursive
+        'tree_iters':args.tree_iters,
+        'compile_trees':args.compile_trees,
+
         # Transformer
         'n_heads':args.n_heads,
         'n_layers':args.n_layers,
         'dq':args.dq,
         'dv':args.dv,
+        'attention':args.attention,
+        'landmarks':args.landmarks,
         'dropout':args.model_dropout
     }
     return model_kwargs
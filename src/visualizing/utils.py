@@ -23,8 +23,7 @@ def ensure_numpy_float(one_d_tensor):
         tensor = tensor.float()
     if isinstance(tensor, torch.Tensor):
         assert np.prod([s for s in tensor.size()]) == 1
-        tensor = tensor.squeeze()
-        tensor = tensor.numpy()[0]
+        tensor = tensor.reshape(-1).numpy()[0]
     if isinstance(tensor, float) or isinstance(tensor, int):
         tensor = np.float32(tensor)
     assert isinstance(tensor, np.float32)
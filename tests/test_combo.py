@@ -0,0 +1,85 @@
+'''
+ComboAdjacency: components reading the PairwiseFeatures shared by the
+combination must compute what they compute on their own, and running them
+on the thread pool must not change the result.
+'''
+import os
+import types
+
+import numpy as np
+import pytest
+import torch
+
+from src.architectures.jet_transforms.nmp.adjacency.simple import SIMPLE_ADJACENCIES
+from src.architectures.jet_transforms.nmp.fixed_nmp.fixed_nmp import FixedNMP
+from src.architectures.jet_transforms.nmp.adjacency.simple.pairwise_features import PairwiseFeatures
+from src.data_ops.jets.RaggedJetBatch import RaggedJetBatch
+
+ADJACENCY_KWARGS = dict(dim_in=8, wn=False, symmetric=True, activation='soft', alpha=1, R=1)
+
+def random_batch(lengths=(3, 7, 5), seed=0):
+    rng = np.random.RandomState(seed)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    constituents = rng.randn(offsets[-1], 7)
+    constituents[:, 0] = np.abs(constituents[:, 0]) + 0.1
+    # a duplicated constituent: siamese pairs at zero distance
+    constituents[1] = constituents[0]
+    return RaggedJetBatch(torch.from_numpy(constituents), offsets)
+
+@pytest.mark.parametrize('matrix', ['phy', 'dm', 'siam', 'sum'])
+def test_shared_raw_matrix(matrix):
+    torch.manual_seed(0)
+    adjacency = SIMPLE_ADJACENCIES[matrix](**ADJACENCY_KWARGS).double()
+    h = random_batch().padded
+    torch.testing.assert_close(adjacency.shared_raw_matrix(h, PairwiseFeatures(h)), adjacency.raw_matrix(h), rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('matrix', ['phy', 'dm', 'siam', 'sum'])
+def test_shared_raw_edges(matrix):
+    torch.manual_seed(0)
+    adjacency = SIMPLE_ADJACENCIES[matrix](**ADJACENCY_KWARGS).double()
+    batch = random_batch()
+    h = batch.nodes
+    rows, cols = batch.edges
+    torch.testing.assert_close(adjacency.shared_raw_edges(h, rows, cols, PairwiseFeatures(h)), adjacency.raw_edges(h, rows, cols), rtol=1e-10, atol=1e-12)
+
+def test_entries_are_shared():
+    batch = random_batch()
+    rows, cols = batch.edges
+    pairwise = PairwiseFeatures(batch.nodes)
+    assert pairwise.edge_nodes(rows, cols)[0] is pairwise.edge_nodes(rows, cols)[0]
+    pairwise.edge_delta_r(rows, cols)
+    pairwise.edge_gram(rows, cols)
+    # the gathered ends are computed once for delta_r, the gram and the components
+    assert len([key for key in pairwise._cache if key[0] == 'edge_nodes']) == 1
+    padded = PairwiseFeatures(batch.padded)
+    assert padded.gram is padded.gram
+    assert [key for key in padded._cache] == ['transposed', 'gram']
+
+def build_combo(combo_threads, plotsdir, learned_tradeoff):
+    torch.manual_seed(0)
+    return FixedNMP(
+        features=8, hidden=16, iters=2, readout='dtnn', matrix=['phy', 'dm'],
+        emb_init='1', mp_layer='simple', act='leakyrelu', wn=False, update='gru',
+        message='2', symmetric=True, activation='soft', alpha=1, R=1,
+        trainable_physics=False, knn=None, radius=None, learned_tradeoff=learned_tradeoff,
+        combo_threads=combo_threads, logger=types.SimpleNamespace(plotsdir=plotsdir),
+        logging_frequency=1,
+    ).double()
+
+@pytest.mark.parametrize('learned_tradeoff', [True, False])
+def test_thread_pool(tmp_path, learned_tradeoff):
+    batch = random_batch(lengths=(3, 7, 5, 1, 7))
+    results = []
+    for combo_threads in [0, 2]:
+        plotsdir = str(tmp_path / str(combo_threads))
+        model = build_combo(combo_threads, plotsdir, learned_tradeoff)
+        # epoch 0, iteration 0: every component logs and plots, from the
+        # pool threads when combo_threads > 1
+        out = model(batch.padded, mask=batch.mask, node_mask=batch.node_mask, epoch=0, iters=0)
+        out.sum().backward()
+        results.append((out, [p.grad for p in model.parameters()]))
+        assert os.path.isdir(os.path.join(plotsdir, 'epoch-0'))
+    (out_serial, grads_serial), (out_threads, grads_threads) = results
+    torch.testing.assert_close(out_threads, out_serial, rtol=1e-10, atol=1e-12)
+    for grad_threads, grad_serial in zip(grads_threads, grads_serial):
+        torch.testing.assert_close(grad_threads, grad_serial, rtol=1e-10, atol=1e-12)
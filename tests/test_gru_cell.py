@@ -0,0 +1,44 @@
+'''
+FusedGRUCell, whose pointwise step has a hand-written backward, against
+the autograd AnyBatchGRUCell with the same weights.
+'''
+import pytest
+import torch
+
+from src.architectures.utils.any_batch_gru_cell import AnyBatchGRUCell, FusedGRUCell, FusedGRUStep
+
+def build(dtype):
+    torch.manual_seed(0)
+    reference = AnyBatchGRUCell(5, 4).to(dtype)
+    fused = FusedGRUCell(5, 4).to(dtype)
+    fused.load_state_dict(reference.state_dict())
+    return reference, fused
+
+@pytest.mark.parametrize('shape', [(7,), (3, 6), (2, 3, 4)])
+@pytest.mark.parametrize('dtype', [torch.float32, torch.float64])
+def test_parity(shape, dtype):
+    reference, fused = build(dtype)
+    i = torch.randn(*shape, 5, dtype=dtype, requires_grad=True)
+    h = torch.randn(*shape, 4, dtype=dtype, requires_grad=True)
+    out_reference, out_fused = reference(i, h), fused(i, h)
+    tolerance = dict(rtol=1e-5, atol=1e-6) if dtype == torch.float32 else dict(rtol=1e-10, atol=1e-12)
+    torch.testing.assert_close(out_fused, out_reference, **tolerance)
+
+    grad = torch.randn_like(out_reference)
+    expected = torch.autograd.grad(out_reference, [i, h] + list(reference.parameters()), grad)
+    grads = torch.autograd.grad(out_fused, [i, h] + list(fused.parameters()), grad)
+    for g, e in zip(grads, expected):
+        torch.testing.assert_close(g, e, **tolerance)
+
+def test_gradcheck():
+    torch.manual_seed(0)
+    gi = torch.randn(6, 12, dtype=torch.float64, requires_grad=True)
+    gh = torch.randn(6, 12, dtype=torch.float64, requires_grad=True)
+    h = torch.randn(6, 4, dtype=torch.float64, requires_grad=True)
+    assert torch.autograd.gradcheck(FusedGRUStep.apply, (gi, gh, h))
+
+def test_cell_gradcheck():
+    _, fused = build(torch.float64)
+    i = torch.randn(3, 5, dtype=torch.float64, requires_grad=True)
+    h = torch.randn(3, 4, dtype=torch.float64, requires_grad=True)
+    assert torch.autograd.gradcheck(fused, (i, h))
@@ -0,0 +1,48 @@
+'''
+LeafJetLoader and the per-jet adjacency cache: unaugmented batches keep
+their jet indices, so that the physics adjacency of a jet is computed on
+the first epoch and read back from the cache on the next ones.
+'''
+import numpy as np
+import pytest
+import torch
+
+from src.architectures.jet_transforms.nmp.adjacency.simple.physics import FixedPhysicsAdjacency
+from src.data_ops.jets.Jet import Jet
+from src.data_ops.jets.JetDataset import JetDataset
+from src.data_ops.jets.JetLoader import LeafJetLoader
+
+def random_dataset(n_jets=12, seed=0):
+    rng = np.random.RandomState(seed)
+    jets = []
+    for i in range(n_jets):
+        constituents = rng.randn(rng.randint(2, 9), 7).astype(np.float32)
+        constituents[:, 0] = np.abs(constituents[:, 0]) + 0.1
+        jets.append(Jet(constituents=constituents, y=i % 2, index=i))
+    return JetDataset(jets)
+
+def run_epochs(loader, n_epochs=2):
+    adjacency = FixedPhysicsAdjacency(alpha=1, R=1, symmetric=True, activation='soft', adjacency_cache=1)
+    hits = []
+    for epoch in range(n_epochs):
+        before = adjacency.cache.hits
+        for x, y in loader:
+            adjacency(x.padded, x.mask, batch=x)
+        hits.append(adjacency.cache.hits - before)
+    return adjacency.cache, hits
+
+@pytest.mark.parametrize('dropout', [None, 1.0])
+def test_cache_hits_without_augmentation(dropout):
+    dataset = random_dataset()
+    cache, hits = run_epochs(LeafJetLoader(dataset, batch_size=5, dropout=dropout, seed=0))
+    assert hits == [0, len(dataset)]
+    assert len(cache) == len(dataset)
+
+@pytest.mark.parametrize('augmentation', [dict(dropout=.9), dict(permute_particles=True)])
+def test_cache_bypassed_with_augmentation(augmentation):
+    dataset = random_dataset()
+    loader = LeafJetLoader(dataset, batch_size=5, seed=0, **augmentation)
+    assert all(x.indices is None for x, y in loader)
+    cache, hits = run_epochs(loader)
+    assert hits == [0, 0]
+    assert len(cache) == 0
@@ -0,0 +1,105 @@
+'''
+Parity of the packed engine with the dense one: the same FixedNMP weights,
+run on the padded views of a RaggedJetBatch or on its packed nodes, must
+give the same outputs and the same parameter gradients.
+'''
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from src.architectures.jet_transforms.nmp.fixed_nmp.fixed_nmp import FixedNMP
+from src.data_ops.jets.RaggedJetBatch import RaggedJetBatch
+
+FEATURES = 7
+
+def random_batch(lengths, seed=0):
+    rng = np.random.RandomState(seed)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    constituents = torch.from_numpy(rng.randn(offsets[-1], FEATURES)).float()
+    # physics adjacencies read pt from the first column
+    constituents[:, 0] = constituents[:, 0].abs() + 0.1
+    return RaggedJetBatch(constituents, offsets)
+
+def build(engine, **kwargs):
+    torch.manual_seed(0)
+    model_kwargs = dict(
+        features=FEATURES + 1, hidden=16, iters=3, readout='dtnn', matrix='phy',
+        emb_init='1', mp_layer='simple', act='leakyrelu', wn=False, update='gru',
+        message='2', symmetric=True, activation='soft', alpha=1, R=1,
+        trainable_physics=False, knn=None, radius=None, masked_readout=True,
+    )
+    model_kwargs.update(kwargs)
+    return FixedNMP(engine=engine, **model_kwargs)
+
+def run_both(batch, **kwargs):
+    dense = build('dense', **kwargs)
+    packed = copy.deepcopy(dense)
+    packed.engine = 'packed'
+
+    out_dense = dense(batch.padded, mask=batch.mask, node_mask=batch.node_mask, batch=batch)
+    out_packed = packed(batch)
+    out_dense.sum().backward()
+    out_packed.sum().backward()
+    return dense, packed, out_dense, out_packed
+
+def assert_parity(dense, packed, out_dense, out_packed):
+    torch.testing.assert_close(out_packed, out_dense, rtol=1e-5, atol=1e-6)
+    for (name, p_dense), p_packed in zip(dense.named_parameters(), packed.parameters()):
+        if p_dense.grad is None:
+            assert p_packed.grad is None, name
+            continue
+        torch.testing.assert_close(p_packed.grad, p_dense.grad, rtol=1e-4, atol=1e-6, msg=name)
+
+LENGTHS = [1, 5, 12, 3, 8, 12]
+
+@pytest.mark.parametrize('matrix', ['phy', 'one', 'eye', 'sum', 'dm', 'siam'])
+def test_simple_adjacencies(matrix):
+    assert_parity(*run_both(random_batch(LENGTHS), matrix=matrix))
+
+@pytest.mark.parametrize('matrix', [['phy', 'sum'], ['one', 'dm', 'siam'], ['phy', 'eye']])
+@pytest.mark.parametrize('learned_tradeoff', [True, False])
+def test_combos(matrix, learned_tradeoff):
+    assert_parity(*run_both(random_batch(LENGTHS), matrix=matrix, learned_tradeoff=learned_tradeoff))
+
+@pytest.mark.parametrize('sparsity', [dict(knn=3), dict(radius=1.5)])
+def test_sparse_physics_dense(sparsity):
+    with pytest.raises(ValueError):
+        build('dense', **sparsity)
+
+@pytest.mark.parametrize('sparsity', [dict(knn=max(LENGTHS)), dict(radius=100.)])
+def test_sparse_physics(sparsity):
+    # neighbourhoods covering whole jets: the packed model of the full adjacency
+    batch = random_batch(LENGTHS)
+    sparse = build('packed', **sparsity)
+    full = build('packed')
+    out_sparse = sparse(batch)
+    out_full = full(batch)
+    out_sparse.sum().backward()
+    out_full.sum().backward()
+    assert_parity(full, sparse, out_full, out_sparse)
+
+@pytest.mark.parametrize('update', ['gru', 'fused_gru'])
+def test_vertex_updates(update):
+    assert_parity(*run_both(random_batch(LENGTHS), update=update))
+
+@pytest.mark.parametrize('checkpoint_mp', [1, 2])
+def test_checkpoint_mp(checkpoint_mp):
+    assert_parity(*run_both(random_batch(LENGTHS), checkpoint_mp=checkpoint_mp))
+
+def test_uniform_lengths():
+    # no padding at all: the dense path does not depend on masking either
+    assert_parity(*run_both(random_batch([6, 6, 6]), matrix=['phy', 'sum']))
+
+@pytest.mark.parametrize('option', [
+    dict(mp_layer='attn'),
+    dict(activation='no_mask_softmax'),
+    dict(readout='set'),
+    dict(matrix='attn'),
+    dict(matrix=['phy', 'sum'], knn=3),
+    dict(matrix=['phy', 'sum'], radius=1.),
+])
+def test_unsupported_options(option):
+    with pytest.raises(ValueError, match=list(option)[-1]):
+        build('packed', **option)
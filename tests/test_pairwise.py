@@ -0,0 +1,109 @@
+'''
+The pairwise adjacencies against the (B, N, N, D) formulations they
+replaced: same values and same gradients, in float64.
+'''
+import pytest
+import torch
+
+from src.architectures.jet_transforms.nmp.adjacency.simple.learned import Sum, Attentional, Siamese
+from src.architectures.jet_transforms.nmp.message_passing.message_passing_layers import GraphAttentionalLayer
+from src.architectures.utils import pairwise_distance
+
+ADJACENCY_KWARGS = dict(wn=False, symmetric=False, activation='mask')
+
+def old_sum(adjacency, h):
+    shp = h.size()
+    h_l = h.view(shp[0], shp[1], 1, shp[2])
+    h_r = h.view(shp[0], 1, shp[1], shp[2])
+    return -adjacency.edge_embedding(h_l + h_r).squeeze(-1)
+
+def old_pair_concat(h, a):
+    shp = h.size()
+    h_i = h.view(shp[0], shp[1], 1, shp[2]).repeat(1, 1, shp[1], 1)
+    h_j = h.view(shp[0], 1, shp[1], shp[2]).repeat(1, shp[1], 1, 1)
+    h_cat = torch.cat([h_i, h_j], 3)
+    return torch.sum(h_cat * a, 3)
+
+def old_attentional(adjacency, h):
+    return old_pair_concat(adjacency.embedding(h), adjacency.a)
+
+def old_siamese(adjacency, h):
+    shp = h.size()
+    h_l = h.view(shp[0], shp[1], 1, shp[2])
+    h_r = h.view(shp[0], 1, shp[1], shp[2])
+    return -torch.norm(h_l - h_r, 2, 3)
+
+def random_h(batch_size=3, n=9, dim=5, duplicates=False, seed=0):
+    torch.manual_seed(seed)
+    h = torch.randn(batch_size, n, dim, dtype=torch.float64)
+    if duplicates:
+        # off-diagonal pairs at zero distance
+        h[:, 4] = h[:, 1]
+        h[:, 7] = h[:, 1]
+    return h
+
+def grads(fn, h, module, upstream):
+    h = h.clone().requires_grad_()
+    module.zero_grad()
+    out = fn(h)
+    out.backward(upstream)
+    return out.detach(), h.grad, [p.grad.clone() for p in module.parameters()]
+
+def assert_same(module, new, old, h):
+    torch.manual_seed(1)
+    upstream = torch.randn(h.size()[0], h.size()[1], h.size()[1], dtype=torch.float64)
+    out_new, dh_new, dp_new = grads(new, h, module, upstream)
+    out_old, dh_old, dp_old = grads(old, h, module, upstream)
+    torch.testing.assert_close(out_new, out_old, rtol=1e-12, atol=1e-12)
+    torch.testing.assert_close(dh_new, dh_old, rtol=1e-10, atol=1e-12)
+    for g_new, g_old in zip(dp_new, dp_old):
+        torch.testing.assert_close(g_new, g_old, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('pairwise_chunk', [None, 2, 4])
+def test_sum(pairwise_chunk):
+    adjacency = Sum(5, pairwise_chunk=pairwise_chunk, **ADJACENCY_KWARGS).double()
+    assert_same(adjacency, adjacency.raw_matrix, lambda h: old_sum(adjacency, h), random_h())
+
+def test_attentional():
+    torch.manual_seed(0)
+    adjacency = Attentional(5, 6, **ADJACENCY_KWARGS).double()
+    assert_same(adjacency, adjacency.forward, lambda h: old_attentional(adjacency, h), random_h())
+
+def test_graph_attentional_layer_scores():
+    torch.manual_seed(0)
+    layer = GraphAttentionalLayer(hidden=5, act='leakyrelu').double()
+    new = lambda h: layer.forward(h=h)
+    def old(h):
+        h_w = layer.W(h)
+        a_ij = torch.softmax(layer.activation(old_pair_concat(h_w, layer.a)), dim=2)
+        return layer.activation(torch.bmm(a_ij, h_w))
+    h = random_h()
+    upstream = torch.randn_like(h)
+    out_new, dh_new, dp_new = grads(new, h, layer, upstream)
+    out_old, dh_old, dp_old = grads(old, h, layer, upstream)
+    torch.testing.assert_close(out_new, out_old, rtol=1e-12, atol=1e-12)
+    torch.testing.assert_close(dh_new, dh_old, rtol=1e-10, atol=1e-12)
+    for g_new, g_old in zip(dp_new, dp_old):
+        torch.testing.assert_close(g_new, g_old, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('pairwise_chunk', [None, 1, 2, 4, 100])
+@pytest.mark.parametrize('duplicates', [False, True])
+def test_siamese(pairwise_chunk, duplicates):
+    adjacency = Siamese(5, pairwise_chunk=pairwise_chunk, **ADJACENCY_KWARGS).double()
+    h = random_h(duplicates=duplicates)
+    assert_same(adjacency, adjacency.raw_matrix, lambda h: old_siamese(adjacency, h), h)
+
+def test_siamese_edges():
+    adjacency = Siamese(5, **ADJACENCY_KWARGS).double()
+    h = random_h(batch_size=1, duplicates=True)
+    rows, cols = torch.meshgrid(torch.arange(h.size()[1]), torch.arange(h.size()[1]), indexing='ij')
+    torch.testing.assert_close(
+        adjacency.raw_edges(h[0], rows.reshape(-1), cols.reshape(-1)).view(h.size()[1], -1),
+        old_siamese(adjacency, h)[0], rtol=1e-12, atol=1e-12)
+
+def test_pairwise_distance_zero_distance():
+    h = random_h(duplicates=True).requires_grad_()
+    distances = pairwise_distance(h, chunk_size=3)
+    assert (distances[:, 1, 4] == 0).all() and (torch.diagonal(distances, dim1=1, dim2=2) == 0).all()
+    distances.sum().backward()
+    assert torch.isfinite(h.grad).all()
@@ -0,0 +1,79 @@
+'''
+knn and radius neighbourhoods of the physics adjacencies, found with a
+periodic KD-tree over the whole packed batch, against a brute-force search
+over the pairs of nodes of each jet.
+'''
+import math
+
+import numpy as np
+import pytest
+import torch
+
+from src.architectures.jet_transforms.nmp.adjacency.simple.physics import knn_edges, radius_edges
+from src.data_ops.jets.RaggedJetBatch import RaggedJetBatch
+
+def random_batch(lengths, seed=0, phi_wrap=False):
+    rng = np.random.RandomState(seed)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    constituents = rng.randn(offsets[-1], 7)
+    constituents[:, 0] = np.abs(constituents[:, 0]) + 0.1
+    constituents[:, 1] = rng.uniform(-1, 1, offsets[-1])
+    if phi_wrap:
+        # jets straddling phi = +-pi, on both sides of the cut
+        constituents[:, 2] = np.where(rng.rand(offsets[-1]) < 0.5, -math.pi, math.pi) + rng.uniform(-0.4, 0.4, offsets[-1])
+    else:
+        constituents[:, 2] = rng.uniform(-math.pi, math.pi, offsets[-1])
+    return RaggedJetBatch(torch.from_numpy(constituents), offsets)
+
+def brute_force_delta_r(batch):
+    ''' delta_r of all within-jet pairs, as a list of (n_i, n_i) arrays. '''
+    p = batch.constituents.numpy()
+    out = []
+    for start, end in zip(batch.offsets[:-1].tolist(), batch.offsets[1:].tolist()):
+        eta, phi = p[start:end, 1], p[start:end, 2]
+        delta_phi = np.abs(phi[:, None] - phi[None, :]) % (2 * math.pi)
+        delta_phi = np.minimum(delta_phi, 2 * math.pi - delta_phi)
+        out.append(np.hypot(eta[:, None] - eta[None, :], delta_phi))
+    return out
+
+def as_set(rows, cols):
+    return set(zip(rows.tolist(), cols.tolist()))
+
+def assert_sorted(rows, cols):
+    key = rows * (int(cols.max()) + 1) + cols
+    assert (key[1:] > key[:-1]).all()
+
+LENGTHS = [1, 4, 9, 2, 13, 6]
+
+@pytest.mark.parametrize('phi_wrap', [False, True])
+@pytest.mark.parametrize('k', [1, 3, 8, 20])
+def test_knn_edges(k, phi_wrap):
+    batch = random_batch(LENGTHS, phi_wrap=phi_wrap)
+    rows, cols = knn_edges(batch.nodes, batch, k)
+    assert_sorted(rows, cols)
+    expected = set()
+    for offset, delta_r in zip(batch.offsets.tolist(), brute_force_delta_r(batch)):
+        for i, d in enumerate(delta_r):
+            expected.update((offset + i, offset + j) for j in np.argsort(d, kind='stable')[:k])
+    assert as_set(rows, cols) == expected
+
+@pytest.mark.parametrize('phi_wrap', [False, True])
+@pytest.mark.parametrize('radius', [0.3, 1., 10.])
+def test_radius_edges(radius, phi_wrap):
+    batch = random_batch(LENGTHS, phi_wrap=phi_wrap)
+    rows, cols = radius_edges(batch.nodes, batch, radius)
+    assert_sorted(rows, cols)
+    expected = set()
+    for offset, delta_r in zip(batch.offsets.tolist(), brute_force_delta_r(batch)):
+        i, j = np.nonzero(delta_r <= radius)
+        expected.update(zip((offset + i).tolist(), (offset + j).tolist()))
+    assert as_set(rows, cols) == expected
+
+def test_phi_wrap_neighbours():
+    # two nodes 0.2 apart across phi = pi, a third one far from both
+    constituents = torch.zeros(3, 7, dtype=torch.float64)
+    constituents[:, 0] = 1
+    constituents[:, 2] = torch.tensor([math.pi - 0.1, -math.pi + 0.1, 0.5])
+    batch = RaggedJetBatch(constituents, [0, 3])
+    assert as_set(*knn_edges(batch.nodes, batch, 2)) == {(0, 0), (0, 1), (1, 1), (1, 0), (2, 2), (2, 0)}
+    assert as_set(*radius_edges(batch.nodes, batch, 0.5)) == {(0, 0), (0, 1), (1, 0), (1, 1), (2, 2)}
@@ -0,0 +1,52 @@
+'''
+TopKAttentionPooling on padded batches: padded nodes never take one of the
+pool_k slots, and jets shorter than pool_k attend to their real nodes only.
+'''
+import types
+
+import torch
+import torch.nn.functional as F
+
+from src.architectures.jet_transforms.nmp.stacked_nmp.attention_pooling import TopKAttentionPooling
+from src.architectures.utils.attention import dot
+
+def build(tmp_path, nodes_out=3, hidden=6, pool_k=4):
+    torch.manual_seed(0)
+    return TopKAttentionPooling(nodes_out, hidden, pool_k=pool_k, logger=types.SimpleNamespace(plotsdir=str(tmp_path)))
+
+def test_padding_is_never_selected(tmp_path):
+    pool = build(tmp_path)
+    lengths = torch.tensor([2, 7, 4, 1])
+    node_mask = torch.arange(7).unsqueeze(0) < lengths.unsqueeze(1)
+    # large padded rows would win the top-k without the mask
+    h = torch.randn(4, 7, 6) + 10 * (~node_mask).unsqueeze(2).float()
+
+    new_hiddens, attns = pool(h, node_mask=node_mask)
+    dense = attns.to_dense()
+
+    assert not (dense != 0).masked_select(~node_mask.unsqueeze(1)).any()
+    nnz = torch.zeros(attns.size(), dtype=torch.long).index_put_(tuple(attns.indices()), torch.tensor(1), accumulate=True).sum(2)
+    assert (nnz == torch.clamp(lengths, max=pool.pool_k).unsqueeze(1)).all()
+    torch.testing.assert_close(dense.sum(2), torch.ones(4, 3))
+    torch.testing.assert_close(new_hiddens, torch.bmm(dense, h))
+
+def test_matches_masked_top_k_softmax(tmp_path):
+    pool = build(tmp_path)
+    lengths = torch.tensor([5, 7, 3])
+    node_mask = torch.arange(7).unsqueeze(0) < lengths.unsqueeze(1)
+    h = torch.randn(3, 7, 6)
+
+    _, attns = pool(h, node_mask=node_mask)
+
+    s = dot(pool.readout(h), h) * h.size()[1] ** 0.5
+    s = s.masked_fill(~node_mask.unsqueeze(1), float('-inf'))
+    threshold = s.topk(pool.pool_k, dim=2)[0][..., -1:]
+    expected = F.softmax(s.masked_fill(s < threshold, float('-inf')), dim=2)
+    torch.testing.assert_close(attns.to_dense(), expected)
+
+def test_without_mask_unchanged(tmp_path):
+    pool = build(tmp_path)
+    h = torch.randn(2, 5, 6)
+    _, attns = pool(h)
+    _, masked = pool(h, node_mask=torch.ones(2, 5, dtype=torch.bool))
+    torch.testing.assert_close(attns.to_dense(), masked.to_dense())
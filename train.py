@@ -49,6 +49,7 @@ loading.add_argument("-r", "--restart", help="restart a loaded model from where
 training = parser.add_argument_group('training')
 training.add_argument("-e", "--epochs", type=int, default=64)
 training.add_argument("-b", "--batch_size", type=int, default=128)
+training.add_argument("--batch_budget", type=int, default=None, help='pack batches up to this cost (B x N_max^2 for leaf models, total nodes for tree models) instead of a fixed batch size')
 training.add_argument("--experiment_time", type=int, default=1000000)
 
 '''
@@ -84,10 +85,17 @@ data = parser.add_argument_group('data')
 data.add_argument("-n", "--n_train", type=int, default=-1)
 data.add_argument("--n_valid", type=int, default=10000)
 data.add_argument("--dataset", type=str, default='w')
-data.add_argument("--data_dropout", type=float, default=.99)
+data.add_argument("--data_dropout", type=float, default=.99, help="probability of keeping each constituent of a training jet, 1 to disable the augmentation")
 data.add_argument("--pp", action='store_true', default=False)
 data.add_argument("--permute_particles", action='store_true')
 data.add_argument("--no_cropped", action='store_true')
+data.add_argument("--bucketing", action='store_true', default=False, help='batch together jets with similar numbers of constituents')
+data.add_argument("--bucket_pool", type=int, default=50, help='number of batches sorted together when bucketing')
+data.add_argument("--preprocessing_workers", type=int, default=0, help='number of processes used to preprocess raw data')
+data.add_argument("--columnar", action='store_true', default=False, help='load jets from a memory-mapped columnar store')
+data.add_argument("--num_workers", type=int, default=0, help='number of worker processes building batches')
+data.add_argument("--prefetch_factor", type=int, default=2, help='number of batches prepared ahead of the training loop')
+data.add_argument("--pin_memory", action='store_true', default=False, help='collate batches into page-locked memory for faster transfers to the GPU')
 
 '''
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -115,6 +123,12 @@ model.add_argument("--emb_init", type=str, default='1', help='type of message')
 model.add_argument("-a","--adj", type=str, nargs='+', default='phy', help='type of matrix layer')
 model.add_argument("--asym", action='store_true', default=False)
 model.add_argument("--readout", type=str, default='dtnn', help='type of readout layer')
+model.add_argument("--engine", type=str, default='dense', help='dense: padded B x N x N message passing, packed: edge lists over the real nodes of each jet')
+model.add_argument("--masked_readout", action='store_true', default=False, help='average the readout over the real nodes of each jet only (always on with --engine packed)')
+model.add_argument("--pairwise_chunk", type=int, default=None, help='compute pairwise distances of learned adjacencies over blocks of this many rows')
+model.add_argument("--checkpoint_mp", type=int, default=0, help='checkpoint the activations of message passing layers in groups of this many layers (0 disables)')
+model.add_argument("--early_exit", type=float, default=None, help='at inference, stop message passing on the jets whose hidden state changes by less than this fraction of its norm')
+model.add_argument("--combo_threads", type=int, default=0, help='evaluate the components of a combination of adjacencies (--adj a b ...) on this many CPU threads')
 model.add_argument("--m_act", type=str, default='soft', help='type of nonlinearity for matrices' )
 model.add_argument("--lf", type=int, default=20)
 model.add_argument("--wn", action='store_true')
@@ -123,20 +137,31 @@ model.add_argument("--wn", action='store_true')
 model.add_argument("--pool_first", action='store_true', default=False)
 model.add_argument("--scales", nargs='+', type=int, default=None)
 model.add_argument("--pool", type=str, default='attn', help='type of pooling layer')
+model.add_argument("--pool_k", type=int, default=8, help='topk pooling: number of fine nodes each coarse node attends to')
 
 # Physics NMP
 model.add_argument("-t", "--trainable_physics", action='store_true', default=False)
 model.add_argument("--alpha", type=float, default=1)
 model.add_argument("-R", type=float, default=1)
+model.add_argument("--knn", type=int, default=None, help='physics adjacency: only keep the k nearest nodes of each node in (eta, phi), with --engine packed')
+model.add_argument("--radius", type=float, default=None, help='physics adjacency: only keep pairs closer than this in (eta, phi), with --engine packed')
+model.add_argument("--adjacency_cache", type=float, default=0, help='MB of fixed physics adjacency matrices cached across epochs (0 disables)')
+model.add_argument("--adjacency_cache_dir", type=str, default=None, help='spill evicted cached adjacency matrices to this directory')
 
 # Physics plus learned NMP
 model.add_argument("--equal_weight", action='store_true', default=False)
 
+# Recursive
+model.add_argument("--tree_iters", type=int, default=0, help='number of top-down and bottom-up passes over the trees after the gated recursion')
+model.add_argument("--compile_trees", action='store_true', default=False, help='compile the level-wise tree recursion of the recursive models with torch.compile')
+
 # Transformer
 model.add_argument("--n_layers", type=int, default=3)
 model.add_argument("--n_heads", type=int, default=8)
 model.add_argument("--dq", type=int, default=32)
 model.add_argument("--dv", type=int, default=32)
+model.add_argument("--attention", type=str, default='exact', help='exact: per-head attention over all nodes, sdpa: fused masked attention, linear: kernelized O(N) attention, nystrom: landmark O(N) attention')
+model.add_argument("--landmarks", type=int, default=32, help='number of landmarks of nystrom attention')
 
 args = parser.parse_args()
 